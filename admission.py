@@ -0,0 +1,290 @@
+import asyncio
+import collections
+import logging
+import math
+import threading
+import time
+
+from PIL import Image
+
+from executor import BusyError
+
+logger = logging.getLogger(__name__)
+
+# Pillow хранит пиксель RGB, RGBA и CMYK в 4 байтах; для оценки памяти этого достаточно для любого режима
+BYTES_PER_PIXEL = 4
+# Копии исходного изображения, которые держит одна задача: декодированное изображение,
+# блок общей памяти для рабочего процесса и изображение в рабочем процессе
+INPUT_COPIES = 3
+# Копии результата: результат в рабочем процессе, блок общей памяти и результат в основном процессе
+OUTPUT_COPIES = 3
+# Операции, результат которых имеет размер исходного изображения, даже если оно декодировано уменьшенным
+FULL_SIZE_OUTPUTS = ('pixelate_image',)
+
+
+class ImageTooLargeError(Exception):
+    """
+    Изображение больше допустимого количества пикселей и не обрабатывается.
+    """
+
+
+# Резервирование памяти задачи
+class Reservation:
+    """
+    Память, выделенная одной задаче. Освобождается один раз вызовом release,
+    который можно передать в Future.add_done_callback.
+    """
+
+    __slots__ = ('_controller', 'nbytes', '_released')
+
+    def __init__(self, controller, nbytes):
+        self._controller = controller
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self, *args):
+        self._controller._release(self)
+
+
+# Контроль допуска задач по памяти
+class AdmissionController:
+    """
+    Не дает задачам обработки исчерпать память процесса.
+
+    Размер изображения проверяется по заголовку файла до декодирования:
+    изображения больше reject_pixels отклоняются (в том числе «бомбы
+    распаковки» - маленькие файлы с огромными размерами), а больше max_pixels
+    уменьшаются при декодировании. Оценка памяти каждой задачи резервируется
+    до декодирования и освобождается после обработки; пока сумма
+    резервирований превышает memory_bytes, новые задачи ждут своей очереди
+    (по порядку поступления), а не запускаются.
+    """
+
+    def __init__(self, max_pixels=25 * 1000 * 1000, reject_pixels=100 * 1000 * 1000,
+                 memory_bytes=1024 * 1024 * 1024, timeout=30.0):
+        """
+        Args:
+            max_pixels (int): Количество пикселей, до которого уменьшаются большие изображения.
+            reject_pixels (int): Количество пикселей, больше которого изображение отклоняется.
+            memory_bytes (int): Предел суммарной оценки памяти задач в работе.
+            timeout (float): Время ожидания памяти в секундах, после которого задача отклоняется.
+        """
+        self.max_pixels = max_pixels
+        self.reject_pixels = reject_pixels
+        self.memory_bytes = memory_bytes
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        # Очередь ожидающих задач: память получает только первая из них
+        self._waiters = collections.deque()
+        self._in_flight = 0
+        # Счетчики допущенных, уменьшенных и отклоненных изображений
+        self.admitted = 0
+        self.downscaled = 0
+        self.rejected = 0
+
+    @property
+    def in_flight_bytes(self):
+        """
+        Возвращает суммарную оценку памяти задач в работе.
+        """
+        with self._cond:
+            return self._in_flight
+
+    @property
+    def waiting(self):
+        """
+        Возвращает количество задач, ожидающих памяти.
+        """
+        with self._cond:
+            return len(self._waiters)
+
+    def check(self, size):
+        """
+        Отклоняет изображение больше reject_pixels по размеру из заголовка файла.
+
+        Args:
+            size (tuple): Ширина и высота исходного изображения.
+        """
+        width, height = size
+        if width * height > self.reject_pixels:
+            with self._cond:
+                self.rejected += 1
+            raise ImageTooLargeError(f"Изображение {width}x{height} больше {self.reject_pixels} пикселей")
+
+    def limit_size(self, size):
+        """
+        Проверяет размер изображения из заголовка файла (см. check).
+
+        Args:
+            size (tuple): Ширина и высота исходного изображения.
+
+        Returns:
+            tuple: Тот же размер или уменьшенный с сохранением пропорций до max_pixels.
+        """
+        self.check(size)
+        width, height = size
+        if width * height <= self.max_pixels:
+            return size
+        with self._cond:
+            self.downscaled += 1
+        limited = self._scale(size)
+        logger.info(f"Изображение {width}x{height} уменьшается до {limited[0]}x{limited[1]}")
+        return limited
+
+    def fit(self, image):
+        """
+        Уменьшает декодированное изображение до max_pixels, если масштаб
+        декодирования JPEG оставил его больше.
+
+        Args:
+            image (PIL.Image): Декодированное изображение.
+
+        Returns:
+            PIL.Image: То же или уменьшенное изображение.
+        """
+        if image.width * image.height <= self.max_pixels:
+            return image
+        return image.resize(self._scale(image.size), resample=Image.Resampling.BICUBIC)
+
+    def estimate(self, operation, source_size, decode_size=None):
+        """
+        Оценивает память задачи по размерам, не декодируя изображение.
+
+        Args:
+            operation (str): Название функции обработки.
+            source_size (tuple): Размер исходного изображения после limit_size.
+            decode_size (tuple): Размер декодирования из plan_decode (None - полный размер).
+
+        Returns:
+            int: Оценка памяти в байтах.
+        """
+        source_pixels = source_size[0] * source_size[1]
+        # Масштаб декодирования JPEG выбирается с запасом: до двух раз больше по каждой стороне
+        decoded = min(source_pixels, 4 * decode_size[0] * decode_size[1]) if decode_size else source_pixels
+        output = source_pixels if operation in FULL_SIZE_OUTPUTS else decoded
+        return BYTES_PER_PIXEL * (decoded * INPUT_COPIES + output * OUTPUT_COPIES)
+
+    def acquire(self, nbytes, timeout=None):
+        """
+        Резервирует память для задачи, дожидаясь, пока ее хватит.
+
+        Задача больше memory_bytes допускается, только когда других задач нет.
+
+        Args:
+            nbytes (int): Оценка памяти задачи.
+            timeout (float): Время ожидания в секундах (None - значение из настроек).
+
+        Returns:
+            Reservation: Резервирование, которое нужно освободить после обработки.
+        """
+        nbytes = min(nbytes, self.memory_bytes)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket or self._in_flight + nbytes > self.memory_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise BusyError("Недостаточно памяти для обработки изображения")
+                    self._cond.wait(remaining)
+                self._in_flight += nbytes
+                self.admitted += 1
+            finally:
+                self._waiters.remove(ticket)
+                # Следующая задача в очереди может поместиться в оставшуюся память
+                self._wake()
+        return Reservation(self, nbytes)
+
+    def stats(self):
+        """
+        Возвращает счетчики и текущую загрузку.
+
+        Returns:
+            dict: Статистика контроля допуска.
+        """
+        with self._cond:
+            return {
+                'in_flight_bytes': self._in_flight,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'downscaled': self.downscaled,
+                'rejected': self.rejected,
+            }
+
+    def _scale(self, size):
+        # Размер с сохранением пропорций, площадь которого не больше max_pixels
+        ratio = math.sqrt(self.max_pixels / (size[0] * size[1]))
+        return max(int(size[0] * ratio), 1), max(int(size[1] * ratio), 1)
+
+    def _release(self, reservation):
+        with self._cond:
+            if reservation._released:
+                return
+            reservation._released = True
+            self._in_flight -= reservation.nbytes
+            self._wake()
+
+    def _wake(self):
+        # Будим ожидающие задачи; вызывается под self._cond
+        self._cond.notify_all()
+
+
+# Задача, ожидающая памяти в цикле событий
+class _Ticket:
+    __slots__ = ('loop', 'wakeup')
+
+    def __init__(self, loop):
+        self.loop = loop
+        # Future цикла событий, которую завершает освобождение памяти
+        self.wakeup = None
+
+
+def _set_done(future):
+    # Future могла быть отменена по истечении времени ожидания
+    if not future.done():
+        future.set_result(None)
+
+
+# Контроль допуска задач по памяти для асинхронного бота
+class AsyncAdmissionController(AdmissionController):
+    """
+    Вариант AdmissionController для цикла событий: acquire - корутина, и
+    ожидающие памяти задачи не занимают потоки. Резервирование можно
+    освободить из любого потока, например в обратном вызове Future исполнителя.
+    """
+
+    async def acquire(self, nbytes, timeout=None):
+        nbytes = min(nbytes, self.memory_bytes)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        ticket = _Ticket(asyncio.get_running_loop())
+        with self._cond:
+            self._waiters.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    if self._waiters[0] is ticket and self._in_flight + nbytes <= self.memory_bytes:
+                        self._in_flight += nbytes
+                        self.admitted += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise BusyError("Недостаточно памяти для обработки изображения")
+                    ticket.wakeup = ticket.loop.create_future()
+                try:
+                    await asyncio.wait_for(ticket.wakeup, remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._waiters.remove(ticket)
+                self._wake()
+        return Reservation(self, nbytes)
+
+    def _wake(self):
+        # Память может получить только первая задача в очереди, поэтому будим только ее
+        if self._waiters and self._waiters[0].wakeup is not None:
+            ticket = self._waiters[0]
+            ticket.loop.call_soon_threadsafe(_set_done, ticket.wakeup)
@@ -0,0 +1,87 @@
+from functools import lru_cache
+
+
+# Функция для построения таблицы соответствия яркости и символов
+@lru_cache(maxsize=256)
+def build_ascii_table(ascii_chars):
+    """
+    Строит таблицу из 256 символов: индекс - яркость пикселя, значение - символ ASCII-арта.
+
+    Таблица кэшируется для каждого набора символов, поэтому повторные запросы
+    с тем же набором не пересчитывают ее.
+
+    Args:
+        ascii_chars (str): Набор символов для ASCII-арта (допускаются любые символы Unicode).
+
+    Returns:
+        tuple: Кортеж из 256 строк.
+    """
+    if not ascii_chars:
+        raise ValueError("Набор символов для ASCII-арта не должен быть пустым.")
+    count = len(ascii_chars)
+    # Та же формула, что и при попиксельном переборе: index = pixel * len(chars) // 256
+    return tuple(ascii_chars[value * count // 256] for value in range(256))
+
+
+@lru_cache(maxsize=256)
+def _build_plane_tables(ascii_chars):
+    # Таблицы для bytes.translate по каждому байту кода символа в UTF-32-LE.
+    # Для набора из символов Latin-1 достаточно одной таблицы (одного байта на символ).
+    table = build_ascii_table(ascii_chars)
+    if any(0xD800 <= ord(char) <= 0xDFFF for char in ascii_chars):
+        # Одиночные суррогаты не кодируются в UTF-32, для них остается str.translate
+        return None
+    codes = [ord(char) for char in table]
+    planes = 1 if max(codes) <= 0xFF else 4
+    return tuple(bytes((code >> (8 * plane)) & 0xFF for code in codes) for plane in range(planes))
+
+
+# Функция для преобразования пикселей в строку символов
+def pixels_to_text(image, ascii_chars):
+    """
+    Преобразует пиксели изображения в оттенках серого в строку символов по таблице.
+
+    Для однобайтовых наборов символов используется один bytes.translate. Для
+    многобайтового Unicode каждый байт кода символа в UTF-32 получается своим
+    bytes.translate, после чего байты чередуются срезами. Все пути работают на
+    уровне C без цикла по пикселям в Python.
+
+    Args:
+        image (PIL.Image): Изображение в режиме 'L'.
+        ascii_chars (str): Набор символов для ASCII-арта.
+
+    Returns:
+        str: Строка символов длиной ширина * высота.
+    """
+    # Сырые значения яркости, по одному байту на пиксель
+    data = image.tobytes()
+    planes = _build_plane_tables(ascii_chars)
+    if planes is None:
+        # Декодирование Latin-1 превращает каждый байт в символ с тем же кодом, который служит индексом таблицы
+        return data.decode('latin-1').translate(build_ascii_table(ascii_chars))
+    if len(planes) == 1:
+        return data.translate(planes[0]).decode('latin-1')
+    encoded = bytearray(len(data) * 4)
+    for index, plane in enumerate(planes):
+        encoded[index::4] = data.translate(plane)
+    return encoded.decode('utf-32-le')
+
+
+# Функция для разбиения строки символов на строки ASCII-арта
+def text_to_rows(text, width, max_rows=None):
+    """
+    Разбивает строку символов на строки заданной ширины и собирает их одним join.
+
+    Args:
+        text (str): Строка символов, полученная из pixels_to_text.
+        width (int): Ширина строки ASCII-арта.
+        max_rows (int): Максимальное количество строк (None - без ограничения).
+
+    Returns:
+        str: ASCII-арт, каждая строка которого завершается переводом строки.
+    """
+    end = len(text) if max_rows is None else min(max_rows * width, len(text))
+    rows = [text[i:i + width] for i in range(0, end, width)]
+    if not rows:
+        return ""
+    return "\n".join(rows) + "\n"
@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import handlers
+from config import (HTTP_POOL_SIZE, IO_THREADS, OUTBOUND_CHAT_BURST, OUTBOUND_CHAT_RATE, OUTBOUND_GLOBAL_RATE,
+                    OUTBOUND_GROUP_PER_MINUTE, OUTBOUND_MAX_RETRIES, SLOW_TRACE_DIR, SLOW_TRACE_SECONDS,
+                    SOURCE_CACHE_BYTES, SOURCE_CACHE_DECODED, SOURCE_CACHE_TTL, TRACE_SAMPLE_RATE)
+from admission import AsyncAdmissionController
+from handlers import Runtime, handle_photo, route_callback, route_message, start_metrics_server
+from helpers import get_token
+from log_utils import setup_logging
+from outbound import AsyncOutboundScheduler, throttle_bot
+from single_flight import AsyncSingleFlight
+from source_cache import AsyncSourceCache
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+# Среда выполнения обработчиков в цикле событий
+class AsyncRuntime(Runtime):
+    """
+    Выполняет обработчики в цикле событий: все чаты обслуживает один поток,
+    скачивание и ожидание памяти не занимают потоки, а декодирование,
+    кодирование и кэши результатов выполняются в небольшом пуле потоков.
+    """
+
+    flights_class = AsyncSingleFlight
+    admission_class = AsyncAdmissionController
+
+    def __init__(self, bot, outbound):
+        """
+        Создается в цикле событий бота.
+
+        Args:
+            bot (AsyncTeleBot): Экземпляр асинхронного бота.
+            outbound (AsyncOutboundScheduler): Планировщик исходящих запросов бота.
+        """
+        self.loop = asyncio.get_running_loop()
+        # Подтверждения и другие фоновые задачи: цикл событий хранит только слабые ссылки на задачи
+        self._tasks = set()
+        # Кэш скачанных исходных фотографий, общий для process_image и process_ascii_art
+        source_cache = AsyncSourceCache(handlers.download_photo, SOURCE_CACHE_BYTES, SOURCE_CACHE_TTL,
+                                        SOURCE_CACHE_DECODED)
+        super().__init__(bot, outbound, source_cache)
+
+    async def run_blocking(self, func, *args):
+        # Декодирование и работа с кэшами не должны блокировать цикл событий; текущий участок
+        # трассы передается в поток вместе с контекстом, чтобы вложенные вызовы попали в ту же трассу
+        return await self.loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+    async def wait(self, future):
+        # Дожидаемся результата исполнителя без блокировки цикла событий
+        return await asyncio.wrap_future(future)
+
+    async def wait_first(self, futures):
+        await asyncio.wait([asyncio.wrap_future(future) for future in futures],
+                           return_when=asyncio.FIRST_COMPLETED)
+
+    async def acquire(self, nbytes):
+        return await self.admission.acquire(nbytes)
+
+    async def coalesce(self, key, func, *args, scope=None):
+        return await self.flights.run(key, func, *args, scope=scope)
+
+    def start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def schedule(self, delay, callback):
+        self.loop.call_later(delay, callback)
+
+
+# Функция для создания бота
+def create_bot():
+    """
+    Читает токен и создает асинхронного бота с планировщиком исходящих запросов.
+
+    Returns:
+        tuple: Экземпляр асинхронного бота (AsyncTeleBot) и его планировщик (AsyncOutboundScheduler).
+    """
+    try:
+        # Вызываем функцию для чтения токена
+        token = get_token()
+        # Создаем экземпляр асинхронного бота с использованием токена
+        bot = AsyncTeleBot(token)
+    except Exception as e:
+        # Логируем ошибку, если чтение токена не удалось
+        logger.error(f"Ошибка при получении токена: {e}")
+        raise
+    # Все исходящие запросы ждут своей очереди в цикле событий
+    outbound = AsyncOutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+                                      OUTBOUND_GROUP_PER_MINUTE, OUTBOUND_MAX_RETRIES)
+    throttle_bot(bot, outbound)
+    return bot, outbound
+
+
+# Функция для запуска бота
+async def main():
+    """
+    Запускает асинхронного бота в режиме опроса сервера Telegram. Бот и
+    обработчики создаются здесь, а не при импорте: рабочие процессы
+    исполнителя запускаются через spawn и импортируют этот модуль заново.
+    """
+    # Небольшой пул потоков для декодирования, кодирования и кэшей
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=IO_THREADS))
+    bot, outbound = create_bot()
+    # Общие обработчики из handlers.py выполняются в цикле событий
+    runtime = AsyncRuntime(bot, outbound)
+    handlers.setup(runtime)
+    bot.register_message_handler(handle_photo, content_types=['photo'])
+    # Единственный обработчик текстовых сообщений и единственный обработчик запросов обратного вызова:
+    # обработчик команды или кнопки находится в словаре маршрутизатора
+    bot.register_message_handler(route_message, content_types=['text'])
+    bot.register_callback_query_handler(route_callback, func=lambda call: True)
+    # Сервер метрик работает в своем потоке и не занимает цикл событий
+    metrics_server = start_metrics_server()
+    try:
+        await bot.remove_webhook()
+    except Exception as e:
+        logger.error(f"Ошибка при удалении вебхука: {e}")
+    try:
+        await bot.polling(non_stop=True)
+    finally:
+        # Закрываем общий пул HTTP-соединений и останавливаем рабочие процессы
+        await bot.close_session()
+        runtime.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+# Запускаем бота только при прямом запуске файла: рабочие процессы исполнителя импортируют этот модуль повторно
+if __name__ == '__main__':
+    # Настройка логирования: записи выводятся отдельным потоком через очередь
+    setup_logging(logging.INFO, '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Настройки трассировки задаются в config.py
+    tracer.configure(TRACE_SAMPLE_RATE, SLOW_TRACE_SECONDS, SLOW_TRACE_DIR)
+    # Ограничиваем пул соединений aiohttp, который AsyncTeleBot использует для всех запросов
+    asyncio_helper.REQUEST_LIMIT = HTTP_POOL_SIZE
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        logger.error(f"Ошибка при запуске бота: {e}")
@@ -0,0 +1,68 @@
+"""
+Микробенчмарк преобразования пикселей в ASCII-арт.
+
+Сравнивает прежний попиксельный перебор с конкатенацией строк и табличный
+движок из ascii_engine на ширинах 40, 120 и 400 символов.
+
+Запуск из корня проекта:
+    python3 benchmarks/ascii_benchmark.py
+"""
+import os
+import sys
+import timeit
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ascii_engine import pixels_to_text, text_to_rows  # noqa: E402
+
+WIDTHS = (40, 120, 400)
+CHARSETS = {
+    'ascii': '@%#*+=-:. ',
+    'unicode': '█▓▒░ ',
+}
+
+
+# Прежняя реализация, сохраненная для сравнения
+def legacy_image_to_ascii(image, ascii_chars):
+    characters = ""
+    for pixel in image.getdata():
+        characters += ascii_chars[int(pixel * len(ascii_chars) // 256)]
+    width = image.width
+    ascii_art = ""
+    for i in range(0, len(characters), width):
+        ascii_art += characters[i:i + width] + "\n"
+    return ascii_art
+
+
+def engine_image_to_ascii(image, ascii_chars):
+    return text_to_rows(pixels_to_text(image, ascii_chars), image.width)
+
+
+def make_image(width):
+    # Шумное изображение в оттенках серого с пропорциями 4:3 и поправкой 0.55 на высоту символа
+    height = max(1, int(width * 0.75 * 0.55))
+    return Image.effect_noise((width, height), 64).convert('L')
+
+
+def measure(func, image, ascii_chars):
+    timer = timeit.Timer(lambda: func(image, ascii_chars))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    print(f"{'набор':<8} {'ширина':>6} {'прежний, мс':>12} {'движок, мс':>11} {'ускорение':>10}")
+    for name, ascii_chars in CHARSETS.items():
+        for width in WIDTHS:
+            image = make_image(width)
+            # Убеждаемся, что обе реализации дают одинаковый результат
+            assert legacy_image_to_ascii(image, ascii_chars) == engine_image_to_ascii(image, ascii_chars)
+            legacy = measure(legacy_image_to_ascii, image, ascii_chars)
+            engine = measure(engine_image_to_ascii, image, ascii_chars)
+            print(f"{name:<8} {width:>6} {legacy * 1000:>12.3f} {engine * 1000:>11.3f} {legacy / engine:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Сквозной нагрузочный тест бота на локальной замене Bot API.
+
+Запускает fake_bot_api.FakeBotApi и bot.py в отдельном процессе, направленный
+на него через telebot.apihelper.API_URL. Затем N одновременных чатов
+присылают фотографии, нажимают кнопки из get_options_keyboard и вводят
+наборы символов для ASCII-арта. Для каждого действия измеряется время от
+отправки обновления до ответа бота; в отчете - гистограммы задержек,
+перцентили и количество обновлений в секунду.
+
+Запуск из корня проекта:
+    python3 benchmarks/e2e_load.py --chats 20 --rounds 3 --output e2e.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+FAKE_TOKEN = '123456:FAKE-TOKEN-FOR-LOAD-TESTS'
+# Варианты размера фотографии, которые присылает Telegram: миниатюра, средний и исходный размер
+PHOTO_SIZES = ((90, 68), (320, 240), (1280, 960))
+ASCII_CHARSETS = ('@%#*+=-:. ', '█▓▒░ ', '#. ')
+# Границы корзин гистограммы задержек в миллисекундах
+HISTOGRAM_BOUNDS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+# Функция для запуска бота, направленного на локальный сервер (выполняется в дочернем процессе)
+def serve_bot(api_url, file_url):
+    import runpy
+
+    import telebot
+
+    import helpers
+    telebot.apihelper.API_URL = api_url
+    telebot.apihelper.FILE_URL = file_url
+    # bot.py читает токен при запуске; локальному серверу подходит любой токен правильного вида
+    helpers.get_token = lambda: FAKE_TOKEN
+    runpy.run_path(os.path.join(ROOT, 'bot.py'), run_name='__main__')
+
+
+def make_jpeg(size, seed):
+    random.seed(seed)
+    image = Image.effect_noise(size, 40 + random.randint(0, 40)).convert('RGB')
+    stream = io.BytesIO()
+    image.save(stream, format='JPEG', quality=85)
+    return stream.getvalue()
+
+
+def get_button_actions():
+    # Кнопки берем из той же клавиатуры, которую бот отправляет пользователю
+    from keyboards import get_options_keyboard
+    keyboard = get_options_keyboard()
+    return [button.callback_data for row in keyboard.keyboard for button in row]
+
+
+# Симуляция одного чата
+class ChatSimulator:
+    """
+    Отправляет обновления от имени одного чата и ждет ответов бота на них.
+    """
+
+    def __init__(self, api, chat_id, photos, actions, timeout, latencies, errors):
+        self.api = api
+        self.chat_id = chat_id
+        self.photos = photos
+        self.actions = actions
+        self.timeout = timeout
+        self.latencies = latencies
+        self.errors = errors
+        # Запросы бота в этот чат: (метод, параметры, время получения)
+        self.events = queue.Queue()
+        self._callback_ids = itertools.count(1)
+
+    def run(self, rounds):
+        for round_number in range(rounds):
+            photo = self._send_photo(round_number)
+            if photo is None:
+                continue
+            for action in self.actions:
+                self._press(action, photo)
+
+    def _send_photo(self, round_number):
+        sizes = self.photos[round_number % len(self.photos)]
+        # Уникальный ID на каждую фотографию, чтобы бот не отвечал из кэша результатов
+        unique = f"{self.chat_id}-{round_number}"
+        message = self._message(photo=[{'file_id': file_id, 'file_unique_id': f"{file_id}-{unique}",
+                                        'width': width, 'height': height}
+                                       for file_id, width, height in sizes])
+        started = self._push('message', message)
+        if self._wait(lambda method, params: method == 'sendMessage' and 'reply_markup' in params, 'photo',
+                      started):
+            return message
+        return None
+
+    def _press(self, action, photo):
+        callback = {'id': f"{self.chat_id}:{next(self._callback_ids)}", 'chat_instance': str(self.chat_id),
+                    'from': self._user(), 'data': action,
+                    'message': {'message_id': photo['message_id'], 'date': photo['date'],
+                                'chat': {'id': self.chat_id, 'type': 'private'}}}
+        started = self._push('callback_query', callback)
+        if action == 'ascii':
+            # Бот просит ввести набор символов; отвечаем и ждем готовый ASCII-арт
+            if not self._wait(lambda method, params: method == 'sendMessage', 'ascii_prompt', started):
+                return
+            self._push('message', self._message(text=random.choice(ASCII_CHARSETS)))
+            self._wait(lambda method, params: method == 'sendMessage' and params.get('text', '').startswith('```'),
+                       'ascii', started)
+        elif action == 'pipeline':
+            self._wait(lambda method, params: method == 'editMessageReplyMarkup', action, started)
+        else:
+            self._wait(lambda method, params: method in ('sendPhoto', 'sendDocument', 'sendMediaGroup',
+                                                               'editMessageMedia'),
+                       action, started)
+
+    def _wait(self, predicate, name, started):
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                method, params, received = self.events.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                self.errors.append((name, 'timeout'))
+                return False
+            if predicate(method, params):
+                self.latencies.setdefault(name, []).append(received - started)
+                return True
+            if method == 'sendMessage' and not params.get('text', '').startswith('```') and (
+                    'ошибка' in params.get('text', '') or 'занят' in params.get('text', '')):
+                self.errors.append((name, params['text']))
+                return False
+
+    def _push(self, kind, payload):
+        started = time.monotonic()
+        self.api.push_update(kind, payload)
+        return started
+
+    def _user(self):
+        return {'id': self.chat_id, 'is_bot': False, 'first_name': f"Load{self.chat_id}"}
+
+    def _message(self, **fields):
+        message = {'message_id': self.api.next_message_id(), 'date': int(time.time()), 'from': self._user(),
+                   'chat': {'id': self.chat_id, 'type': 'private'}}
+        message.update(fields)
+        return message
+
+
+def histogram(values_ms):
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in values_ms:
+        counts[next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if value <= bound),
+                    len(HISTOGRAM_BOUNDS_MS))] += 1
+    labels = [f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}"]
+    return dict(zip(labels, counts))
+
+
+def percentile(sorted_values, fraction):
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies):
+    summary = {}
+    for name, values in sorted(latencies.items()):
+        values_ms = sorted(value * 1000 for value in values)
+        summary[name] = {
+            'count': len(values_ms),
+            'p50_ms': percentile(values_ms, 0.5),
+            'p90_ms': percentile(values_ms, 0.9),
+            'p99_ms': percentile(values_ms, 0.99),
+            'max_ms': values_ms[-1],
+            'histogram_ms': histogram(values_ms),
+        }
+    return summary
+
+
+def print_report(report):
+    print(f"Чатов: {report['chats']}, обновлений: {report['updates']}, время: {report['elapsed_s']:.1f} с, "
+          f"{report['updates_per_s']:.1f} обновлений/с, ответов бота: {report['bot_requests']}, "
+          f"ошибок: {len(report['errors'])}")
+    for name, stats in report['latency'].items():
+        print(f"\n{name}: {stats['count']} ответов, p50 {stats['p50_ms']:.0f} мс, p90 {stats['p90_ms']:.0f} мс, "
+              f"p99 {stats['p99_ms']:.0f} мс, максимум {stats['max_ms']:.0f} мс")
+        largest = max(stats['histogram_ms'].values()) or 1
+        for label, count in stats['histogram_ms'].items():
+            print(f"  {label:>8} мс {'#' * round(40 * count / largest):<40} {count}")
+    for name, error in report['errors'][:10]:
+        print(f"Ошибка {name}: {error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chats', type=int, default=20, help='Количество одновременных чатов')
+    parser.add_argument('--rounds', type=int, default=3, help='Количество фотографий от каждого чата')
+    parser.add_argument('--actions', nargs='+', help='Нажимаемые кнопки (по умолчанию все кнопки клавиатуры)')
+    parser.add_argument('--timeout', type=float, default=120, help='Время ожидания ответа бота в секундах')
+    parser.add_argument('--output', help='Файл JSON для сохранения отчета')
+    parser.add_argument('--bot-log', help='Файл для журнала бота (по умолчанию журнал не сохраняется)')
+    parser.add_argument('--serve-bot', nargs=2, metavar=('API_URL', 'FILE_URL'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve_bot:
+        serve_bot(*args.serve_bot)
+        return 0
+
+    simulators = {}
+
+    def on_request(method, params, body_size):
+        # Ответ на нажатие кнопки адресован запросу: ID чата закодирован в ID запроса
+        chat_id = params.get('chat_id') or params.get('callback_query_id', '').split(':')[0]
+        simulator = simulators.get(int(chat_id)) if chat_id else None
+        if simulator is not None:
+            simulator.events.put((method, params, time.monotonic()))
+
+    api = FakeBotApi(on_request)
+    photos = []
+    for index in range(3):
+        sizes = []
+        for width, height in PHOTO_SIZES:
+            file_id = f"photo{index}_{width}"
+            api.add_file(file_id, make_jpeg((width, height), index))
+            sizes.append((file_id, width, height))
+        photos.append(sizes)
+    api.start()
+
+    actions = args.actions or get_button_actions()
+    latencies = {}
+    errors = []
+    for chat_id in range(1, args.chats + 1):
+        simulators[chat_id] = ChatSimulator(api, chat_id, photos, actions, args.timeout, latencies, errors)
+
+    log = open(args.bot_log, 'w') if args.bot_log else subprocess.DEVNULL
+    with tempfile.TemporaryDirectory() as workdir:
+        # Бот работает в отдельном процессе и во временном каталоге, чтобы не создавать файлы в проекте
+        bot_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-bot', api.api_url,
+                                        api.file_url], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            if not api.polling.wait(60):
+                print("Бот не начал опрос локального сервера")
+                return 1
+            started = time.monotonic()
+            threads = [threading.Thread(target=simulator.run, args=(args.rounds,))
+                       for simulator in simulators.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+        finally:
+            bot_process.terminate()
+            bot_process.wait()
+            api.shutdown()
+            if args.bot_log:
+                log.close()
+
+    updates = api.updates_pushed
+    report = {
+        'chats': args.chats,
+        'rounds': args.rounds,
+        'actions': actions,
+        'elapsed_s': elapsed,
+        'updates': updates,
+        'updates_per_s': updates / elapsed if elapsed else 0.0,
+        'bot_requests': dict(api.requests),
+        'bytes_from_bot': api.bytes_in,
+        'latency': summarize(latencies),
+        'errors': errors,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\nОтчет сохранен в {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
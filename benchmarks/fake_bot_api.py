@@ -0,0 +1,196 @@
+"""
+Локальная замена Bot API Telegram для нагрузочных испытаний бота.
+
+Поддерживает методы, которыми пользуется бот: getUpdates (с долгим опросом),
+getFile и скачивание файла, sendMessage, sendPhoto, sendDocument, sendMediaGroup,
+answerCallbackQuery, editMessageReplyMarkup, editMessageMedia, deleteMessage,
+sendChatAction, deleteWebhook и getMe. Обновления добавляются через push_update, а каждый
+ответ бота передается функции on_request.
+
+Бот направляется на сервер через telebot.apihelper.API_URL и FILE_URL:
+    telebot.apihelper.API_URL = server.api_url
+    telebot.apihelper.FILE_URL = server.file_url
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Обрыв соединения при остановке бота - не ошибка сервера
+        logger.debug(f"Ошибка соединения с {client_address[0]}", exc_info=True)
+
+
+# Локальный сервер Bot API
+class FakeBotApi:
+    """
+    Хранит очередь обновлений и файлы фотографий и отвечает на запросы бота
+    так же, как Bot API, но без обращения к Telegram.
+    """
+
+    def __init__(self, on_request=None, host='127.0.0.1', port=0):
+        """
+        Args:
+            on_request (function): Функция on_request(method, params, body_size), вызываемая
+                для каждого запроса бота, кроме getUpdates.
+            host (str): Адрес сервера.
+            port (int): Порт сервера (0 - любой свободный).
+        """
+        self.on_request = on_request
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._files = {}
+        self._cond = threading.Condition()
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name='fake-bot-api')
+        # Счетчики запросов по методам и принятых от бота байтов
+        self.requests = {}
+        self.bytes_in = 0
+        self.updates_pushed = 0
+        # Устанавливается при первом запросе getUpdates, то есть когда бот начал опрос
+        self.polling = threading.Event()
+
+    @property
+    def api_url(self):
+        """
+        Шаблон адреса методов для telebot.apihelper.API_URL.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    @property
+    def file_url(self):
+        """
+        Шаблон адреса файлов для telebot.apihelper.FILE_URL.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/file/bot{{0}}/{{1}}"
+
+    def start(self):
+        self._thread.start()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_file(self, file_id, data):
+        """
+        Регистрирует файл, который бот сможет получить через getFile и скачать.
+        """
+        self._files[file_id] = data
+
+    def push_update(self, kind, payload):
+        """
+        Добавляет обновление в очередь getUpdates.
+
+        Args:
+            kind (str): Тип обновления ('message' или 'callback_query').
+            payload (dict): Объект сообщения или запроса обратного вызова.
+
+        Returns:
+            int: update_id добавленного обновления.
+        """
+        with self._cond:
+            update_id = next(self._update_ids)
+            self.updates_pushed += 1
+            self._updates.append({'update_id': update_id, kind: payload})
+            self._cond.notify_all()
+        return update_id
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+    def _get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        deadline = time.monotonic() + float(params.get('timeout', 0))
+        with self._cond:
+            # Подтвержденные ботом обновления (меньше offset) больше не выдаются
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._updates[:limit]
+
+    def _message(self, params):
+        chat_id = int(params.get('chat_id', 0))
+        return {'message_id': self.next_message_id(), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'}}
+
+    def _call(self, method, params, body_size):
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        with self._cond:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.bytes_in += body_size
+        if self.on_request is not None:
+            self.on_request(method, params, body_size)
+        if method == 'getFile':
+            file_id = params['file_id']
+            if file_id not in self._files:
+                return None
+            return {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': len(self._files[file_id]),
+                    'file_path': f"photos/{file_id}.jpg"}
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method in ('answerCallbackQuery', 'deleteMessage', 'deleteWebhook', 'setWebhook', 'sendChatAction'):
+            return True
+        if method == 'sendMediaGroup':
+            return [self._message(params) for _ in json.loads(params.get('media', '[]'))]
+        return self._message(params)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                parts = url.path.strip('/').split('/')
+                if parts[0] == 'file':
+                    # /file/bot<token>/photos/<file_id>.jpg
+                    data = server._files.get(parts[-1].rsplit('.', 1)[0])
+                    self._reply(200 if data is not None else 404, data or b'', 'image/jpeg')
+                    return
+                params = dict(parse_qsl(url.query))
+                if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update(parse_qsl(body.decode('utf-8')))
+                result = server._call(parts[-1], params, len(body))
+                if result is None:
+                    payload = {'ok': False, 'error_code': 400, 'description': 'Bad Request: file not found'}
+                    self._reply(400, json.dumps(payload).encode('utf-8'))
+                    return
+                self._reply(200, json.dumps({'ok': True, 'result': result}).encode('utf-8'))
+
+            def _reply(self, status, data, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
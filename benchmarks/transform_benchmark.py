@@ -0,0 +1,268 @@
+"""
+Бенчмарк функций обработки изображений из image_ops.
+
+Запускает пикселизацию, ASCII-арт, инверсию, отражение, тепловую карту и
+стикер на сгенерированных изображениях от 320x240 до 4096x4096 в режимах
+RGB, RGBA, L и P. Для каждого случая выводит перцентили задержки, пропускную
+способность и пиковый прирост памяти, сохраняет результаты в JSON и, если
+указан базовый файл, отмечает случаи, ставшие медленнее или тяжелее.
+
+Запуск из корня проекта:
+    python3 benchmarks/transform_benchmark.py --output results.json
+    python3 benchmarks/transform_benchmark.py --baseline results.json --output new.json
+
+При найденных регрессиях скрипт завершается с кодом 1.
+"""
+import argparse
+import ctypes
+import io
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import sys
+import time
+
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_ops  # noqa: E402
+
+SIZES = ((320, 240), (640, 480), (1280, 960), (1920, 1080), (2560, 1920), (4096, 4096))
+MODES = ('RGB', 'RGBA', 'L', 'P')
+
+# Случаи бенчмарка: название -> функция, получающая исходное изображение
+CASES = {
+    'pixelate_image': lambda image: image_ops.pixelate_image(image, 20),
+    'image_to_ascii': lambda image: image_ops.image_to_ascii(_encode_png(image)),
+    'pixels_to_ascii': lambda image: image_ops.pixels_to_ascii(image.convert('L')),
+    'invert_colors': lambda image: image_ops.invert_colors(image),
+    'mirror_image': lambda image: image_ops.mirror_image(image, 'horizontal'),
+    'convert_to_heatmap': lambda image: image_ops.convert_to_heatmap(image),
+    'convert_to_heatmap_viridis': lambda image: image_ops.convert_to_heatmap(image, 'viridis'),
+    'resize_for_sticker': lambda image: image_ops.resize_for_sticker(image),
+}
+
+# Пороги по умолчанию: регрессия - медиана медленнее базовой на 15% или пик памяти больше на 15% и 1 МБ
+DEFAULT_TIME_THRESHOLD = 0.15
+DEFAULT_MEMORY_THRESHOLD = 0.15
+MEMORY_SLACK_BYTES = 1024 * 1024
+
+
+def _encode_png(image):
+    # image_to_ascii принимает поток с файлом; PNG сохраняет любой из режимов без потерь
+    stream = io.BytesIO()
+    image.save(stream, format='PNG', compress_level=1)
+    stream.seek(0)
+    return stream
+
+
+def make_image(size, mode):
+    # Шум с плавным градиентом: сжимается и обрабатывается как фотография, а не как однотонная заливка
+    noise = Image.effect_noise(size, 48)
+    gradient = Image.linear_gradient('L').resize(size)
+    gray = Image.blend(noise, gradient, 0.5)
+    if mode == 'L':
+        return gray
+    bands = [gray, gray.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gray.transpose(Image.Transpose.FLIP_TOP_BOTTOM)]
+    if mode == 'RGBA':
+        bands.append(gradient)
+    if mode == 'P':
+        return Image.merge('RGB', bands).quantize(256)
+    return Image.merge(mode, bands)
+
+
+# Измерение пикового прироста памяти процесса
+class PeakMemory:
+    """
+    На Linux сбрасывает пиковый RSS процесса (VmHWM) через /proc/self/clear_refs
+    и измеряет, насколько он вырос за время измерения. Это учитывает буферы
+    Pillow, которые выделяются вне аллокатора Python и не видны tracemalloc.
+    На других системах используется ru_maxrss, который нельзя сбросить, поэтому
+    прирост виден, только если превышает прежний пик процесса.
+    """
+
+    def __init__(self):
+        self.resettable = False
+        self.start = 0
+        self.peak = 0
+
+    def __enter__(self):
+        self.resettable = self._reset()
+        self.start = self._read('VmRSS') if self.resettable else self._maxrss()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = self._read('VmHWM') if self.resettable else self._maxrss()
+        self.peak = max(end - self.start, 0)
+
+    @staticmethod
+    def _reset():
+        try:
+            with open('/proc/self/clear_refs', 'w') as file:
+                file.write('5')
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _read(field):
+        with open('/proc/self/status') as file:
+            return int(re.search(rf'{field}:\s+(\d+)', file.read()).group(1)) * 1024
+
+    @staticmethod
+    def _maxrss():
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def fix_mmap_threshold():
+    # glibc поднимает порог mmap после освобождения больших блоков и начинает держать их в куче;
+    # с фиксированным порогом буферы изображений выделяются и возвращаются системе отдельно
+    try:
+        ctypes.CDLL('libc.so.6').mallopt(-3, 128 * 1024)  # M_MMAP_THRESHOLD
+    except (OSError, AttributeError):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    # Перцентиль с линейной интерполяцией между соседними значениями
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def run_case(func, image, min_runs, min_time):
+    # Первый запуск прогревает кэши и измеряет память, остальные - задержку
+    with PeakMemory() as memory:
+        func(image)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - started < min_time:
+        begin = time.perf_counter()
+        func(image)
+        timings.append(time.perf_counter() - begin)
+    timings.sort()
+    total = sum(timings)
+    megapixels = image.width * image.height / 1e6
+    return {
+        'runs': len(timings),
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p90_ms': percentile(timings, 0.9) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'mean_ms': total / len(timings) * 1000,
+        'ops_per_s': len(timings) / total,
+        'megapixels_per_s': megapixels * len(timings) / total,
+        'peak_memory_bytes': memory.peak,
+    }
+
+
+def run(cases, sizes, modes, min_runs, min_time):
+    results = {}
+    for width, height in sizes:
+        for mode in modes:
+            image = make_image((width, height), mode)
+            for name in cases:
+                key = f"{name}/{width}x{height}/{mode}"
+                try:
+                    results[key] = run_case(CASES[name], image, min_runs, min_time)
+                except Exception as e:
+                    # Неподдерживаемые сочетания операции и режима тоже попадают в отчет
+                    results[key] = {'error': f"{type(e).__name__}: {e}"}
+                print_result(key, results[key])
+    return results
+
+
+def print_result(key, result):
+    if 'error' in result:
+        print(f"{key:<42} ошибка: {result['error']}")
+        return
+    print(f"{key:<42} p50 {result['p50_ms']:>9.2f} мс  p90 {result['p90_ms']:>9.2f} мс  "
+          f"p99 {result['p99_ms']:>9.2f} мс  {result['megapixels_per_s']:>8.1f} Мп/с  "
+          f"память {result['peak_memory_bytes'] / 2 ** 20:>7.1f} МБ")
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """
+    Сравнивает результаты с базовыми и возвращает список регрессий.
+
+    Returns:
+        list: Строки с описанием регрессий.
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None or 'error' in result or 'error' in base:
+            continue
+        ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        if ratio > 1 + time_threshold:
+            regressions.append(f"{key}: медиана {base['p50_ms']:.2f} -> {result['p50_ms']:.2f} мс ({ratio:.2f}x)")
+        limit = base['peak_memory_bytes'] * (1 + memory_threshold) + MEMORY_SLACK_BYTES
+        if result['peak_memory_bytes'] > limit:
+            regressions.append(f"{key}: пик памяти {base['peak_memory_bytes'] / 2 ** 20:.1f} -> "
+                               f"{result['peak_memory_bytes'] / 2 ** 20:.1f} МБ")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES),
+                        help='Функции обработки для измерения')
+    parser.add_argument('--sizes', nargs='+', default=[f"{w}x{h}" for w, h in SIZES],
+                        help='Размеры изображений в формате ШИРИНАxВЫСОТА')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='Режимы изображений')
+    parser.add_argument('--min-runs', type=int, default=5, help='Минимальное количество запусков на случай')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Минимальное время измерения случая в секундах')
+    parser.add_argument('--output', help='Файл JSON для сохранения результатов')
+    parser.add_argument('--baseline', help='Файл JSON с базовыми результатами для сравнения')
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD,
+                        help='Допустимое относительное замедление медианы')
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD,
+                        help='Допустимый относительный рост пика памяти')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Декоратор log_function пишет в журнал каждый вызов и каждую ошибку; в бенчмарке это только шум
+    logging.disable(logging.CRITICAL)
+    # Без кэша блоков Pillow каждое изображение выделяет память заново, и пик памяти не зависит от предыдущих случаев
+    Image.core.set_blocks_max(0)
+    fix_mmap_threshold()
+    sizes = [tuple(int(value) for value in size.lower().split('x')) for size in args.sizes]
+    results = run(args.cases, sizes, args.modes, args.min_runs, args.min_time)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'memory_method': 'VmHWM' if PeakMemory._reset() else 'ru_maxrss',
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            return 1
+        print("Регрессий относительно базовых результатов нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
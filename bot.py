@@ -1,897 +1,304 @@
-import io
 import logging
-import random
-import threading
-import time
-from datetime import datetime
-from functools import wraps
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import telebot
-from PIL import Image, UnidentifiedImageError, ImageOps
-from telebot import types
 
-from lists import JOKES, COMPLIMENTS
+import handlers
+from config import (ACK_WORKERS, DISPATCHER_QUEUE_SIZE, DISPATCHER_THREADS, DISPATCHER_WORKERS, DRAIN_TIMEOUT,
+                    JOURNAL_PATH, OUTBOUND_CHAT_BURST, OUTBOUND_CHAT_RATE, OUTBOUND_GLOBAL_RATE,
+                    OUTBOUND_GROUP_PER_MINUTE, OUTBOUND_MAX_RETRIES, SLOW_TRACE_DIR, SLOW_TRACE_SECONDS,
+                    SOURCE_CACHE_BYTES, SOURCE_CACHE_DECODED, SOURCE_CACHE_TTL, TRACE_SAMPLE_RATE, TRANSFORM_WORKERS,
+                    UPDATE_MODE, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
+from dispatcher import Dispatcher, ShutdownRequested, ignore_shutdown_signals, install_shutdown_handler, serve_shard
+from handlers import Awaitable, Runtime, handle_photo, route_callback, route_message, start_metrics_server
+from helpers import get_token
+from journal import UpdateJournal
+from log_utils import setup_logging
+from media_groups import schedule_in_thread
+from metrics import Gauge, registry
+from outbound import OutboundScheduler, throttle_bot
+from source_cache import SourceCache
+from tracing import tracer
+from webhook_server import WebhookServer
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Токен, бот, планировщик исходящих запросов, среда выполнения обработчиков и журнал обновлений.
+# Заполняются при запуске в процессе, которому они нужны: рабочие процессы исполнителя и диспетчера
+# запускаются через spawn и импортируют этот модуль заново, поэтому при импорте ничего не создается
+TOKEN = None
+bot = None
+outbound = None
+runtime = None
+journal = None
 
-# Функция для чтения токена из файла
-def get_token():
-    """
-    Читает токен бота из файла.
-
-    Returns:
-        str: Токен бота.
-    """
-    # Логируем информацию о попытке чтения токена
-    logger.info("Чтение токена бота из файла")
-    try:
-        # Открываем файл с токеном
-        with open('/путь/к/файлу/token.txt', 'r') as file:
-            # Читаем и возвращаем токен, удаляя лишние пробелы
-            return file.read().strip()
-    except FileNotFoundError:
-        # Логируем ошибку, если файл не найден
-        logger.error("Файл с токеном не найден")
-        raise
-
-
-# Получаем токен
-try:
-    # Вызываем функцию для чтения токена
-    TOKEN = get_token()
-    # Создаем экземпляр бота с использованием токена
-    bot = telebot.TeleBot(TOKEN)
-except Exception as e:
-    # Логируем ошибку, если чтение токена не удалось
-    logger.error(f"Ошибка при получении токена: {e}")
-    raise
-
-
-# Удаляем вебхук, если он активен
-def delete_webhook():
-    """
-    Удаляет вебхук, если он активен.
-    """
-    # Логируем информацию о попытке удаления вебхука
-    logger.info("Удаление webhook, если он активен")
-    try:
-        # Удаляем вебхук, если он установлен
-        bot.remove_webhook()  # Пытаемся удалить вебхук, если он был установлен
-    except Exception as e:
-        # Логируем ошибку, если удаление вебхука не удалось
-        logger.error(f"Ошибка при удалении вебхука: {e}")
-
-
-delete_webhook()
-
-# Словарь для хранения состояний пользователей
-user_states = {}
-
-# Набор символов для создания ASCII-арта
-DEFAULT_ASCII_CHARS = '@%#*+=-:. '
-
-# Словарь для сопоставления названий функций с действиями пользователя
-function_to_action = {
-    'pixelate_image': 'пикселизирует изображение',
-    'image_to_ascii': 'преобразует изображение в ASCII-арт',
-    'invert_colors': 'инвертирует цвета изображения',
-    'mirror_image': 'отражает изображение',
-    'send_welcome': 'отправляет приветственное сообщение',
-    'handle_photo': 'отправляет фотографию',
-    'get_options_keyboard': 'получает клавиатуру с вариантами действий',
-    'callback_query': 'обрабатывает запрос обратного вызова',
-    'get_ascii_chars': 'вводит символы для ASCII-арта',
-    'process_image': 'обрабатывает изображение',
-    'process_ascii_art': 'обрабатывает ASCII-арт',
-    'convert_to_heatmap': 'преобразует изображение в тепловую карту',
-    'resize_for_sticker': 'изменяет размер изображения для стикера',
-    'send_random_joke': 'получает случайную шутку',
-    'send_random_compliment': 'получает случайный комплимент',
-    'show_commands': 'получает список команд',
-    'get_commands_keyboard': 'получает клавиатуру с командами',
-    'flip_coin': 'подбрасывает монетку',
-    'handle_resize_sticker': 'изменяет размер изображения для стикера',
-    'handle_heatmap': 'преобразует изображение в тепловую карту',
-    'handle_mirror_vertical': 'отражает изображение по вертикали',
-    'handle_mirror_horizontal': 'отражает изображение по горизонтали',
-    'handle_ascii': 'обрабатывает ASCII-арт',
-    'handle_pixelate': 'пикселизирует изображение',
-    'grayify': 'преобразует изображение в оттенки серого',
-    'pixels_to_ascii': 'преобразует пиксели изображения в ASCII-символы'
-}
-
-
-# Декоратор для логирования вызовов функций и обработки ошибок
-def log_function(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        # Извлекаем user_id из kwargs или args
-        user_id = kwargs.get('user_id')
-        if not user_id:
-            for arg in args:
-                if isinstance(arg, types.Message):
-                    user_id = arg.chat.id
-                    break
-                elif isinstance(arg, types.CallbackQuery):
-                    user_id = arg.message.chat.id
-                    break
-
-        # Если user_id все еще None, устанавливаем его в "Unknown"
-        if not user_id:
-            user_id = "Unknown"
-
-        action = function_to_action.get(func.__name__, f"выполняет неизвестное действие ({func.__name__})")
-        start_time = time.time()  # Засекаем время начала обработки
-        start_time_str = datetime.fromtimestamp(start_time).strftime(
-            '%d-%m-%Y %H:%M:%S')  # Преобразуем в формат день-месяц-год
-        logger.info(
-            f"Начало операции: Пользователь с ID {user_id} {action} в {start_time_str}")  # Логируем начало операции
-
-        try:
-            result = func(*args, **kwargs)
-            end_time = time.time()  # Засекаем время окончания обработки
-            end_time_str = datetime.fromtimestamp(end_time).strftime(
-                '%d-%m-%Y %H:%M:%S')  # Преобразуем в формат день-месяц-год
-            # Логируем конец операции и время выполнения
-            logger.info(
-                f"Конец операции: Пользователь с ID {user_id} {action} в {end_time_str}, время выполнения: {end_time - start_time} сек")
-            # Возвращаем результат выполнения функции
-            return result
-        except Exception as e:
-            # Логируем ошибку, если она произошла
-            logger.error(f"Ошибка в функции {func.__name__} пользователя с ID {user_id}: {e}")
-            raise
-
-    # Возвращаем обертку для функции
-    return wrapper
-
-
-# Функция для обработки ошибок
-def handle_error(message, error_message):
-    # Логируем ошибку с использованием переданного сообщения об ошибке
-    logger.error(f"Ошибка для пользователя с ID {message.chat.id}: {error_message}")
-    # Отправляем сообщение пользователю о том, что произошла ошибка при обработке изображения
-    bot.send_message(message.chat.id, "Произошла ошибка при обработке изображения.")
-
-
-# Функция для изменения размера изображения
-@log_function
-def resize_image(image, new_width=100, user_id=None):
-    """
-    Изменяет размер изображения, сохраняя пропорции.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        new_width (int): Новая ширина изображения.
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Изображение с измененным размером.
-    """
-    # Получаем текущие размеры изображения
-    width, height = image.size
-    # Вычисляем соотношение сторон
-    ratio = height / width
-    # Вычисляем новую высоту, сохраняя пропорции
-    new_height = int(new_width * ratio)
-    # Изменяем размер изображения и возвращаем его с новыми размерами
-    return image.resize((new_width, new_height))
-
-
-# Функция для преобразования изображения в оттенки серого
-@log_function
-def grayify(image, user_id=None):
-    """
-    Преобразует изображение в оттенки серого.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Изображение в оттенках серого.
-    """
-    # Преобразуем изображение в оттенки серого и возвращаем его в оттенках серого
-    return image.convert("L")
-
-
-# Функция для преобразования изображения в ASCII-арт
-@log_function
-def image_to_ascii(image_stream, new_width=40, ascii_chars=DEFAULT_ASCII_CHARS, user_id=None):
-    """
-    Преобразует изображение в ASCII-арт.
-
-    Args:
-        image_stream (io.BytesIO): Поток байтов с изображением.
-        new_width (int): Новая ширина изображения.
-        ascii_chars (str): Набор символов для ASCII-арта.
-        user_id (int): ID пользователя.
 
-    Returns:
-        str: ASCII-арт изображения.
-    """
-
-    # Открываем изображение из потока и преобразуем его в оттенки серого
-    image = Image.open(image_stream).convert('L')
-    # Получаем размеры изображения
-    width, height = image.size
-    # Вычисляем соотношение сторон
-    aspect_ratio = height / width
-    # Вычисляем новую высоту, сохраняя соотношение сторон
-    new_height = int(aspect_ratio * new_width * 0.55)
-    # Изменяем размер изображения
-    img_resized = image.resize((new_width, new_height))
-    # Преобразуем пиксели изображения в ASCII-символы
-    img_str = pixels_to_ascii(img_resized, ascii_chars, user_id=user_id)
-    # Получаем ширину изображения после изменения размера
-    img_width = img_resized.width
-    # Вычисляем максимальное количество символов, которое можно отправить в одном сообщении
-    max_characters = 4000 - (new_width + 1)
-    # Вычисляем максимальное количество строк, которое можно отправить
-    max_rows = max_characters // (new_width + 1)
-    # Инициализируем строку для ASCII-арта
-    ascii_art = ""
-    # Формируем ASCII-арт, добавляя по одной строке за раз
-    for i in range(0, min(max_rows * img_width, len(img_str)), img_width):
-        ascii_art += img_str[i:i + img_width] + "\n"
-    # Возвращаем сформированный ASCII-арт
-    return ascii_art
-
-
-# Функция для преобразования пикселей в ASCII-символы
-@log_function
-def pixels_to_ascii(image, ascii_chars=DEFAULT_ASCII_CHARS, user_id=None):
-    """
-    Преобразует пиксели изображения в ASCII-символы.
-
-    Args:
-        image (PIL.Image): Изображение в оттенках серого.
-        ascii_chars (str): Набор символов для ASCII-арта.
-        user_id (int): ID пользователя.
-
-    Returns:
-        str: Строка с ASCII-символами.
-    """
-    # Получаем данные о пикселях изображения
-    pixels = image.getdata()
-    # Инициализируем строку для хранения ASCII-символов
-    characters = ""
-    # Проходим по каждому пикселю
-    for pixel in pixels:
-        # Вычисляем индекс символа в наборе ASCII-символов
-        index = int(pixel * len(ascii_chars) // 256)
-        # Добавляем символ в строку
-        characters += ascii_chars[index]
-    # Возвращаем строку с ASCII-символами
-    return characters
-
-
-# Функция для пикселизации изображения
-@log_function
-def pixelate_image(image, pixel_size, user_id=None):
-    """
-    Пикселизирует изображение.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        pixel_size (int): Размер пикселя.
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Пикселизованное изображение.
-    """
-    # Уменьшаем изображение до размера, кратного pixel_size, используя метод ближайшего соседа
-    image = image.resize(
-        (image.size[0] // pixel_size, image.size[1] // pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-    # Увеличиваем изображение обратно до исходного размера, используя метод ближайшего соседа
-    image = image.resize(
-        (image.size[0] * pixel_size, image.size[1] * pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-    # Возвращаем пикселизованное изображение
-    return image
-
-
-# Функция для инверсии цветов изображения
-@log_function
-def invert_colors(image, user_id=None):
-    """
-    Инвертирует цвета изображения.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Изображение с инвертированными цветами.
-    """
-    # Инвертируем цвета изображения с помощью функции invert из модуля ImageOps
-    return ImageOps.invert(image)
-
-
-# Функция для отражения изображения
-@log_function
-def mirror_image(image, direction, user_id=None):
-    """
-    Отражает изображение по горизонтали или вертикали.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        direction (str): Направление отражения ('horizontal' или 'vertical').
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Отраженное изображение.
-    """
-    if direction == 'horizontal':
-        # Возвращаем изображение, отраженное по горизонтали
-        return ImageOps.mirror(image)
-    elif direction == 'vertical':
-        # Возвращаем изображение, отраженное по вертикали
-        return ImageOps.flip(image)
-    else:
-        # Выбрасываем исключение, если направление неверное
-        raise ValueError("Неверное направление отражения. Используйте 'horizontal' или 'vertical'.")
-
-
-# Функция для преобразования изображения в тепловую карту
-@log_function
-def convert_to_heatmap(image, user_id=None):
+# Функция для выполнения корутины обработчика в текущем потоке
+def run_sync(coroutine):
     """
-    Преобразует изображение в тепловую карту.
+    Выполняет корутину из handlers.py до конца в текущем потоке. Все, что
+    она ожидает в этой среде выполнения, - обычные блокирующие вызовы,
+    поэтому корутина не приостанавливается и цикл событий не нужен.
 
     Args:
-        image (PIL.Image): Исходное изображение.
-        user_id (int): ID пользователя.
+        coroutine (coroutine): Вызов обработчика, например handlers.route_message(message).
 
     Returns:
-        PIL.Image: Изображение в виде тепловой карты.
+        Результат корутины.
     """
-    # Преобразуем изображение в оттенки серого
-    gray_image = grayify(image, user_id=user_id)
-    # Применяем цветовую палитру для создания тепловой карты
-    heatmap_image = ImageOps.colorize(gray_image, black="blue", white="red")
-    # Возвращаем изображение в виде тепловой карты
-    return heatmap_image
-
-
-# Функция для изменения размера изображения для стикера
-@log_function
-def resize_for_sticker(image, max_size=256, user_id=None):
-    """
-    Изменяет размер изображения, сохраняя пропорции, чтобы его максимальное измерение не превышало заданного максимума.
-
-    Args:
-        image (PIL.Image): Исходное изображение.
-        max_size (int): Максимальный размер изображения (по умолчанию 256 пикселей).
-        user_id (int): ID пользователя.
-
-    Returns:
-        PIL.Image: Изображение с измененным размером.
-    """
-    # Получаем текущие размеры изображения
-    width, height = image.size
-    # Вычисляем соотношение сторон
-    ratio = min(max_size / width, max_size / height)
-    # Вычисляем новые размеры, сохраняя пропорции
-    new_width = int(width * ratio)
-    new_height = int(height * ratio)
-    # Изменяем размер изображения и возвращаем его
-    return image.resize((new_width, new_height),
-                        resample=Image.Resampling.BICUBIC)
-
-
-# Обработчик команд /start и /help
-@bot.message_handler(commands=['start', 'help'])
-@log_function
-def send_welcome(message, user_id=None):
-    """
-    Обрабатывает команды /start и /help.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    if message.text == '/start':
-        # Отправляем приветственное сообщение пользователю
-        bot.reply_to(message, "Пришлите мне изображение, и я предложу вам варианты!",
-                     reply_markup=get_commands_keyboard(user_id=message.chat.id))
-    elif message.text == '/help':
-        # Отправляем текст справки пользователю
-        help_text = get_help_text()
-        bot.reply_to(message, help_text)
-
-
-# Обработчик команды /random_joke
-@bot.message_handler(commands=['random_joke'])
-@bot.message_handler(func=lambda message: message.text == "Случайная шутка")
-@log_function
-def send_random_joke(message, user_id=None):
-    """
-    Отправляет пользователю случайную шутку из списка JOKES.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Выбираем случайную шутку из списка
-    joke = random.choice(JOKES)
-    # Отправляем шутку пользователю
-    bot.reply_to(message, joke)
-
-
-# Обработчик команды /random_compliment
-@bot.message_handler(commands=['random_compliment'])
-@bot.message_handler(func=lambda message: message.text == "Случайный комплимент")
-@log_function
-def send_random_compliment(message, user_id=None):
-    """
-    Отправляет пользователю случайный комплимент из списка COMPLIMENTS.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Выбираем случайный комплимент из списка
-    compliment = random.choice(COMPLIMENTS)
-    # Отправляем комплимент пользователю
-    bot.reply_to(message, compliment)
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("Обработчик ожидает объект asyncio, а не блокирующий вызов")
 
 
-# Обработчик команды /flip_coin
-@bot.message_handler(commands=['flip_coin'])
-@bot.message_handler(func=lambda message: message.text == "Подбросить монетку")
-@log_function
-def flip_coin(message, user_id=None):
+# Среда выполнения обработчиков в потоках
+class ThreadRuntime(Runtime):
     """
-    Симулирует подбрасывание монетки и сообщает пользователю результат ("Орел" или "Решка").
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
+    Выполняет обработчики в потоках telebot или диспетчера: методы бота и
+    кэша исходных фотографий блокируют поток обработчика, а подтверждения
+    отправляются в пуле потоков ack.
     """
-    # Случайный выбор между "Heads" и "Tails"
-    result = random.choice(["Орел", "Решка"])
 
-    # Отправляем результат пользователю
-    bot.reply_to(message, f"Результат подбрасывания монетки: {result}")
+    def __init__(self, bot, outbound, transform_workers=TRANSFORM_WORKERS):
+        """
+        Args:
+            bot (telebot.TeleBot): Экземпляр бота.
+            outbound (OutboundScheduler): Планировщик исходящих запросов бота.
+            transform_workers (int): Количество процессов обработки (None - число ядер).
+        """
+        # Подтверждения отправляются в этих потоках, пока обработчик скачивает и обрабатывает фотографию
+        self.ack_executor = ThreadPoolExecutor(ACK_WORKERS, thread_name_prefix='ack')
+        # Кэш скачанных исходных фотографий, общий для process_image и process_ascii_art
+        source_cache = SourceCache(lambda photo_id: run_sync(handlers.download_photo(photo_id)), SOURCE_CACHE_BYTES,
+                                   SOURCE_CACHE_TTL, SOURCE_CACHE_DECODED)
+        super().__init__(Awaitable(bot), outbound, Awaitable(source_cache), transform_workers)
 
+    async def run_blocking(self, func, *args):
+        return func(*args)
 
-# Обработчик команды /pixelate
-@bot.message_handler(commands=['pixelate'])
-@log_function
-def handle_pixelate(message, user_id=None):
-    """
-    Обрабатывает команду /pixelate для пикселизации изображения.
+    async def wait(self, future):
+        return future.result()
 
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Пикселизация вашего изображения...")
-    # Обрабатываем изображение с помощью функции пикселизации
-    process_image(message, pixelate_image, 20, user_id=message.chat.id)
+    async def wait_first(self, futures):
+        wait(futures, return_when=FIRST_COMPLETED)
 
+    async def acquire(self, nbytes):
+        return self.admission.acquire(nbytes)
 
-# Обработчик команды /ascii
-@bot.message_handler(commands=['ascii'])
-@log_function
-def handle_ascii(message, user_id=None):
-    """
-    Обрабатывает команду /ascii для преобразования изображения в ASCII-арт.
+    async def coalesce(self, key, func, *args, scope=None):
+        return self.flights.run(key, lambda: run_sync(func(*args)), scope=scope)
 
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Преобразование вашего изображения в формат ASCII art...")
-    # Запрашиваем у пользователя набор символов для ASCII-арта
-    bot.send_message(message.chat.id, "Пожалуйста, введите набор символов для ASCII-арта.")
-    # Устанавливаем состояние пользователя в ожидание ввода символов
-    user_states[message.chat.id] = {'ascii_chars': 'waiting'}
-
-
-# Обработчик команды /invert
-@bot.message_handler(commands=['invert'])
-@log_function
-def handle_invert(message, user_id=None):
-    """
-    Обрабатывает команду /invert для инверсии цветов изображения.
+    def start(self, coroutine):
+        return self.ack_executor.submit(run_sync, coroutine)
 
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Инверсия цветов вашего изображения...")
-    # Обрабатываем изображение с помощью функции инверсии цветов
-    process_image(message, invert_colors, user_id=message.chat.id)
+    def schedule(self, delay, callback):
+        schedule_in_thread(delay, callback)
 
+    def close(self):
+        # Дожидаемся отправки подтверждений
+        self.ack_executor.shutdown()
+        super().close()
 
-# Обработчик команды /mirror_horizontal
-@bot.message_handler(commands=['mirror_horizontal'])
-@log_function
-def handle_mirror_horizontal(message, user_id=None):
-    """
-    Обрабатывает команду /mirror_horizontal для отражения изображения по горизонтали.
 
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Отражение вашего изображения по горизонтали...")
-    # Обрабатываем изображение с помощью функции отражения по горизонтали
-    process_image(message, mirror_image, 'horizontal', user_id=message.chat.id)
+# Функция для настройки журнала и трассировки процесса
+def configure_logging():
+    # Записи выводятся отдельным потоком через очередь; настройки трассировки задаются в config.py
+    setup_logging(logging.INFO, '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    tracer.configure(TRACE_SAMPLE_RATE, SLOW_TRACE_SECONDS, SLOW_TRACE_DIR)
 
 
-# Обработчик команды /mirror_vertical
-@bot.message_handler(commands=['mirror_vertical'])
-@log_function
-def handle_mirror_vertical(message, user_id=None):
+# Функция для создания бота
+def create_bot(global_rate=OUTBOUND_GLOBAL_RATE):
     """
-    Обрабатывает команду /mirror_vertical для отражения изображения по вертикали.
+    Читает токен, создает бота и планировщик его исходящих запросов.
 
     Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
+        global_rate (float): Предел исходящих запросов этого процесса в секунду.
     """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Отражение вашего изображения по вертикали...")
-    # Обрабатываем изображение с помощью функции отражения по вертикали
-    process_image(message, mirror_image, 'vertical', user_id=message.chat.id)
+    global TOKEN, bot, outbound
+    try:
+        # Вызываем функцию для чтения токена
+        TOKEN = get_token()
+        # Создаем экземпляр бота с использованием токена
+        bot = telebot.TeleBot(TOKEN)
+    except Exception as e:
+        # Логируем ошибку, если чтение токена не удалось
+        logger.error(f"Ошибка при получении токена: {e}")
+        raise
+    # Все исходящие запросы проходят через планировщик: ответы на кнопки раньше сообщений, сообщения раньше медиа
+    outbound = OutboundScheduler(global_rate, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+                                 OUTBOUND_GROUP_PER_MINUTE, OUTBOUND_MAX_RETRIES)
+    throttle_bot(bot, outbound)
 
 
-# Обработчик команды /heatmap
-@bot.message_handler(commands=['heatmap'])
-@log_function
-def handle_heatmap(message, user_id=None):
+# Функция для подключения обработчиков к боту
+def start_handlers(transform_workers=TRANSFORM_WORKERS):
     """
-    Обрабатывает команду /heatmap для преобразования изображения в тепловую карту.
+    Создает среду выполнения обработчиков (хранилище состояний, кэши и пул
+    процессов обработки) и регистрирует общие обработчики из handlers.py.
 
     Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Преобразование вашего изображения в тепловую карту...")
-    # Обрабатываем изображение с помощью функции преобразования в тепловую карту
-    process_image(message, convert_to_heatmap, user_id=message.chat.id)
+        transform_workers (int): Количество процессов обработки (None - число ядер).
+    """
+    global runtime
+    # Общие обработчики из handlers.py выполняются в потоках этого процесса
+    runtime = ThreadRuntime(bot, outbound, transform_workers)
+    handlers.setup(runtime)
+    bot.register_message_handler(lambda message: run_sync(handle_photo(message)), content_types=['photo'])
+    # Единственный обработчик текстовых сообщений и единственный обработчик запросов обратного вызова:
+    # обработчик команды или кнопки находится в словаре маршрутизатора
+    bot.register_message_handler(lambda message: run_sync(route_message(message)), content_types=['text'])
+    bot.register_callback_query_handler(lambda call: run_sync(route_callback(call)), func=lambda call: True)
+
+
+# Функция для освобождения ресурсов процесса при остановке
+def close_resources(metrics_server):
+    # Дожидаемся отправки подтверждений и завершения задач обработки, сохраняем состояния пользователей
+    if runtime is not None:
+        runtime.close()
+    if journal is not None:
+        journal.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
 
 
-# Обработчик команды /resize_sticker
-@bot.message_handler(commands=['resize_sticker'])
-@log_function
-def handle_resize_sticker(message, user_id=None):
+# Удаляем вебхук, если он активен
+def delete_webhook():
     """
-    Обрабатывает команду /resize_sticker для изменения размера изображения для стикера.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
+    Удаляет вебхук, если он активен.
     """
-    # Отправляем сообщение о начале обработки
-    bot.reply_to(message, "Изменение размера изображения для стикера...")
-    # Обрабатываем изображение с помощью функции изменения размера для стикера
-    process_image(message, resize_for_sticker, user_id=message.chat.id)
+    # Логируем информацию о попытке удаления вебхука
+    logger.info("Удаление webhook, если он активен")
+    try:
+        # Удаляем вебхук, если он установлен
+        bot.remove_webhook()  # Пытаемся удалить вебхук, если он был установлен
+    except Exception as e:
+        # Логируем ошибку, если удаление вебхука не удалось
+        logger.error(f"Ошибка при удалении вебхука: {e}")
 
 
-# Обработчик получения фотографий
-@bot.message_handler(content_types=['photo'])
-@log_function
-def handle_photo(message, user_id=None):
+# Функция для передачи обработчикам обновления, полученного от диспетчера
+def process_update(update):
     """
-    Обрабатывает полученные фотографии и предлагает пользователю варианты действий.
+    Передает обновление в виде словаря Bot API обработчикам бота и после их
+    завершения удаляет его из журнала.
 
     Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
+        update (dict): Обновление.
     """
-    # Отправляем ответное сообщение с предложением выбрать действие
-    bot.reply_to(message, "У меня есть ваша фотография! Пожалуйста, выберите, что бы вы хотели с ней сделать.",
-                 reply_markup=get_options_keyboard(user_id=message.chat.id))
-    # Сохраняем ID фотографии и инициализируем поле для символов ASCII-арта
-    user_states[message.chat.id] = {'photo': message.photo[-1].file_id, 'ascii_chars': None}
+    update_id = update['update_id']
+    try:
+        bot.process_new_updates([telebot.types.Update.de_json(update)])
+    finally:
+        if journal is not None:
+            journal.done(update_id)
 
 
-# Функция для создания клавиатуры с вариантами действий
-@log_function
-def get_options_keyboard(user_id=None):
+# Функция для обработки обновлений в этом процессе
+def serve_updates(index, updates):
     """
-    Создает клавиатуру с вариантами действий над изображением.
+    Обрабатывает обновления из очереди диспетчера в потоках этого процесса.
 
     Args:
-        user_id (int): ID пользователя.
-
-    Returns:
-        telebot.types.InlineKeyboardMarkup: Клавиатура с вариантами действий.
-    """
-    # Создаем объект клавиатуры
-    keyboard = types.InlineKeyboardMarkup()
-    # Создаем кнопку для пикселизации изображения
-    pixelate_btn = types.InlineKeyboardButton("Пикселизация", callback_data="pixelate")
-    # Создаем кнопку для преобразования изображения в ASCII-арт
-    ascii_btn = types.InlineKeyboardButton("ASCII-арт", callback_data="ascii")
-    # Создаем кнопку для инверсии цветов изображения
-    invert_btn = types.InlineKeyboardButton("Инвертировать цвета", callback_data="invert")
-    # Создаем кнопку для отражения изображения по горизонтали
-    mirror_horizontal_btn = types.InlineKeyboardButton("Отразить по горизонтали", callback_data="mirror_horizontal")
-    # Создаем кнопку для отражения изображения по вертикали
-    mirror_vertical_btn = types.InlineKeyboardButton("Отразить по вертикали", callback_data="mirror_vertical")
-    # Создаем кнопку для преобразования изображения в тепловую карту
-    heatmap_btn = types.InlineKeyboardButton("Тепловая карта", callback_data="heatmap")
-    # Создаем кнопку для изменения размера изображения для стикера
-    resize_sticker_btn = types.InlineKeyboardButton("Изменить размер для стикера", callback_data="resize_sticker")
-    # Добавляем кнопки на клавиатуру
-    keyboard.add(pixelate_btn, ascii_btn, invert_btn, mirror_horizontal_btn, mirror_vertical_btn, heatmap_btn,
-                 resize_sticker_btn)
-    # Возвращаем созданную клавиатуру
-    return keyboard
-
-
-# Функция для создания клавиатуры с командами
-@log_function
-def get_commands_keyboard(user_id=None):
+        index (int): Номер потока диспетчера.
+        updates (queue.Queue): Очередь обновлений.
     """
-    Создает клавиатуру с командами бота.
+    # Обработчики вызываются в потоках диспетчера по порядку обновлений чата, а не в пуле потоков telebot,
+    # чтобы обновление удалялось из журнала только после завершения обработки
+    bot.threaded = False
+    serve_shard(updates, process_update, DISPATCHER_THREADS)
 
-    Args:
-        user_id (int): ID пользователя.
 
-    Returns:
-        telebot.types.ReplyKeyboardMarkup: Клавиатура с командами.
-    """
-    # Создаем объект клавиатуры
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    # Создаем кнопку для отправки случайной шутки
-    random_joke_btn = types.KeyboardButton("Случайная шутка")
-    # Создаем кнопку для отправки случайного комплимента
-    random_compliment_btn = types.KeyboardButton("Случайный комплимент")
-    # Создаем кнопку для подбрасывания монетки
-    flip_coin_btn = types.KeyboardButton("Подбросить монетку")
-    # Создаем кнопку для вывода списка команд
-    commands_btn = types.KeyboardButton("Список команд")
-    # Добавляем кнопки на клавиатуру
-    keyboard.add(random_joke_btn, random_compliment_btn, flip_coin_btn, commands_btn)
-    # Возвращаем созданную клавиатуру
-    return keyboard
-
-
-# Обработчик запросов обратного вызова
-@bot.callback_query_handler(func=lambda call: True)
-@log_function
-def callback_query(call, user_id=None):
-    """
-    Обрабатывает запросы обратного вызова от пользователя.
+# Функция для получения обновлений долгим опросом в процессе диспетчера
+def get_updates(offset, limit, timeout):
+    return telebot.apihelper.get_updates(TOKEN, offset, limit, timeout, long_polling_timeout=timeout)
 
-    Args:
-        call (telebot.types.CallbackQuery): Запрос обратного вызова.
-        user_id (int): ID пользователя.
-    """
-    user_id = call.message.chat.id
-    # Проверяем, какой вариант выбрал пользователь
-    if call.data == "pixelate":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Пикселизация вашего изображения...")
-        # Обрабатываем изображение с помощью функции пикселизации
-        process_image(call.message, pixelate_image, 20, user_id=user_id)
-    elif call.data == "ascii":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Преобразование вашего изображения в формат ASCII art...")
-        # Запрашиваем у пользователя набор символов для ASCII-арта
-        bot.send_message(call.message.chat.id, "Пожалуйста, введите набор символов для ASCII-арта.")
-        # Устанавливаем состояние пользователя в ожидание ввода символов
-        user_states[call.message.chat.id]['ascii_chars'] = 'waiting'
-    elif call.data == "invert":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Инверсия цветов вашего изображения...")
-        # Обрабатываем изображение с помощью функции инверсии цветов
-        process_image(call.message, invert_colors, user_id=user_id)
-    elif call.data == "mirror_horizontal":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Отражение вашего изображения по горизонтали...")
-        # Обрабатываем изображение с помощью функции отражения по горизонтали
-        process_image(call.message, mirror_image, 'horizontal', user_id=user_id)
-    elif call.data == "mirror_vertical":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Отражение вашего изображения по вертикали...")
-        # Обрабатываем изображение с помощью функции отражения по вертикали
-        process_image(call.message, mirror_image, 'vertical', user_id=user_id)
-    elif call.data == "heatmap":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Преобразование вашего изображения в тепловую карту...")
-        # Обрабатываем изображение с помощью функции преобразования в тепловую карту
-        process_image(call.message, convert_to_heatmap, user_id=user_id)
-    elif call.data == "resize_sticker":
-        # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
-        bot.answer_callback_query(call.id, "Изменение размера изображения для стикера...")
-        # Обрабатываем изображение с помощью функции изменения размера для стикера
-        process_image(call.message, resize_for_sticker, user_id=user_id)
-
-
-# Обработчик ввода символов для ASCII-арта
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id, {}).get('ascii_chars') == 'waiting')
-@log_function
-def get_ascii_chars(message, user_id=None):
-    """
-    Обрабатывает ввод пользователем символов для ASCII-арта.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Сохраняем введенные пользователем символы для ASCII-арта
-    user_states[message.chat.id]['ascii_chars'] = message.text
-    # Вызываем функцию для обработки ASCII-арта с использованием введенных символов
-    process_ascii_art(message, user_id=message.chat.id)
 
-
-# Функция для обработки изображения и отправки результата
-@log_function
-def process_image(message, image_processing_func, *args, user_id=None):
+# Функция рабочего процесса диспетчера
+def run_dispatcher_worker(index, updates):
     """
-    Обрабатывает изображение с помощью переданной функции и отправляет результат пользователю.
+    Обрабатывает обновления своего сегмента чатов существующими обработчиками.
+    Выполняется в рабочем процессе диспетчера, который импортирует этот модуль
+    заново и сам создает бота, обработчики и журнал.
 
     Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        image_processing_func (function): Функция для обработки изображения.
-        *args: Дополнительные аргументы для функции обработки изображения.
-        user_id (int): ID пользователя.
-    """
+        index (int): Номер рабочего процесса.
+        updates (multiprocessing.Queue): Очередь обновлений сегмента.
+    """
+    global journal
+    # Завершением процесса управляет диспетчер: сигнал остановки не прерывает начатую обработку
+    ignore_shutdown_signals()
+    configure_logging()
+    # Общий предел исходящих запросов Telegram делится между рабочими процессами
+    create_bot(OUTBOUND_GLOBAL_RATE / DISPATCHER_WORKERS)
+    # Обработчики вызываются в потоках сегмента по порядку обновлений чата, а не в пуле потоков telebot
+    bot.threaded = False
+    # Ядра делятся между пулами обработки рабочих процессов, а не заняты каждым из них целиком
+    start_handlers(TRANSFORM_WORKERS or max((os.cpu_count() or 1) // DISPATCHER_WORKERS, 1))
+    journal = UpdateJournal(JOURNAL_PATH) if JOURNAL_PATH else None
+    # Метрики каждого процесса доступны на своем порту: METRICS_PORT + 1 + index
+    metrics_server = start_metrics_server(index + 1)
+    logger.info(f"Рабочий процесс {index} диспетчера запущен")
     try:
-        # Получаем ID фотографии из состояния пользователя
-        photo_id = user_states[message.chat.id]['photo']
-        # Получаем информацию о файле по его ID
-        file_info = bot.get_file(photo_id)
-        # Скачиваем файл изображения
-        downloaded_file = bot.download_file(file_info.file_path)
-
-        # Открываем скачанный файл как поток байтов
-        with io.BytesIO(downloaded_file) as image_stream:
-            # Открываем изображение с помощью библиотеки PIL
-            image = Image.open(image_stream)
-            # Получаем размер изображения
-            width, height = image.size
-            # Логируем информацию о размере изображения и пользователе
-            logger.info(f"Пользователь с ID {user_id} обрабатывает изображение размером {width}x{height} пикселей")
-
-            # Обрабатываем изображение с помощью переданной функции и аргументов
-            processed_image = image_processing_func(image, *args, user_id=user_id)
-
-            # Создаем новый поток байтов для сохранения обработанного изображения
-            with io.BytesIO() as output_stream:
-                # Сохраняем обработанное изображение в формате JPEG
-                processed_image.save(output_stream, format="JPEG")
-                # Перемещаем указатель потока в начало
-                output_stream.seek(0)
-                # Отправляем обработанное изображение пользователю
-                bot.send_photo(message.chat.id, output_stream)
-    except UnidentifiedImageError:
-        # Обрабатываем ошибку, если изображение не удалось открыть
-        handle_error(message, "Ошибка при открытии изображения")
-    except Exception as e:
-        # Обрабатываем любые другие ошибки и логируем их
-        handle_error(message, f"Ошибка при обработке и отправке изображения: {e}")
-
-
-# Функция для обработки ASCII-арта и отправки результата
-@log_function
-def process_ascii_art(message, user_id=None):
-    """
-    Обрабатывает изображение и преобразует его в ASCII-арт, затем отправляет результат пользователю.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
+        serve_shard(updates, process_update, DISPATCHER_THREADS, DISPATCHER_WORKERS)
+    finally:
+        close_resources(metrics_server)
+
+
+# Запускаем бота только при прямом запуске файла: рабочие процессы исполнителя и диспетчера импортируют
+# этот модуль повторно под именем __mp_main__
+if __name__ == '__main__':
+    configure_logging()
+    # SIGTERM и SIGINT прерывают прием обновлений, после чего начатая обработка завершается
+    install_shutdown_handler()
+    create_bot()
+    journal = UpdateJournal(JOURNAL_PATH) if JOURNAL_PATH else None
+    if DISPATCHER_WORKERS:
+        # Этот процесс только распределяет обновления: обработчики, состояния пользователей и пулы обработки
+        # создаются в рабочих процессах
+        metrics_server = start_metrics_server()
+        dispatcher = Dispatcher(run_dispatcher_worker, DISPATCHER_WORKERS, DISPATCHER_QUEUE_SIZE, journal)
+        registry.register(Gauge('tgbot_dispatcher_queue_depth', 'Количество обновлений в очереди рабочего процесса',
+                                ('shard',), function=lambda: {(str(index),): depth
+                                                              for index, depth in enumerate(dispatcher.depths())}))
+    else:
+        # Обновления обрабатываются в потоках этого процесса
+        start_handlers()
+        metrics_server = start_metrics_server()
+        dispatcher = Dispatcher(serve_updates, 1, DISPATCHER_QUEUE_SIZE, journal, local=True)
+    webhook_server = None
+    # Запускаем бота
     try:
-        # Получаем ID фотографии из состояния пользователя
-        photo_id = user_states[message.chat.id]['photo']
-        # Получаем символы для ASCII-арта из состояния пользователя
-        ascii_chars = user_states[message.chat.id]['ascii_chars']
-        # Получаем информацию о файле по его ID
-        file_info = bot.get_file(photo_id)
-        # Скачиваем файл изображения
-        downloaded_file = bot.download_file(file_info.file_path)
-
-        # Открываем скачанный файл как поток байтов
-        with io.BytesIO(downloaded_file) as image_stream:
-            # Открываем изображение с помощью библиотеки PIL
-            image = Image.open(image_stream)
-            # Получаем размер изображения
-            width, height = image.size
-            # Логируем информацию о размере изображения и пользователе
-            logger.info(
-                f"Пользователь с ID {user_id} преобразует изображение размером {width}x{height} пикселей в ASCII-арт с символами: {ascii_chars}")
-
-            # Преобразуем изображение в ASCII-арт
-            ascii_art = image_to_ascii(image_stream, ascii_chars=ascii_chars, user_id=user_id)
-            # Отправляем ASCII-арт пользователю
-            bot.send_message(message.chat.id, f"```\n{ascii_art}\n```", parse_mode="MarkdownV2")
-    except UnidentifiedImageError:
-        # Обрабатываем ошибку, если изображение не удалось открыть
-        handle_error(message, "Ошибка при открытии изображения")
+        # Запускаем обработку и повторяем обновления, не завершенные до перезапуска
+        dispatcher.start()
+        if UPDATE_MODE == 'webhook':
+            # Регистрируем вебхук в Telegram, если указан публичный URL
+            if WEBHOOK_URL:
+                bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+            # Принимаем обновления встроенным HTTP-сервером: обновление записывается в журнал до ответа
+            # Telegram, а диспетчеру его передает один поток, чтобы обновления чата не менялись местами
+            webhook_server = WebhookServer(dispatcher.dispatch, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                                           WEBHOOK_SECRET, workers=1, accept=dispatcher.journal_json)
+            registry.register(Gauge('tgbot_webhook_queue_depth', 'Количество обновлений в очереди вебхука',
+                                    function=webhook_server.updates.qsize))
+            webhook_server.serve_forever()
+        else:
+            delete_webhook()
+            # Опрашиваем сервер Telegram с сохраненного offset и передаем обновления диспетчеру
+            dispatcher.poll(get_updates)
+    except ShutdownRequested as e:
+        logger.info(f"Получен сигнал {e}: прием обновлений остановлен, завершается начатая обработка")
     except Exception as e:
-        # Обрабатываем любые другие ошибки и логируем их
-        handle_error(message, f"Ошибка при преобразовании изображения в ASCII-арт и отправке: {e}")
-
-
-# Обработчик команды "Список команд"
-@bot.message_handler(func=lambda message: message.text == "Список команд")
-@log_function
-def show_commands(message, user_id=None):
-    """
-    Отправляет пользователю список доступных команд бота.
-
-    Args:
-        message (telebot.types.Message): Сообщение от пользователя.
-        user_id (int): ID пользователя.
-    """
-    # Формируем сообщение со списком команд и их описаниями
-    commands_message = (
-        "/start - Начать работу с ботом\n"
-        "/help - Получить помощь\n"
-        "/pixelate - Пикселизация изображения\n"
-        "/ascii - Преобразование изображения в ASCII-арт\n"
-        "/invert - Инвертировать цвета изображения\n"
-        "/mirror_horizontal - Отразить изображение по горизонтали\n"
-        "/mirror_vertical - Отразить изображение по вертикали\n"
-        "/heatmap - Преобразование изображения в тепловую карту\n"
-        "/resize_sticker - Изменить размер изображения для стикера\n"
-        "/random_joke - Случайная шутка\n"
-        "/random_compliment - Случайный комплимент\n"
-        "/flip_coin - Подбросить монетку и получить результат (\"Орел\" или \"Решка\")\n"
-    )
-    # Отправляем сообщение с командами пользователю
-    bot.send_message(message.chat.id, commands_message)
-
-
-# Функция для чтения текста справки из файла help.txt
-def get_help_text():
-    """
-    Читает текст справки из файла help.txt.
-
-    Returns:
-        str: Текст справки.
-    """
-    try:
-        with open('help.txt', 'r', encoding='utf-8') as file:
-            return file.read()
-    except FileNotFoundError:
-        return "Файл справки не найден."
-
-
-# Функция для проверки состояния чата
-def check_chat_state():
-    """
-    Проверяет состояние чата каждую минуту и сбрасывает историю событий для несуществующих чатов.
-    """
-    while True:
-        time.sleep(60)  # Проверяем состояние чата каждую минуту
-        for chat_id in list(user_states.keys()):
-            try:
-                # Проверяем, существует ли чат
-                bot.send_chat_action(chat_id, 'typing')
-            except telebot.apihelper.ApiException:
-                # Если чат не существует, сбрасываем историю событий
-                del user_states[chat_id]
-                logger.info(f"Сброс истории событий для чата с ID {chat_id}")
-
-
-# Запускаем поток для проверки состояния чата
-threading.Thread(target=check_chat_state, daemon=True).start()
-
-# Запускаем бота
-try:
-    # Запускаем бота в режиме опроса сервера Telegram на наличие новых сообщений
-    bot.polling(none_stop=True)
-except Exception as e:
-    # В случае ошибки при запуске бота, логируем ошибку
-    logger.error(f"Ошибка при запуске бота: {e}")
+        # В случае ошибки при запуске бота, логируем ошибку
+        logger.error(f"Ошибка при запуске бота: {e}")
+    finally:
+        if webhook_server is not None:
+            # Передаем диспетчеру обновления, на которые вебхук уже ответил
+            webhook_server.shutdown()
+        # Дожидаемся обработки полученных обновлений; не успевшие остаются в журнале
+        dispatcher.shutdown(DRAIN_TIMEOUT)
+        close_resources(metrics_server)
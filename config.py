@@ -0,0 +1,93 @@
+# Настройки бота, общие для bot.py и async_bot.py
+
+# Настройки трассировки: доля запросов, участки которых пишутся в журнал, длительность
+# запроса в секундах, после которой его трасса сохраняется в JSON, и каталог для таких трасс
+TRACE_SAMPLE_RATE = 0.1
+SLOW_TRACE_SECONDS = 5.0
+SLOW_TRACE_DIR = None
+
+# Ограничения частоты исходящих запросов Telegram: всего в секунду, в личный чат в секунду
+# (и подряд), в группу в минуту, а также количество повторов после ответа 429
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_GROUP_PER_MINUTE = 20
+OUTBOUND_MAX_RETRIES = 3
+
+# Количество потоков bot.py для отправки подтверждений (ответов на кнопки и сообщений о начале обработки)
+ACK_WORKERS = 4
+
+# Размер пула HTTP-соединений async_bot.py к Bot API, общего для всех обработчиков
+HTTP_POOL_SIZE = 100
+# Количество потоков async_bot.py для декодирования, кодирования и кэшей
+IO_THREADS = 8
+
+# Способ получения обновлений: 'polling' - опрос сервера Telegram, 'webhook' - встроенный HTTP-сервер
+UPDATE_MODE = 'polling'
+# Настройки вебхука: публичный URL (None - не регистрировать вебхук в Telegram, например для локальной проверки),
+# адрес и порт встроенного сервера, путь и секретный токен для проверки запросов
+WEBHOOK_URL = None
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = None
+
+# Количество рабочих процессов диспетчера (0 - обрабатывать обновления в этом процессе). Если процессов
+# больше нуля, этот процесс только получает обновления и распределяет их по процессам по ID чата;
+# DISPATCHER_THREADS - количество потоков обработки в каждом процессе (обновления одного чата
+# обрабатываются одним потоком по порядку; по умолчанию столько же, сколько в пуле потоков telebot),
+# DISPATCHER_QUEUE_SIZE - размер очереди обновлений процесса
+DISPATCHER_WORKERS = 0
+DISPATCHER_THREADS = 2
+DISPATCHER_QUEUE_SIZE = 1000
+
+# Журнал принятых, но не обработанных обновлений и offset опроса (None - без журнала): после перезапуска
+# бот продолжает с сохраненного offset и повторяет незавершенные обновления. При SIGTERM бот перестает
+# принимать обновления и до DRAIN_TIMEOUT секунд дожидается завершения начатой обработки
+JOURNAL_PATH = 'journal.sqlite3'
+DRAIN_TIMEOUT = 30.0
+
+# Хранилище состояний пользователей: 'memory' - только в памяти, 'sqlite' - в базе SQLite,
+# чтобы состояния переживали перезапуск бота. Записи устаревают через SESSION_TTL секунд
+# после последнего изменения, в памяти хранится не больше SESSION_MEMORY_ENTRIES чатов
+SESSION_STORE = 'sqlite'
+SESSION_DB_PATH = 'sessions.sqlite3'
+SESSION_TTL = 24 * 60 * 60
+SESSION_MEMORY_ENTRIES = 100000
+
+# Время ожидания следующей фотографии альбома в секундах
+MEDIA_GROUP_DELAY = 1.0
+
+# Отправка результатов: True - документом (без пережатия Telegram), False - фотографией, кроме стикеров.
+# Желаемый максимальный размер файла результата в байтах: качество JPEG и WebP подбирается под него (None - без предела)
+SEND_RESULTS_AS_DOCUMENT = False
+RESULT_MAX_BYTES = None
+
+# Настройки кэша готовых результатов: бюджет памяти, каталог и бюджет дискового уровня (None - без диска)
+RESULT_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_DIR = None
+RESULT_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+# Настройки кэша исходных фотографий: бюджет в байтах, время жизни записи и хранение декодированных изображений
+SOURCE_CACHE_BYTES = 128 * 1024 * 1024
+SOURCE_CACHE_TTL = 30 * 60
+SOURCE_CACHE_DECODED = False
+
+# Настройки исполнителя функций обработки: 'process' - пул процессов, 'inline' - поток обработчика.
+# None для числа процессов и длины очереди означает значения по умолчанию (число ядер и удвоенное число ядер;
+# с рабочими процессами диспетчера ядра делятся между ними). Заданное число процессов действует в каждом процессе бота
+TRANSFORM_EXECUTOR = 'process'
+TRANSFORM_WORKERS = None
+TRANSFORM_QUEUE_SIZE = None
+
+# Ограничения памяти обработки: изображения больше ADMISSION_REJECT_PIXELS пикселей отклоняются по заголовку
+# файла, больше ADMISSION_MAX_PIXELS - уменьшаются при декодировании. Пока суммарная оценка памяти задач
+# в работе превышает ADMISSION_MEMORY_BYTES, новые задачи ждут (не дольше ADMISSION_TIMEOUT секунд)
+ADMISSION_MAX_PIXELS = 25 * 1000 * 1000
+ADMISSION_REJECT_PIXELS = 100 * 1000 * 1000
+ADMISSION_MEMORY_BYTES = 1024 * 1024 * 1024
+ADMISSION_TIMEOUT = 30.0
+
+# Адрес и порт HTTP-сервера метрик в текстовом формате Prometheus (None - не запускать сервер)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
@@ -0,0 +1,344 @@
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Типы обновлений, содержащих сообщение с чатом
+MESSAGE_UPDATES = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+# Количество обновлений в очереди одного потока рабочего процесса, после которого чтение сегмента приостанавливается
+LANE_QUEUE_SIZE = 100
+# Пауза перед повтором запроса обновлений после ошибки, в секундах
+POLL_ERROR_DELAY = 3.0
+# Интервал проверки, что процесс диспетчера еще работает, в секундах
+PARENT_CHECK_INTERVAL = 1.0
+
+
+# Сигналы, по которым процесс бота завершает работу
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class ShutdownRequested(BaseException):
+    """
+    Процесс получил сигнал остановки (SIGTERM или SIGINT). Как и
+    KeyboardInterrupt, не наследуется от Exception, чтобы его не перехватили
+    обработчики ошибок по пути к основному циклу.
+    """
+
+
+# Функция для установки обработчика сигналов остановки
+def install_shutdown_handler():
+    """
+    Превращает SIGTERM и SIGINT в исключение ShutdownRequested в основном
+    потоке. Исключение прерывает ожидание долгого опроса или вебхука сразу,
+    а не после окончания запроса; повторные сигналы игнорируются, пока идет
+    завершение.
+    """
+    def handle(signum, frame):
+        ignore_shutdown_signals()
+        raise ShutdownRequested(signal.Signals(signum).name)
+
+    for signum in SHUTDOWN_SIGNALS:
+        signal.signal(signum, handle)
+
+
+# Функция для отключения сигналов остановки в дочернем процессе
+def ignore_shutdown_signals():
+    """
+    Игнорирует SIGTERM и SIGINT. Используется в рабочих процессах: сигнал
+    получает вся группа процессов, а завершением рабочих процессов управляет
+    основной процесс, чтобы они успели закончить начатую обработку.
+    """
+    for signum in SHUTDOWN_SIGNALS:
+        signal.signal(signum, signal.SIG_IGN)
+
+
+# Функция для получения ID чата обновления
+def get_chat_id(update):
+    """
+    Возвращает ID чата, к которому относится обновление.
+
+    Args:
+        update (dict): Обновление в том виде, в каком его присылает Bot API.
+
+    Returns:
+        int | None: ID чата, ID отправителя для обновлений без чата или None.
+    """
+    for kind in MESSAGE_UPDATES:
+        if kind in update:
+            return update[kind]['chat']['id']
+    callback = update.get('callback_query')
+    if callback is not None:
+        # Нажатие кнопки относится к чату сообщения с кнопкой, чтобы попасть туда же, куда и фотография
+        message = callback.get('message')
+        return message['chat']['id'] if message else callback['from']['id']
+    # Прочие обновления (inline_query, poll_answer и др.) распределяются по отправителю
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from']['id']
+    return None
+
+
+# Функция для выбора сегмента по ID чата
+def get_shard(chat_id, shards):
+    """
+    Возвращает номер сегмента чата: обновления одного чата всегда попадают в один сегмент.
+
+    Args:
+        chat_id (int | None): ID чата (None - первый сегмент).
+        shards (int): Количество сегментов.
+
+    Returns:
+        int: Номер сегмента от 0 до shards - 1.
+    """
+    return 0 if chat_id is None else chat_id % shards
+
+
+# Функция для обработки сегмента чатов в рабочем процессе
+def serve_shard(updates, process_update, threads=4, shards=1):
+    """
+    Читает обновления сегмента из очереди и передает их process_update в
+    нескольких потоках. Чаты сегмента делятся между потоками тем же
+    хешированием по ID чата, поэтому обновления одного чата обрабатываются
+    строго по порядку, а разные чаты - параллельно. Возвращается после
+    получения None из очереди и обработки всех полученных ранее обновлений
+    или после завершения процесса диспетчера.
+
+    Args:
+        updates (multiprocessing.Queue): Очередь обновлений сегмента.
+        process_update (function): Функция, принимающая обновление (dict).
+        threads (int): Количество потоков обработки.
+        shards (int): Количество сегментов, чтобы потоки делили чаты сегмента равномерно.
+    """
+    lanes = [queue.Queue(maxsize=LANE_QUEUE_SIZE) for _ in range(threads)]
+
+    def work(lane):
+        while True:
+            update = lane.get()
+            if update is None:
+                return
+            try:
+                process_update(update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+
+    workers = [threading.Thread(target=work, args=(lane,), name=f'shard-lane-{index}')
+               for index, lane in enumerate(lanes)]
+    for worker in workers:
+        worker.start()
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            update = updates.get(timeout=PARENT_CHECK_INTERVAL)
+        except queue.Empty:
+            # Без процесса диспетчера новых обновлений не будет: процесс не должен остаться сиротой
+            if parent is not None and not parent.is_alive():
+                logger.error("Процесс диспетчера завершился, рабочий процесс останавливается")
+                break
+            continue
+        if update is None:
+            break
+        chat_id = get_chat_id(update)
+        # Все чаты сегмента имеют одинаковый остаток от деления на shards: делим по частному
+        lanes[get_shard(None if chat_id is None else chat_id // shards, threads)].put(update)
+    # Потоки завершаются после обработки своих очередей
+    for lane in lanes:
+        lane.put(None)
+    for worker in workers:
+        worker.join()
+
+
+# Диспетчер обновлений
+class Dispatcher:
+    """
+    Распределяет обновления по рабочим процессам по ID чата.
+
+    Один процесс получает обновления (опросом или через вебхук) и кладет
+    каждое в очередь рабочего процесса get_shard(chat_id, workers). Все
+    обновления чата попадают в один процесс и в порядке получения, поэтому
+    состояние чата (например, ожидание символов для ASCII-арта) остается в
+    одном процессе, а количество процессов можно увеличивать ради
+    пропускной способности. С local=True вместо процессов запускаются
+    потоки этого процесса.
+
+    Если передан журнал, принятые обновления записываются в него до
+    подтверждения Telegram, опрос продолжается с сохраненного offset, а
+    незавершенные обновления передаются обработчикам при запуске.
+    """
+
+    def __init__(self, worker, workers=2, queue_size=1000, journal=None, local=False):
+        """
+        Args:
+            worker (function): Функция worker(index, updates) рабочего процесса. Должна быть определена
+                на уровне модуля: процессы запускаются через spawn и импортируют ее заново.
+            workers (int): Количество рабочих процессов.
+            queue_size (int): Максимальное количество обновлений в очереди одного процесса.
+            journal (UpdateJournal): Журнал принятых обновлений (None - без журнала).
+            local (bool): Запускать worker в потоках этого процесса, а не в отдельных процессах.
+        """
+        self.worker = worker
+        self.workers = workers
+        self.journal = journal
+        self.local = local
+        # Процессы запускаются через spawn: fork процесса с потоками может унаследовать захваченные блокировки
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [queue.Queue(queue_size) if local else self._context.Queue(queue_size)
+                        for _ in range(workers)]
+        self._processes = [None] * workers
+        self._stopped = threading.Event()
+        # Количество переданных обновлений по сегментам
+        self.dispatched = [0] * workers
+
+    def start(self):
+        """
+        Запускает рабочие процессы и передает им незавершенные обновления из журнала.
+        """
+        for index in range(self.workers):
+            self._start_worker(index)
+        if not self.local:
+            logger.info(f"Запущено рабочих процессов диспетчера: {self.workers}")
+        if self.journal is not None:
+            updates = self.journal.pending()
+            if updates:
+                logger.info(f"Повторная обработка незавершенных обновлений: {len(updates)}")
+            for update in updates:
+                self.dispatch(update)
+
+    def _start_worker(self, index):
+        if self.local:
+            # Потоки не мешают завершению процесса, если не успели закончить обработку
+            process = threading.Thread(target=self.worker, args=(index, self._queues[index]),
+                                       name=f'shard-{index}', daemon=True)
+        else:
+            process = self._context.Process(target=self.worker, args=(index, self._queues[index]),
+                                            name=f'shard-{index}')
+        process.start()
+        self._processes[index] = process
+
+    def dispatch(self, update):
+        """
+        Передает обновление рабочему процессу его чата. Если очередь процесса
+        заполнена, ждет места, приостанавливая получение новых обновлений.
+
+        Args:
+            update (dict): Обновление в том виде, в каком его присылает Bot API.
+        """
+        index = get_shard(get_chat_id(update), self.workers)
+        process = self._processes[index]
+        if process is not None and not process.is_alive() and not self._stopped.is_set():
+            # Упавший процесс заменяется новым; обновления в его очереди дождутся нового процесса
+            logger.error(f"Рабочий процесс {index} диспетчера завершился с кодом "
+                         f"{getattr(process, 'exitcode', None)}, перезапуск")
+            self._start_worker(index)
+        self._queues[index].put(update)
+        self.dispatched[index] += 1
+
+    def accept(self, updates):
+        """
+        Записывает полученные обновления в журнал и передает их рабочим процессам.
+
+        Args:
+            updates (list): Обновления (dict) по порядку update_id.
+        """
+        if self.journal is not None:
+            self.journal.accept(updates)
+        for update in updates:
+            self.dispatch(update)
+
+    def journal_json(self, data):
+        """
+        Разбирает обновление из тела запроса вебхука и записывает его в журнал.
+        Вызывается до ответа Telegram, поэтому обновление, на которое отправлен
+        ответ 200, не теряется при аварийном завершении; передает его рабочему
+        процессу dispatch. Повторная запись того же обновления ничего не меняет.
+
+        Args:
+            data (bytes): JSON обновления.
+
+        Returns:
+            dict: Обновление.
+        """
+        update = json.loads(data)
+        if self.journal is not None:
+            self.journal.accept([update])
+        return update
+
+    def poll(self, get_updates, timeout=20, limit=100, offset=None):
+        """
+        Получает обновления долгим опросом и передает их рабочим процессам,
+        пока не будет вызван stop.
+
+        Args:
+            get_updates (function): Функция get_updates(offset, limit, timeout), возвращающая список
+                обновлений (dict), например telebot.apihelper.get_updates с токеном бота.
+            timeout (int): Время долгого опроса в секундах.
+            limit (int): Максимальное количество обновлений за запрос.
+            offset (int): update_id, с которого начинать (None - из журнала или первое неподтвержденное).
+
+        Returns:
+            int | None: update_id следующего обновления.
+        """
+        if offset is None and self.journal is not None:
+            offset = self.journal.offset
+        while not self._stopped.is_set():
+            try:
+                updates = get_updates(offset, limit, timeout)
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновлений: {e}")
+                self._stopped.wait(POLL_ERROR_DELAY)
+                continue
+            if not updates:
+                continue
+            # Обновления записываются в журнал до того, как следующий запрос подтвердит их Telegram
+            self.accept(updates)
+            offset = updates[-1]['update_id'] + 1
+        return offset
+
+    def depths(self):
+        """
+        Возвращает количество обновлений в очереди каждого рабочего процесса.
+        """
+        depths = []
+        for updates in self._queues:
+            try:
+                depths.append(updates.qsize())
+            except NotImplementedError:
+                # qsize не поддерживается на macOS
+                depths.append(0)
+        return depths
+
+    def stop(self):
+        """
+        Останавливает опрос в poll после текущего запроса.
+        """
+        self._stopped.set()
+
+    def shutdown(self, timeout=None):
+        """
+        Останавливает опрос и рабочие процессы. Процессы обрабатывают уже
+        полученные обновления и завершаются. Процессы, не успевшие за timeout,
+        останавливаются; их необработанные обновления остаются в журнале и
+        будут обработаны после перезапуска.
+
+        Args:
+            timeout (float): Общее время ожидания в секундах (None - без ограничения).
+        """
+        self.stop()
+        for updates, process in zip(self._queues, self._processes):
+            if process is not None and process.is_alive():
+                updates.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if not process.is_alive():
+                continue
+            logger.error(f"Рабочий процесс {index} диспетчера не завершился вовремя и будет остановлен")
+            if not self.local:
+                process.terminate()
+                process.join()
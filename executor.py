@@ -0,0 +1,247 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageMode
+
+import image_ops
+from dispatcher import ignore_shutdown_signals
+
+
+# Исключение, возникающее при переполнении очереди задач
+class BusyError(Exception):
+    """
+    Очередь задач обработки заполнена, новую задачу нужно повторить позже.
+    """
+
+
+# Функция для подготовки рабочего процесса пула
+def _init_worker():
+    # Сигналы остановки процессы игнорируют: начатые задачи завершаются, а пул останавливает shutdown
+    ignore_shutdown_signals()
+    # Если процесс бота завершился аварийно, рабочий процесс не должен остаться сиротой
+    threading.Thread(target=_exit_with_parent, args=(multiprocessing.parent_process(),), daemon=True,
+                     name='parent-watch').start()
+
+
+def _exit_with_parent(parent):
+    parent.join()
+    os._exit(1)
+
+
+# Размер части изображения, которую кодировщик raw записывает в общую память за один вызов
+SHARE_CHUNK_SIZE = 1024 * 1024
+
+
+# Функция для получения размера сырых пикселей изображения
+def _raw_size(image):
+    # Столько же байт возвращает image.tobytes()
+    if image.mode == '1':
+        return (image.width + 7) // 8 * image.height
+    mode = ImageMode.getmode(image.mode)
+    return image.width * image.height * len(mode.bands) * int(mode.typestr[2:])
+
+
+# Функция для передачи изображения через общую память
+def _share_image(image):
+    # Записываем сырые пиксели прямо в блок общей памяти, чтобы не сериализовать объект PIL через pickle.
+    # Кодировщик raw (его же использует tobytes) отдает пиксели частями, поэтому копия всего изображения
+    # в промежуточном буфере не создается
+    image.load()
+    length = _raw_size(image)
+    block = shared_memory.SharedMemory(create=True, size=max(length, 1))
+    try:
+        if length:
+            encoder = Image._getencoder(image.mode, 'raw', image.mode)
+            encoder.setimage(image.im)
+            # Кодировщику нужно место хотя бы для одной строки изображения
+            chunk_size = max(SHARE_CHUNK_SIZE, length // image.height)
+            offset = 0
+            while True:
+                _, status, chunk = encoder.encode(chunk_size)
+                block.buf[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+                if status:
+                    break
+            if status < 0 or offset != length:
+                raise RuntimeError(f"Ошибка кодировщика raw {status} при передаче изображения")
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    palette = image.getpalette() if image.mode in ('P', 'PA') else None
+    header = (block.name, image.mode, image.size, length, palette)
+    block.close()
+    return header
+
+
+def _attach_image(header):
+    # Собираем изображение из блока общей памяти и освобождаем блок
+    name, mode, size, length, palette = header
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        buffer = block.buf[:length]
+        try:
+            image = Image.frombuffer(mode, size, buffer, 'raw', mode, 0, 1)
+            # Для режимов L, P, RGBA и др. изображение ссылается на общую память: копируем его один раз
+            # перед освобождением блока; остальные режимы frombuffer уже скопировал при чтении
+            if image.readonly:
+                image = image.copy()
+        finally:
+            buffer.release()
+    finally:
+        block.close()
+        block.unlink()
+    if palette is not None:
+        image.putpalette(palette)
+    return image
+
+
+def _run_in_worker(transform_name, header, args, user_id):
+    # Выполняется в рабочем процессе: читает исходное изображение и возвращает результат через общую память
+    image = _attach_image(header)
+    result = image_ops.TRANSFORMS[transform_name](image, *args, user_id=user_id)
+    return _share_image(result)
+
+
+# Исполнитель, выполняющий обработку в вызывающем потоке
+class InlineExecutor:
+    """
+    Выполняет функции обработки прямо в потоке обработчика, без пула процессов.
+    """
+
+    def submit(self, transform_name, image, *args, user_id=None):
+        """
+        Выполняет функцию обработки и возвращает завершенный Future.
+
+        Args:
+            transform_name (str): Название функции обработки из image_ops.TRANSFORMS.
+            image (PIL.Image): Исходное изображение.
+            *args: Дополнительные аргументы для функции обработки.
+            user_id (int): ID пользователя.
+
+        Returns:
+            concurrent.futures.Future: Future с обработанным изображением.
+        """
+        future = Future()
+        try:
+            future.set_result(image_ops.TRANSFORMS[transform_name](image, *args, user_id=user_id))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @property
+    def pending(self):
+        """
+        Возвращает количество задач в работе и в очереди.
+        """
+        return 0
+
+    def run(self, transform_name, image, *args, user_id=None):
+        """
+        Выполняет функцию обработки и возвращает обработанное изображение.
+        """
+        return self.submit(transform_name, image, *args, user_id=user_id).result()
+
+    def shutdown(self):
+        pass
+
+
+# Исполнитель, выполняющий обработку в пуле процессов
+class ProcessPoolTransformExecutor(InlineExecutor):
+    """
+    Выполняет функции обработки в пуле процессов, чтобы тяжелые операции Pillow
+    не занимали потоки обработчиков и не упирались в GIL.
+
+    Изображения передаются в процессы и обратно как сырые пиксели через общую
+    память. Количество задач в работе и в очереди ограничено: при переполнении
+    submit сразу выбрасывает BusyError.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        """
+        Args:
+            max_workers (int): Количество рабочих процессов (по умолчанию - число ядер).
+            max_pending (int): Максимальное количество задач в работе и в очереди
+                (по умолчанию - удвоенное число процессов).
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        # Процессы запускаются через spawn: fork процесса с потоками бота может унаследовать захваченные блокировки
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        # Количество задач в работе и в очереди для метрик
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _add_pending(self, delta):
+        with self._pending_lock:
+            self._pending += delta
+
+    def submit(self, transform_name, image, *args, user_id=None):
+        if transform_name not in image_ops.TRANSFORMS:
+            raise ValueError(f"Неизвестная функция обработки: {transform_name}")
+        # Не ждем освобождения места: при заполненной очереди сразу сообщаем о занятости
+        if not self._slots.acquire(blocking=False):
+            raise BusyError("Очередь обработки изображений заполнена")
+        self._add_pending(1)
+        result = Future()
+        try:
+            header = _share_image(image)
+            worker_future = self._pool.submit(_run_in_worker, transform_name, header, args, user_id)
+        except Exception:
+            self._add_pending(-1)
+            self._slots.release()
+            raise
+
+        def on_done(done):
+            self._add_pending(-1)
+            self._slots.release()
+            try:
+                result.set_result(_attach_image(done.result()))
+            except Exception as e:
+                # Если задача не выполнилась, блок с исходным изображением мог остаться неосвобожденным
+                self._discard(header)
+                result.set_exception(e)
+
+        worker_future.add_done_callback(on_done)
+        return result
+
+    @staticmethod
+    def _discard(header):
+        try:
+            block = shared_memory.SharedMemory(name=header[0])
+        except FileNotFoundError:
+            return
+        block.close()
+        block.unlink()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+# Функция для создания исполнителя по названию
+def create_executor(kind, max_workers=None, max_pending=None):
+    """
+    Создает исполнитель функций обработки изображений.
+
+    Args:
+        kind (str): 'inline' - обработка в потоке обработчика, 'process' - в пуле процессов.
+        max_workers (int): Количество рабочих процессов.
+        max_pending (int): Максимальное количество задач в работе и в очереди.
+
+    Returns:
+        InlineExecutor: Исполнитель.
+    """
+    if kind == 'inline':
+        return InlineExecutor()
+    if kind == 'process':
+        return ProcessPoolTransformExecutor(max_workers, max_pending)
+    raise ValueError(f"Неизвестный тип исполнителя: {kind}")
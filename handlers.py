@@ -0,0 +1,1090 @@
+import functools
+import io
+import logging
+import random
+
+from PIL import Image, UnidentifiedImageError
+from telebot import types
+
+from admission import AdmissionController, ImageTooLargeError
+from config import (ADMISSION_MAX_PIXELS, ADMISSION_MEMORY_BYTES, ADMISSION_REJECT_PIXELS, ADMISSION_TIMEOUT,
+                    MEDIA_GROUP_DELAY, METRICS_HOST, METRICS_PORT, RESULT_CACHE_DIR, RESULT_CACHE_DISK_BYTES,
+                    RESULT_CACHE_MEMORY_BYTES, RESULT_MAX_BYTES, SEND_RESULTS_AS_DOCUMENT, SESSION_DB_PATH,
+                    SESSION_MEMORY_ENTRIES, SESSION_STORE, SESSION_TTL, TRANSFORM_EXECUTOR, TRANSFORM_QUEUE_SIZE,
+                    TRANSFORM_WORKERS)
+from executor import BusyError, create_executor
+from helpers import COMMANDS_MESSAGE, get_help_text, get_photo_sizes, is_chat_unreachable
+from image_ops import TRANSFORMS, image_to_ascii, run_pipeline, plan_decode, select_photo_size
+from keyboards import get_commands_keyboard, get_options_keyboard, get_pipeline_keyboard
+from lists import JOKES, COMPLIMENTS
+from log_utils import log_function
+from media_groups import MediaGroupCollector
+from metrics import BYTES, CallbackCounter, Gauge, MetricsServer, count_error, phase, registry, start_phase
+from output_formats import encode_image, get_file_name, get_output_policy, get_output_tag
+from operations import OPERATIONS
+from pipeline import MAX_PIPELINE_STEPS, PIPELINE_STEPS, check_pipeline_size, parse_pipeline, steps_from_names
+from result_cache import ResultCache
+from router import Router, get_command
+from session_store import create_session_store
+from single_flight import DuplicateRequestError, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Среда выполнения обработчиков
+class Runtime:
+    """
+    Общие объекты бота и операции, которые по-разному выполняются в потоках
+    (bot.py) и в цикле событий (async_bot.py).
+
+    Обработчики этого модуля - корутины: методы бота, кэша исходных
+    фотографий и операции среды вызываются через await. В bot.py это обычные
+    блокирующие вызовы, и корутина выполняется до конца в потоке обработчика
+    без цикла событий; в async_bot.py ожидание не занимает поток.
+    """
+
+    # Классы объединения одинаковых запросов и контроля допуска по памяти
+    flights_class = SingleFlight
+    admission_class = AdmissionController
+
+    def __init__(self, bot, outbound, source_cache, transform_workers=TRANSFORM_WORKERS):
+        """
+        Args:
+            bot: Бот, методы которого вызываются через await.
+            outbound (OutboundScheduler): Планировщик исходящих запросов бота.
+            source_cache: Кэш исходных фотографий, методы которого вызываются через await.
+            transform_workers (int): Количество процессов обработки (None - число ядер).
+        """
+        self.bot = bot
+        self.outbound = outbound
+        self.source_cache = source_cache
+        # Одинаковые запросы (фотография, операция и параметры), пришедшие во время обработки, дожидаются ее результата
+        self.flights = self.flights_class()
+        # Контроль допуска задач обработки по памяти
+        self.admission = self.admission_class(ADMISSION_MAX_PIXELS, ADMISSION_REJECT_PIXELS, ADMISSION_MEMORY_BYTES,
+                                              ADMISSION_TIMEOUT)
+        # Pillow сам отказывается открывать файлы больше удвоенного MAX_IMAGE_PIXELS: запасная защита от бомб распаковки
+        Image.MAX_IMAGE_PIXELS = ADMISSION_REJECT_PIXELS
+        # Хранилище состояний пользователей
+        self.user_states = create_session_store(SESSION_STORE, SESSION_DB_PATH, SESSION_TTL, SESSION_MEMORY_ENTRIES)
+        # Кэш готовых результатов обработки, общий для всех чатов
+        self.result_cache = ResultCache(RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_BYTES)
+        # Исполнитель функций обработки изображений
+        self.transform_executor = create_executor(TRANSFORM_EXECUTOR, transform_workers, TRANSFORM_QUEUE_SIZE)
+
+    async def run_blocking(self, func, *args):
+        """
+        Выполняет блокирующую функцию: декодирование, кодирование, работу с кэшем результатов,
+        постановку задачи в исполнитель (копирование пикселей в общую память).
+        """
+        raise NotImplementedError
+
+    async def wait(self, future):
+        """
+        Дожидается результата Future исполнителя или подтверждения из send_ack.
+        """
+        raise NotImplementedError
+
+    async def wait_first(self, futures):
+        """
+        Дожидается завершения хотя бы одного из Future исполнителя.
+        """
+        raise NotImplementedError
+
+    async def acquire(self, nbytes):
+        """
+        Резервирует память задачи обработки (см. AdmissionController.acquire).
+
+        Returns:
+            Reservation: Резервирование, которое нужно освободить после обработки.
+        """
+        raise NotImplementedError
+
+    async def coalesce(self, key, func, *args, scope=None):
+        """
+        Выполняет корутинную функцию func(*args) или дожидается такой же
+        выполняющейся задачи с тем же ключом (см. SingleFlight). Повторный
+        запрос того же получателя scope завершается ошибкой DuplicateRequestError.
+        """
+        raise NotImplementedError
+
+    def start(self, coroutine):
+        """
+        Запускает корутину в фоне и сразу возвращается.
+
+        Returns:
+            concurrent.futures.Future | asyncio.Task: Результат корутины, который можно передать в wait.
+        """
+        raise NotImplementedError
+
+    def schedule(self, delay, callback):
+        """
+        Вызывает callback через delay секунд.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Дожидается завершения задач обработки и сохраняет состояния пользователей.
+        """
+        self.transform_executor.shutdown()
+        self.user_states.close()
+
+
+# Обертка, через которую обработчики вызывают методы блокирующего объекта через await
+class Awaitable:
+    """
+    Делает методы объекта корутинными функциями. Вызов выполняется сразу, в
+    потоке, который выполняет корутину.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+# Среда выполнения и ее объекты, которыми пользуются обработчики; заполняются функцией setup
+runtime = None
+bot = None
+user_states = None
+result_cache = None
+source_cache = None
+admission = None
+transform_executor = None
+media_groups = None
+
+
+# Функция для подключения обработчиков к среде выполнения
+def setup(new_runtime):
+    """
+    Подключает обработчики к среде выполнения и регистрирует метрики бота.
+    Вызывается один раз при запуске bot.py или async_bot.py.
+
+    Args:
+        new_runtime (Runtime): Среда выполнения.
+    """
+    global runtime, bot, user_states, result_cache, source_cache, admission, transform_executor, media_groups
+    runtime = new_runtime
+    bot = runtime.bot
+    user_states = runtime.user_states
+    result_cache = runtime.result_cache
+    source_cache = runtime.source_cache
+    admission = runtime.admission
+    transform_executor = runtime.transform_executor
+    # Сборщик частей альбомов: альбом считается полученным через секунду после последней фотографии
+    media_groups = MediaGroupCollector(lambda messages: runtime.start(handle_album(messages,
+                                                                                  user_id=messages[0].chat.id)),
+                                       runtime.schedule, MEDIA_GROUP_DELAY)
+    register_metrics()
+
+
+# Функция для скачивания фотографии по ее ID
+async def download_photo(photo_id):
+    """
+    Скачивает файл фотографии с серверов Telegram.
+
+    Args:
+        photo_id (str): ID файла в Telegram.
+
+    Returns:
+        bytes: Содержимое файла.
+    """
+    # Получаем информацию о файле по его ID
+    file_info = await bot.get_file(photo_id)
+    # Скачиваем файл изображения
+    data = await bot.download_file(file_info.file_path)
+    BYTES.inc(len(data), direction='in')
+    return data
+
+
+# Функция для обработки ошибок
+async def handle_error(message, error_message, error=None):
+    if error is not None:
+        count_error('handle_error', error)
+    # Если бот больше не может писать в чат, удаляем его состояние и не пытаемся отправить сообщение об ошибке
+    if forget_unreachable_chat(message.chat.id, error):
+        return
+    # Логируем ошибку с использованием переданного сообщения об ошибке
+    logger.error(f"Ошибка для пользователя с ID {message.chat.id}: {error_message}")
+    try:
+        # Отправляем сообщение пользователю о том, что произошла ошибка при обработке изображения
+        await bot.send_message(message.chat.id, "Произошла ошибка при обработке изображения.")
+    except Exception as e:
+        if not forget_unreachable_chat(message.chat.id, e):
+            raise
+
+
+# Функция для удаления состояния чата, в который бот больше не может писать
+def forget_unreachable_chat(chat_id, error):
+    """
+    Удаляет состояние чата, если ошибка отправки означает, что чат недоступен
+    (например, бот заблокирован пользователем).
+
+    Args:
+        chat_id (int): ID чата.
+        error (Exception): Ошибка, возникшая при отправке (None - ошибки не было).
+
+    Returns:
+        bool: True, если состояние чата удалено.
+    """
+    if error is None or not is_chat_unreachable(error):
+        return False
+    user_states.pop(chat_id, None)
+    logger.info(f"Сброс истории событий для чата с ID {chat_id}: {error}")
+    return True
+
+
+# Функция для отправки подтверждения параллельно с обработкой
+def send_ack(method, *args, **kwargs):
+    """
+    Запускает запрос к Telegram (ответ на кнопку или сообщение о начале
+    обработки) в фоне и сразу возвращается: подтверждение уходит, пока
+    обработчик скачивает и обрабатывает фотографию, а не перед этим.
+
+    Args:
+        method (function): Метод бота, например bot.answer_callback_query.
+        *args: Аргументы метода.
+        **kwargs: Именованные аргументы метода.
+
+    Returns:
+        concurrent.futures.Future | asyncio.Task: Ответ Telegram, который можно дождаться через runtime.wait.
+    """
+    def log_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            count_error('send_ack', future.exception())
+            logger.error(f"Ошибка при отправке подтверждения {method.__name__}: {future.exception()}")
+
+    future = runtime.start(method(*args, **kwargs))
+    future.add_done_callback(log_error)
+    return future
+
+
+# Функция для отправки сообщения о начале обработки, которое заменяется результатом
+def send_placeholder(message, text):
+    """
+    Отправляет ответ на команду о начале обработки параллельно с обработкой.
+
+    Telegram может заменить через editMessageMedia только медиа, поэтому для
+    одиночной фотографии ответом служит сама исходная фотография (по file_id,
+    без загрузки) с подписью text; send_result затем заменяет ее результатом.
+    Для альбома и чата без фотографии отправляется обычный текстовый ответ;
+    ответ на альбом process_album удаляет, когда отправит результат.
+
+    Args:
+        message (telebot.types.Message): Сообщение с командой.
+        text (str): Текст о начале обработки.
+
+    Returns:
+        concurrent.futures.Future | asyncio.Task | None: Сообщение, которое можно заменить результатом, или None.
+    """
+    state = user_states.get(message.chat.id, {})
+    if not state.get('photo_sizes'):
+        send_ack(bot.reply_to, message, text)
+        return None
+    if len(state.get('album', ())) > 1:
+        return send_ack(bot.reply_to, message, text)
+    # Самый большой вариант - файл, который пользователь отправил сам: клиенту не нужно скачивать его заново
+    return send_ack(bot.send_photo, message.chat.id, state['photo_sizes'][-1][0], caption=text,
+                    reply_to_message_id=message.message_id, allow_sending_without_reply=True)
+
+
+# Маршрутизатор команд, кнопок и запросов обратного вызова по реестру операций
+router = Router()
+
+
+# Обработчик команд /start и /help
+@router.operation('start', 'help')
+@log_function
+async def send_welcome(message, user_id=None):
+    """
+    Обрабатывает команды /start и /help.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    if get_command(message.text) == 'start':
+        # Отправляем приветственное сообщение пользователю
+        await bot.reply_to(message, "Пришлите мне изображение, и я предложу вам варианты!",
+                           reply_markup=get_commands_keyboard(user_id=message.chat.id))
+    else:
+        # Отправляем текст справки пользователю
+        help_text = get_help_text()
+        await bot.reply_to(message, help_text)
+
+
+# Обработчик команды /random_joke
+@router.operation('random_joke')
+@log_function
+async def send_random_joke(message, user_id=None):
+    """
+    Отправляет пользователю случайную шутку из списка JOKES.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Выбираем случайную шутку из списка
+    joke = random.choice(JOKES)
+    # Отправляем шутку пользователю
+    await bot.reply_to(message, joke)
+
+
+# Обработчик команды /random_compliment
+@router.operation('random_compliment')
+@log_function
+async def send_random_compliment(message, user_id=None):
+    """
+    Отправляет пользователю случайный комплимент из списка COMPLIMENTS.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Выбираем случайный комплимент из списка
+    compliment = random.choice(COMPLIMENTS)
+    # Отправляем комплимент пользователю
+    await bot.reply_to(message, compliment)
+
+
+# Обработчик команды /flip_coin
+@router.operation('flip_coin')
+@log_function
+async def flip_coin(message, user_id=None):
+    """
+    Симулирует подбрасывание монетки и сообщает пользователю результат ("Орел" или "Решка").
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Случайный выбор между "Heads" и "Tails"
+    result = random.choice(["Орел", "Решка"])
+
+    # Отправляем результат пользователю
+    await bot.reply_to(message, f"Результат подбрасывания монетки: {result}")
+
+
+# Обработчик команд обработки изображений: /pixelate, /invert, /mirror_horizontal, /mirror_vertical,
+# /heatmap и /resize_sticker
+@router.operation(*(name for name, operation in OPERATIONS.items() if operation.command and operation.transform))
+@log_function
+async def handle_image_command(message, user_id=None):
+    """
+    Обрабатывает команду обработки изображения из реестра операций. После
+    команды можно указать параметры, например палитру: /heatmap viridis
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    operation = OPERATIONS[get_command(message.text)]
+    try:
+        # Разбираем параметры после команды
+        args = operation.get_args(message.text.partition(' ')[2])
+    except ValueError as e:
+        # Сообщаем пользователю, что не так в параметрах
+        await bot.reply_to(message, str(e))
+        return
+    # Сообщение о начале обработки отправляется параллельно с обработкой и затем заменяется результатом
+    placeholder = send_placeholder(message, operation.reply)
+    # Обрабатываем изображение с помощью функции обработки операции
+    await process_image(message, TRANSFORMS[operation.transform], *args, user_id=message.chat.id,
+                        placeholder=placeholder)
+
+
+# Обработчик команды /ascii
+@router.operation('ascii')
+@log_function
+async def handle_ascii(message, user_id=None):
+    """
+    Обрабатывает команду /ascii для преобразования изображения в ASCII-арт.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Отправляем сообщение о начале обработки
+    await bot.reply_to(message, "Преобразование вашего изображения в формат ASCII art...")
+    # Запрашиваем у пользователя набор символов для ASCII-арта
+    await bot.send_message(message.chat.id, "Пожалуйста, введите набор символов для ASCII-арта.")
+    # Устанавливаем состояние пользователя в ожидание ввода символов
+    user_states[message.chat.id] = {'ascii_chars': 'waiting'}
+
+
+# Обработчик команды /pipeline
+@router.operation('pipeline')
+@log_function
+async def handle_pipeline(message, user_id=None):
+    """
+    Обрабатывает команду /pipeline для применения нескольких эффектов по порядку,
+    например: /pipeline invert,mirror_horizontal,pixelate:12
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    try:
+        # Разбираем список эффектов после команды
+        steps = parse_pipeline(message.text.partition(' ')[2])
+        # Размер пикселя проверяем по размеру фотографии, который известен до ее загрузки
+        photo_sizes = user_states.get(message.chat.id, {}).get('photo_sizes')
+        if photo_sizes:
+            check_pipeline_size(steps, photo_sizes[-1][1:])
+    except ValueError as e:
+        # Сообщаем пользователю, что не так в описании конвейера
+        await bot.reply_to(message, str(e))
+        return
+    # Сообщение о начале обработки отправляется параллельно с обработкой и затем заменяется результатом
+    placeholder = send_placeholder(message, OPERATIONS['pipeline'].reply)
+    # Применяем все эффекты за одно декодирование и одно кодирование
+    await process_image(message, run_pipeline, steps, user_id=message.chat.id, placeholder=placeholder)
+
+
+# Обработчик получения фотографий
+@log_function
+async def handle_photo(message, user_id=None):
+    """
+    Обрабатывает полученные фотографии и предлагает пользователю варианты действий.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Заранее скачиваем самый большой вариант - его выбирает большинство операций, - чтобы первое нажатие кнопки
+    # не ждало сети. Меньшие варианты для ASCII-арта и стикера скачиваются только при выборе этих операций
+    await source_cache.prefetch(get_photo_sizes(message)[-1][0])
+    if message.media_group_id:
+        # Фотографии альбома приходят отдельными сообщениями: собираем их и отвечаем один раз на весь альбом
+        media_groups.add(message)
+        return
+    # Сохраняем ID фотографии, ее постоянный уникальный ID и инициализируем поле для символов ASCII-арта
+    # до отправки ответа, чтобы быстрые нажатия кнопок уже видели фотографию
+    user_states[message.chat.id] = {'photo': message.photo[-1].file_id,
+                                    'photo_unique_id': message.photo[-1].file_unique_id,
+                                    'photo_sizes': get_photo_sizes(message),
+                                    'ascii_chars': None}
+    # Отправляем ответное сообщение с предложением выбрать действие
+    await bot.reply_to(message, "У меня есть ваша фотография! Пожалуйста, выберите, что бы вы хотели с ней сделать.",
+                       reply_markup=get_options_keyboard(user_id=message.chat.id))
+
+
+# Функция для обработки полностью полученного альбома
+@log_function
+async def handle_album(messages, user_id=None):
+    """
+    Сохраняет все фотографии альбома и предлагает пользователю варианты действий.
+
+    Args:
+        messages (list): Сообщения альбома в порядке отправки.
+        user_id (int): ID пользователя.
+    """
+    first = messages[0]
+    # Сохраняем все фотографии альбома; первая используется для ASCII-арта
+    user_states[first.chat.id] = {'photo': first.photo[-1].file_id,
+                                  'photo_unique_id': first.photo[-1].file_unique_id,
+                                  'photo_sizes': get_photo_sizes(first),
+                                  'album': [(get_photo_sizes(message), message.photo[-1].file_unique_id)
+                                            for message in messages],
+                                  'ascii_chars': None}
+    await bot.reply_to(first, f"У меня есть ваш альбом из {len(messages)} фотографий! "
+                              f"Пожалуйста, выберите, что бы вы хотели с ним сделать.",
+                       reply_markup=get_options_keyboard(user_id=first.chat.id))
+
+
+# Обработчик кнопок обработки изображения
+@router.callback(*(name for name, operation in OPERATIONS.items() if operation.button and operation.transform))
+@log_function
+async def handle_image_callback(call, user_id=None):
+    """
+    Обрабатывает нажатие кнопки обработки изображения из реестра операций.
+
+    Args:
+        call (telebot.types.CallbackQuery): Запрос обратного вызова.
+        user_id (int): ID пользователя.
+    """
+    user_id = call.message.chat.id
+    operation = OPERATIONS[call.data]
+    # Отвечаем на запрос обратного вызова параллельно с обработкой
+    send_ack(bot.answer_callback_query, call.id, operation.reply)
+    # Обрабатываем изображение с помощью функции обработки операции
+    await process_image(call.message, TRANSFORMS[operation.transform], *operation.args, user_id=user_id)
+
+
+# Обработчик кнопки ASCII-арта
+@router.callback('ascii')
+@log_function
+async def request_ascii_chars(call, user_id=None):
+    """
+    Запрашивает у пользователя набор символов для ASCII-арта.
+
+    Args:
+        call (telebot.types.CallbackQuery): Запрос обратного вызова.
+        user_id (int): ID пользователя.
+    """
+    # Отвечаем на запрос обратного вызова, чтобы показать индикатор загрузки
+    await bot.answer_callback_query(call.id, OPERATIONS['ascii'].reply)
+    # Запрашиваем у пользователя набор символов для ASCII-арта
+    await bot.send_message(call.message.chat.id, "Пожалуйста, введите набор символов для ASCII-арта.")
+    # Устанавливаем состояние пользователя в ожидание ввода символов
+    user_states.update(call.message.chat.id, ascii_chars='waiting')
+
+
+# Обработчик кнопок выбора нескольких эффектов
+@router.callback('pipeline', 'pipeline_toggle', 'pipeline_reset')
+@log_function
+async def edit_pipeline(call, user_id=None):
+    """
+    Показывает клавиатуру выбора нескольких эффектов, добавляет эффект в конец
+    конвейера или убирает его, если он уже выбран, и сбрасывает выбор.
+
+    Args:
+        call (telebot.types.CallbackQuery): Запрос обратного вызова.
+        user_id (int): ID пользователя.
+    """
+    user_id = call.message.chat.id
+    selected = user_states[call.message.chat.id].get('pipeline', [])
+    if call.data == "pipeline":
+        # Показываем клавиатуру выбора нескольких эффектов вместо списка вариантов
+        await bot.answer_callback_query(call.id, "Выберите эффекты по порядку и нажмите «Применить»")
+    else:
+        name = call.data.partition(':')[2]
+        if call.data == "pipeline_reset":
+            # Сбрасываем выбранные эффекты
+            selected = []
+        elif name in selected:
+            selected.remove(name)
+        elif name in PIPELINE_STEPS and len(selected) < MAX_PIPELINE_STEPS:
+            selected.append(name)
+        # Состояние хранится в хранилище, а не в общем словаре: записываем изменения обратно
+        user_states.update(call.message.chat.id, pipeline=selected)
+        await bot.answer_callback_query(call.id)
+    await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id,
+                                        reply_markup=get_pipeline_keyboard(selected, user_id=user_id))
+
+
+# Обработчик кнопки запуска нескольких эффектов
+@router.callback('pipeline_run')
+@log_function
+async def run_selected_pipeline(call, user_id=None):
+    """
+    Применяет выбранные кнопками эффекты по порядку.
+
+    Args:
+        call (telebot.types.CallbackQuery): Запрос обратного вызова.
+        user_id (int): ID пользователя.
+    """
+    user_id = call.message.chat.id
+    selected = user_states[call.message.chat.id].get('pipeline', [])
+    if not selected:
+        await bot.answer_callback_query(call.id, "Сначала выберите хотя бы один эффект.")
+        return
+    # Отвечаем на запрос обратного вызова параллельно с обработкой
+    send_ack(bot.answer_callback_query, call.id, OPERATIONS['pipeline'].reply)
+    # Применяем все выбранные эффекты за одно декодирование и одно кодирование
+    await process_image(call.message, run_pipeline, steps_from_names(selected), user_id=user_id)
+
+
+# Обработчик текста, для которого нет команды или кнопки
+@router.fallback
+async def handle_other_text(message, user_id=None):
+    # Текст считается набором символов для ASCII-арта, только если бот его ждет
+    if user_states.get(message.chat.id, {}).get('ascii_chars') == 'waiting':
+        await get_ascii_chars(message, user_id=message.chat.id)
+
+
+# Обработчик ввода символов для ASCII-арта
+@log_function
+async def get_ascii_chars(message, user_id=None):
+    """
+    Обрабатывает ввод пользователем символов для ASCII-арта.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Сохраняем введенные пользователем символы для ASCII-арта
+    user_states.update(message.chat.id, ascii_chars=message.text)
+    # Вызываем функцию для обработки ASCII-арта с использованием введенных символов
+    await process_ascii_art(message, user_id=message.chat.id)
+
+
+# Функция для получения ключа кэша результатов
+def get_result_cache_key(chat_id, operation, *args):
+    """
+    Формирует ключ кэша результатов для фотографии из состояния пользователя.
+
+    Args:
+        chat_id (int): ID чата.
+        operation (str): Название функции обработки.
+        *args: Параметры функции обработки.
+
+    Returns:
+        str | None: Ключ кэша или None, если уникальный ID фотографии неизвестен.
+    """
+    # file_unique_id одинаков для одного и того же файла во всех чатах, в отличие от file_id
+    photo_unique_id = user_states.get(chat_id, {}).get('photo_unique_id')
+    if not photo_unique_id:
+        return None
+    return ResultCache.make_key(photo_unique_id, operation, *args)
+
+
+# Функция для запуска обработки фотографии в исполнителе
+async def submit_transform(photo_id, operation, args, user_id=None):
+    """
+    Готовит исходное изображение и ставит его обработку в очередь исполнителя.
+
+    Args:
+        photo_id (str): ID файла в Telegram.
+        operation (str): Название функции обработки.
+        args (tuple): Аргументы функции обработки.
+        user_id (int): ID пользователя.
+
+    Returns:
+        concurrent.futures.Future: Future с обработанным изображением.
+    """
+    # Дожидаемся исходного файла (скачивается только при промахе кэша)
+    with phase(operation, 'download'):
+        await source_cache.get_bytes(photo_id)
+    with phase(operation, 'admission'):
+        # Получаем размер исходного изображения по заголовку файла
+        width, height = await source_cache.get_size(photo_id)
+        # Логируем информацию о размере изображения и пользователе
+        logger.info(f"Пользователь с ID {user_id} обрабатывает изображение размером {width}x{height} пикселей")
+        # Отклоняем слишком большое изображение до декодирования, а большое уменьшаем до бюджета пикселей
+        source_size = admission.limit_size((width, height))
+        # Определяем, до какого размера можно уменьшить изображение при декодировании
+        decode_size, transform_args = plan_decode(operation, source_size, args)
+        if decode_size is None and source_size != (width, height):
+            decode_size = source_size
+        # Резервируем память задачи; если ее не хватает, ждем завершения других задач
+        reservation = await runtime.acquire(admission.estimate(operation, source_size, decode_size))
+    try:
+        with phase(operation, 'decode'):
+            # Получаем декодированное исходное изображение из кэша; уменьшение, копирование пикселей в общую
+            # память и обработка исполнителем 'inline' выполняются вне цикла событий async_bot.py
+            image = await runtime.run_blocking(admission.fit, await source_cache.get_image(photo_id, decode_size))
+        # Время обработки считается от постановки в очередь до готового результата
+        finish_phase = start_phase(operation, 'transform')
+        future = await runtime.run_blocking(functools.partial(transform_executor.submit, operation, image,
+                                                              *transform_args, user_id=user_id))
+    except BaseException:
+        reservation.release()
+        raise
+    future.add_done_callback(finish_phase)
+    # Память освобождается, когда обработка завершена
+    future.add_done_callback(reservation.release)
+    return future
+
+
+# Функция для выбора формата и способа отправки результата
+def get_output(operation, args):
+    return get_output_policy(operation, args, SEND_RESULTS_AS_DOCUMENT, RESULT_MAX_BYTES)
+
+
+# Функция для кодирования результата обработки
+def encode_result(image, operation, policy):
+    with phase(operation, 'encode'):
+        return encode_image(image, policy)
+
+
+# Функция для подготовки результата к отправке в альбоме
+def get_input_media(data, policy):
+    if policy['document']:
+        return types.InputMediaDocument(types.InputFile(io.BytesIO(data), get_file_name(policy)))
+    return types.InputMediaPhoto(data)
+
+
+# Функция для отправки готового результата пользователю
+async def send_result(chat_id, data, operation, policy, placeholder=None):
+    """
+    Отправляет результат новым сообщением или, если передан placeholder,
+    заменяет им сообщение о начале обработки.
+
+    Args:
+        chat_id (int): ID чата.
+        data (bytes): Закодированный результат.
+        operation (str): Название функции обработки.
+        policy (dict): Формат и способ отправки из get_output.
+        placeholder: Сообщение из send_placeholder (None - без замены).
+    """
+    # Время отправки включает ожидание очереди исходящих запросов
+    with phase(operation, 'upload'):
+        if placeholder is None or not await replace_placeholder(chat_id, data, policy, placeholder):
+            if policy['document']:
+                # Документ Telegram не пережимает, и пользователь получает файл в исходном формате
+                await bot.send_document(chat_id, io.BytesIO(data), visible_file_name=get_file_name(policy))
+            else:
+                await bot.send_photo(chat_id, io.BytesIO(data))
+    BYTES.inc(len(data), direction='out')
+
+
+# Функция для получения готового результата из кэша или обработкой изображения
+async def get_result(photo_id, operation, args, policy, cache_key, user_id=None):
+    """
+    Возвращает закодированный результат из кэша или обрабатывает изображение,
+    кодирует результат и сохраняет его в кэше.
+
+    Args:
+        photo_id (str): ID файла в Telegram.
+        operation (str): Название функции обработки.
+        args (tuple): Аргументы функции обработки.
+        policy (dict): Формат и способ отправки из get_output.
+        cache_key (str | None): Ключ кэша результатов (None - без кэша).
+        user_id (int): ID пользователя.
+
+    Returns:
+        bytes: Закодированный результат.
+    """
+    cached_result = await runtime.run_blocking(result_cache.get, cache_key) if cache_key else None
+    if cached_result is not None:
+        # Отдаем сохраненный результат без скачивания и повторной обработки
+        logger.info(f"Пользователь с ID {user_id} получает результат из кэша: {result_cache.stats()}")
+        return cached_result
+    # Обрабатываем изображение с помощью переданной функции и аргументов в исполнителе
+    processed_image = await runtime.wait(await submit_transform(photo_id, operation, args, user_id))
+    # Кодируем обработанное изображение в формате, подходящем для операции
+    result = await runtime.run_blocking(encode_result, processed_image, operation, policy)
+    # Сохраняем закодированный результат в кэше
+    if cache_key:
+        await runtime.run_blocking(result_cache.put, cache_key, result)
+    return result
+
+
+# Функция для замены сообщения о начале обработки результатом
+async def replace_placeholder(chat_id, data, policy, placeholder):
+    """
+    Заменяет сообщение о начале обработки результатом через edit_message_media.
+
+    Returns:
+        bool: True, если сообщение заменено; False - результат нужно отправить новым сообщением.
+    """
+    try:
+        # Сообщение о начале обработки к этому моменту обычно уже отправлено
+        message = await runtime.wait(placeholder)
+    except Exception:
+        # Ошибка уже записана в журнал send_ack
+        return False
+    try:
+        await bot.edit_message_media(get_input_media(data, policy), chat_id=chat_id, message_id=message.message_id)
+        return True
+    except Exception as e:
+        if forget_unreachable_chat(chat_id, e):
+            raise
+        logger.error(f"Не удалось заменить сообщение о начале обработки в чате с ID {chat_id}: {e}")
+    # Результат придет новым сообщением, и подпись о начале обработки не должна остаться в чате
+    await delete_placeholder(chat_id, message)
+    return False
+
+
+# Функция для удаления сообщения о начале обработки, которое не будет заменено результатом
+async def discard_placeholder(chat_id, placeholder):
+    """
+    Удаляет сообщение о начале обработки, если обработка не дала результата
+    (очередь занята, изображение слишком большое или произошла ошибка).
+
+    Args:
+        chat_id (int): ID чата.
+        placeholder: Сообщение из send_placeholder (None - ничего не делать).
+    """
+    if placeholder is None:
+        return
+    try:
+        message = await runtime.wait(placeholder)
+    except Exception:
+        # Сообщение не отправлено, ошибка уже записана в журнал send_ack
+        return
+    await delete_placeholder(chat_id, message)
+
+
+async def delete_placeholder(chat_id, message):
+    try:
+        await bot.delete_message(chat_id, message.message_id)
+    except Exception as e:
+        # Оставшееся сообщение не мешает ответу пользователю
+        logger.error(f"Не удалось удалить сообщение о начале обработки в чате с ID {chat_id}: {e}")
+
+
+# Функция для обработки альбома и отправки результата одной группой
+@log_function
+async def process_album(message, image_processing_func, *args, user_id=None, placeholder=None):
+    """
+    Применяет функцию обработки ко всем фотографиям альбома одновременно и отправляет
+    результаты одним вызовом send_media_group.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        image_processing_func (function): Функция для обработки изображения.
+        *args: Дополнительные аргументы для функции обработки изображения.
+        user_id (int): ID пользователя.
+        placeholder: Текстовое сообщение о начале обработки из send_placeholder, которое
+            удаляется после отправки результата или перед сообщением об ошибке.
+    """
+    operation = image_processing_func.__name__
+    try:
+        try:
+            photos = user_states[message.chat.id]['album']
+            results = [None] * len(photos)
+            policy = get_output(operation, args)
+            cache_keys = [ResultCache.make_key(unique_id, operation, *args, get_output_tag(policy))
+                          for _, unique_id in photos]
+            pending = {}
+            for index, (photo_sizes, _) in enumerate(photos):
+                photo_id = select_photo_size(operation, photo_sizes, args)
+                # Готовые результаты берем из кэша, остальные фотографии ставим в очередь исполнителя
+                results[index] = await runtime.run_blocking(result_cache.get, cache_keys[index])
+                if results[index] is not None:
+                    continue
+                while True:
+                    try:
+                        pending[index] = await submit_transform(photo_id, operation, args, user_id)
+                        break
+                    except BusyError:
+                        # Если очередь занята нашими же задачами, дожидаемся одной из них, иначе сдаемся
+                        running = [future for future in pending.values() if not future.done()]
+                        if not running:
+                            raise
+                        await runtime.wait_first(running)
+            for index, future in pending.items():
+                results[index] = await runtime.run_blocking(encode_result, await runtime.wait(future), operation,
+                                                            policy)
+                await runtime.run_blocking(result_cache.put, cache_keys[index], results[index])
+            # Отправляем все результаты одной группой
+            with phase(operation, 'upload'):
+                await bot.send_media_group(message.chat.id,
+                                           [get_input_media(result, policy) for result in results])
+        finally:
+            # Альбом нельзя поставить на место текстового сообщения о начале обработки, поэтому оно удаляется
+            await discard_placeholder(message.chat.id, placeholder)
+        BYTES.inc(sum(len(result) for result in results), direction='out')
+    except BusyError as e:
+        count_error('process_album', e)
+        logger.info(f"Очередь обработки заполнена, запрос пользователя с ID {user_id} отклонен")
+        await bot.send_message(message.chat.id, "Бот сейчас занят, попробуйте еще раз через несколько секунд.")
+    except (ImageTooLargeError, Image.DecompressionBombError) as e:
+        # Изображение слишком большое: отказываемся его обрабатывать, не декодируя
+        count_error('process_album', e)
+        logger.info(f"Изображение пользователя с ID {user_id} отклонено: {e}")
+        await bot.send_message(message.chat.id, "Изображение слишком большое для обработки.")
+    except UnidentifiedImageError as e:
+        await handle_error(message, "Ошибка при открытии изображения", e)
+    except Exception as e:
+        await handle_error(message, f"Ошибка при обработке и отправке альбома: {e}", e)
+
+
+# Функция для обработки изображения и отправки результата
+@log_function
+async def process_image(message, image_processing_func, *args, user_id=None, placeholder=None):
+    """
+    Обрабатывает изображение с помощью переданной функции и отправляет результат пользователю.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        image_processing_func (function): Функция для обработки изображения.
+        *args: Дополнительные аргументы для функции обработки изображения.
+        user_id (int): ID пользователя.
+        placeholder: Сообщение о начале обработки из send_placeholder, которое заменяется
+            результатом, а если результата нет - удаляется (None - результат отправляется новым сообщением).
+    """
+    # Альбом обрабатывается целиком и отправляется одной группой
+    if len(user_states.get(message.chat.id, {}).get('album', ())) > 1:
+        await process_album(message, image_processing_func, *args, user_id=user_id, placeholder=placeholder)
+        return
+    try:
+        try:
+            # Выбираем наименьший вариант фотографии, достаточный для результата операции
+            photo_sizes = user_states[message.chat.id]['photo_sizes']
+            photo_id = select_photo_size(image_processing_func.__name__, photo_sizes, args)
+            # Ключ кэша результатов и объединения запросов: фотография, операция и ее параметры
+            policy = get_output(image_processing_func.__name__, args)
+            cache_key = get_result_cache_key(message.chat.id, image_processing_func.__name__, *args,
+                                             get_output_tag(policy))
+            # Тот же эффект для той же фотографии из другого чата во время обработки не запускает новую
+            # задачу: результат первой получают все ожидающие чаты. Повторное нажатие в том же чате
+            # не отправляет результат второй раз
+            result = await runtime.coalesce(cache_key, get_result, photo_id, image_processing_func.__name__, args,
+                                            policy, cache_key, user_id, scope=message.chat.id)
+        except Exception:
+            # Результата нет: вместо сообщения о начале обработки пользователь получит сообщение об ошибке
+            await discard_placeholder(message.chat.id, placeholder)
+            raise
+        # Отправляем обработанное изображение пользователю
+        await send_result(message.chat.id, result, image_processing_func.__name__, policy, placeholder)
+    except BusyError as e:
+        # Очередь обработки заполнена: просим пользователя повторить попытку позже
+        count_error('process_image', e)
+        logger.info(f"Очередь обработки заполнена, запрос пользователя с ID {user_id} отклонен")
+        await bot.send_message(message.chat.id, "Бот сейчас занят, попробуйте еще раз через несколько секунд.")
+    except (ImageTooLargeError, Image.DecompressionBombError) as e:
+        # Изображение слишком большое: отказываемся его обрабатывать, не декодируя
+        count_error('process_image', e)
+        logger.info(f"Изображение пользователя с ID {user_id} отклонено: {e}")
+        await bot.send_message(message.chat.id, "Изображение слишком большое для обработки.")
+    except DuplicateRequestError:
+        # Результат уже выполняющегося такого же запроса придет в этот чат один раз
+        logger.info(f"Повторный запрос пользователя с ID {user_id} пропущен: такой же запрос уже выполняется")
+    except UnidentifiedImageError as e:
+        # Обрабатываем ошибку, если изображение не удалось открыть
+        await handle_error(message, "Ошибка при открытии изображения", e)
+    except Exception as e:
+        # Обрабатываем любые другие ошибки и логируем их
+        await handle_error(message, f"Ошибка при обработке и отправке изображения: {e}", e)
+
+
+# Функция для отправки ASCII-арта пользователю
+async def send_ascii_art(chat_id, ascii_art):
+    text = f"```\n{ascii_art}\n```"
+    with phase('image_to_ascii', 'upload'):
+        await bot.send_message(chat_id, text, parse_mode="MarkdownV2")
+    BYTES.inc(len(text.encode('utf-8')), direction='out')
+
+
+# Функция для преобразования скачанного изображения в ASCII-арт
+def render_ascii(downloaded_file, ascii_chars, user_id=None):
+    # Открываем скачанный файл как поток байтов
+    with io.BytesIO(downloaded_file) as image_stream:
+        # Получаем размер изображения по заголовку файла
+        width, height = Image.open(image_stream).size
+        # Логируем информацию о размере изображения и пользователе
+        logger.info(
+            f"Пользователь с ID {user_id} преобразует изображение размером {width}x{height} пикселей в ASCII-арт с символами: {ascii_chars}")
+        # ASCII-арт декодируется в уменьшенном масштабе, поэтому проверяем только предел отклонения
+        admission.check((width, height))
+        # Преобразуем изображение в ASCII-арт (декодирование и преобразование выполняются вместе)
+        return image_to_ascii(image_stream, ascii_chars=ascii_chars, user_id=user_id)
+
+
+# Функция для обработки ASCII-арта и отправки результата
+@log_function
+async def process_ascii_art(message, user_id=None):
+    """
+    Обрабатывает изображение и преобразует его в ASCII-арт, затем отправляет результат пользователю.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    try:
+        # Для ASCII-арта в 40 символов обычно достаточно самого маленького варианта фотографии
+        photo_id = select_photo_size('image_to_ascii', user_states[message.chat.id]['photo_sizes'])
+        # Получаем символы для ASCII-арта из состояния пользователя
+        ascii_chars = user_states[message.chat.id]['ascii_chars']
+        # Ищем готовый ASCII-арт в кэше по фотографии и набору символов
+        cache_key = get_result_cache_key(message.chat.id, 'image_to_ascii', ascii_chars)
+        cached_result = await runtime.run_blocking(result_cache.get, cache_key) if cache_key else None
+        if cached_result is not None:
+            # Отправляем сохраненный ASCII-арт без скачивания и повторной обработки
+            logger.info(f"Пользователь с ID {user_id} получает ASCII-арт из кэша: {result_cache.stats()}")
+            await send_ascii_art(message.chat.id, cached_result)
+            return
+        # Получаем байты исходного изображения из кэша (скачиваются только при промахе)
+        with phase('image_to_ascii', 'download'):
+            downloaded_file = await source_cache.get_bytes(photo_id)
+        with phase('image_to_ascii', 'transform'):
+            ascii_art = await runtime.run_blocking(render_ascii, downloaded_file, ascii_chars, user_id)
+        # Сохраняем ASCII-арт в кэше
+        if cache_key:
+            await runtime.run_blocking(result_cache.put, cache_key, ascii_art)
+        # Отправляем ASCII-арт пользователю
+        await send_ascii_art(message.chat.id, ascii_art)
+    except (ImageTooLargeError, Image.DecompressionBombError) as e:
+        # Изображение слишком большое: отказываемся его обрабатывать, не декодируя
+        count_error('process_ascii_art', e)
+        logger.info(f"Изображение пользователя с ID {user_id} отклонено: {e}")
+        await bot.send_message(message.chat.id, "Изображение слишком большое для обработки.")
+    except UnidentifiedImageError as e:
+        # Обрабатываем ошибку, если изображение не удалось открыть
+        await handle_error(message, "Ошибка при открытии изображения", e)
+    except Exception as e:
+        # Обрабатываем любые другие ошибки и логируем их
+        await handle_error(message, f"Ошибка при преобразовании изображения в ASCII-арт и отправке: {e}", e)
+
+
+# Обработчик команды "Список команд"
+@router.operation('commands')
+@log_function
+async def show_commands(message, user_id=None):
+    """
+    Отправляет пользователю список доступных команд бота.
+
+    Args:
+        message (telebot.types.Message): Сообщение от пользователя.
+        user_id (int): ID пользователя.
+    """
+    # Отправляем сообщение с командами пользователю
+    await bot.send_message(message.chat.id, COMMANDS_MESSAGE)
+
+
+# Единственный обработчик текстовых сообщений: обработчик команды или кнопки находится в словаре
+# маршрутизатора, поэтому время выбора не растет с количеством операций
+async def route_message(message):
+    handler = router.resolve_message(message)
+    if handler is not None:
+        await handler(message, user_id=message.chat.id)
+
+
+# Единственный обработчик запросов обратного вызова
+async def route_callback(call):
+    handler = router.resolve_callback(call.data)
+    if handler is not None:
+        await handler(call, user_id=call.message.chat.id)
+
+
+# Функция для регистрации метрик, которые вычисляются при каждом запросе метрик
+def register_metrics():
+    registry.register(Gauge('tgbot_active_sessions', 'Количество чатов с сохраненным состоянием',
+                            function=lambda: len(user_states)))
+    registry.register(Gauge('tgbot_queue_depth', 'Количество задач в очередях исполнителя и исходящих запросов',
+                            ('queue',), function=lambda: get_queue_depths()))
+    registry.register(CallbackCounter('tgbot_outbound_requests_total',
+                                      'Исходящие запросы к Bot API: отправленные и повторенные после ответа 429',
+                                      ('result',), function=lambda: get_outbound_counters()))
+    registry.register(Gauge('tgbot_admission_memory_bytes', 'Оценка памяти задач обработки, допущенных в работу',
+                            function=lambda: admission.in_flight_bytes))
+    registry.register(Gauge('tgbot_admission_waiting', 'Количество задач обработки, ожидающих памяти',
+                            function=lambda: admission.waiting))
+    registry.register(CallbackCounter('tgbot_coalesced_requests_total',
+                                      'Запросы обработки, дождавшиеся результата такой же выполняющейся задачи',
+                                      function=lambda: runtime.flights.joined))
+    registry.register(CallbackCounter('tgbot_duplicate_requests_total',
+                                      'Повторные запросы из того же чата, пропущенные во время такой же задачи',
+                                      function=lambda: runtime.flights.duplicates))
+
+
+# Функция для получения глубины очередей для метрик
+def get_queue_depths():
+    depths = {('transform',): transform_executor.pending}
+    for name, count in runtime.outbound.stats()['waiting'].items():
+        depths[(f'outbound_{name}',)] = count
+    return depths
+
+
+# Функция для получения счетчиков исходящих запросов для метрик
+def get_outbound_counters():
+    stats = runtime.outbound.stats()
+    return {('sent',): stats['sent'], ('retried',): stats['retries']}
+
+
+# Функция для запуска сервера метрик
+def start_metrics_server(port_offset=0):
+    if METRICS_PORT is None:
+        return None
+    port = METRICS_PORT + port_offset
+    try:
+        server = MetricsServer(registry, METRICS_HOST, port)
+    except OSError as e:
+        # Занятый порт не должен мешать работе бота
+        logger.error(f"Не удалось запустить сервер метрик на {METRICS_HOST}:{port}: {e}")
+        return None
+    server.start()
+    return server
@@ -0,0 +1,85 @@
+import logging
+
+from operations import get_commands_message, get_help_sections
+
+logger = logging.getLogger(__name__)
+
+# Список команд бота с описаниями, построенный по реестру операций
+COMMANDS_MESSAGE = get_commands_message()
+
+# Текст справки после первого успешного чтения help.txt
+_help_text = None
+
+
+# Функция для чтения токена из файла
+def get_token():
+    """
+    Читает токен бота из файла.
+
+    Returns:
+        str: Токен бота.
+    """
+    # Логируем информацию о попытке чтения токена
+    logger.info("Чтение токена бота из файла")
+    try:
+        # Открываем файл с токеном
+        with open('/путь/к/файлу/token.txt', 'r') as file:
+            # Читаем и возвращаем токен, удаляя лишние пробелы
+            return file.read().strip()
+    except FileNotFoundError:
+        # Логируем ошибку, если файл не найден
+        logger.error("Файл с токеном не найден")
+        raise
+
+
+# Функция для чтения текста справки из файла help.txt
+def get_help_text():
+    """
+    Читает текст справки из файла help.txt и подставляет в него списки команд
+    из реестра операций ({basic}, {image}, {extra} и {pipeline_steps}).
+    Прочитанный текст запоминается; если файла нет, он читается снова при следующем запросе.
+
+    Returns:
+        str: Текст справки.
+    """
+    global _help_text
+    if _help_text is None:
+        try:
+            with open('help.txt', 'r', encoding='utf-8') as file:
+                _help_text = file.read().format(**get_help_sections())
+        except FileNotFoundError:
+            return "Файл справки не найден."
+    return _help_text
+
+
+# Функция для получения всех вариантов размера фотографии из сообщения
+def get_photo_sizes(message):
+    """
+    Возвращает все варианты размера фотографии, которые прислал Telegram.
+
+    Args:
+        message (telebot.types.Message): Сообщение с фотографией.
+
+    Returns:
+        list: Варианты фотографии (file_id, ширина, высота) по возрастанию размера.
+    """
+    return sorted(((size.file_id, size.width, size.height) for size in message.photo),
+                  key=lambda size: size[1] * size[2])
+
+
+# Функция для проверки, может ли бот писать в чат
+def is_chat_unreachable(error):
+    """
+    Проверяет, означает ли ошибка Bot API, что бот больше не может писать в чат
+    (бот заблокирован или удален из чата, пользователь удален, чат не найден).
+
+    Args:
+        error (Exception): Ошибка, возникшая при отправке сообщения.
+
+    Returns:
+        bool: True, если чат недоступен.
+    """
+    # Исключения синхронного и асинхронного клиента - разные классы с одинаковыми полями
+    error_code = getattr(error, 'error_code', None)
+    description = str(getattr(error, 'description', '')).lower()
+    return error_code == 403 or (error_code == 400 and 'chat not found' in description)
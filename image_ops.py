@@ -0,0 +1,377 @@
+from PIL import Image, ImageOps
+
+from ascii_engine import pixels_to_text, text_to_rows
+from log_utils import log_function
+from lut import DEFAULT_COLORMAP, apply_steps
+
+# Набор символов для создания ASCII-арта
+DEFAULT_ASCII_CHARS = '@%#*+=-:. '
+# Размер большей стороны стикера, который ожидает Telegram
+STICKER_SIZE = 512
+
+
+# Функция для изменения размера изображения
+@log_function
+def resize_image(image, new_width=100, user_id=None):
+    """
+    Изменяет размер изображения, сохраняя пропорции.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        new_width (int): Новая ширина изображения.
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Изображение с измененным размером.
+    """
+    # Получаем текущие размеры изображения
+    width, height = image.size
+    # Вычисляем соотношение сторон
+    ratio = height / width
+    # Вычисляем новую высоту, сохраняя пропорции
+    new_height = int(new_width * ratio)
+    # Изменяем размер изображения и возвращаем его с новыми размерами
+    return image.resize((new_width, new_height))
+
+
+# Функция для преобразования изображения в оттенки серого
+@log_function
+def grayify(image, user_id=None):
+    """
+    Преобразует изображение в оттенки серого.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Изображение в оттенках серого.
+    """
+    # Преобразуем изображение в оттенки серого и возвращаем его в оттенках серого
+    return image.convert("L")
+
+
+# Функция для преобразования изображения в ASCII-арт
+@log_function
+def image_to_ascii(image_stream, new_width=40, ascii_chars=DEFAULT_ASCII_CHARS, user_id=None):
+    """
+    Преобразует изображение в ASCII-арт.
+
+    Args:
+        image_stream (io.BytesIO): Поток байтов с изображением.
+        new_width (int): Новая ширина изображения.
+        ascii_chars (str): Набор символов для ASCII-арта.
+        user_id (int): ID пользователя.
+
+    Returns:
+        str: ASCII-арт изображения.
+    """
+
+    # Открываем изображение из потока (пиксели еще не декодируются)
+    image = Image.open(image_stream)
+    # Получаем размеры изображения
+    width, height = image.size
+    # Вычисляем соотношение сторон
+    aspect_ratio = height / width
+    # Вычисляем новую высоту, сохраняя соотношение сторон
+    new_height = int(aspect_ratio * new_width * 0.55)
+    # JPEG декодируем сразу в оттенках серого и в уменьшенном масштабе (1/2, 1/4 или 1/8), достаточном для результата
+    image.draft('L', (new_width, max(new_height, 1)))
+    # Преобразуем изображение в оттенки серого
+    image = image.convert('L')
+    # Изменяем размер изображения
+    img_resized = image.resize((new_width, new_height))
+    # Преобразуем пиксели изображения в ASCII-символы
+    img_str = pixels_to_ascii(img_resized, ascii_chars, user_id=user_id)
+    # Получаем ширину изображения после изменения размера
+    img_width = img_resized.width
+    # Вычисляем максимальное количество символов, которое можно отправить в одном сообщении
+    max_characters = 4000 - (new_width + 1)
+    # Вычисляем максимальное количество строк, которое можно отправить
+    max_rows = max_characters // (new_width + 1)
+    # Формируем ASCII-арт из строк одним объединением и возвращаем его
+    return text_to_rows(img_str, img_width, max_rows)
+
+
+# Функция для преобразования пикселей в ASCII-символы
+@log_function
+def pixels_to_ascii(image, ascii_chars=DEFAULT_ASCII_CHARS, user_id=None):
+    """
+    Преобразует пиксели изображения в ASCII-символы.
+
+    Args:
+        image (PIL.Image): Изображение в оттенках серого.
+        ascii_chars (str): Набор символов для ASCII-арта.
+        user_id (int): ID пользователя.
+
+    Returns:
+        str: Строка с ASCII-символами.
+    """
+    # Сопоставляем яркость каждого пикселя символу по заранее построенной таблице из 256 элементов
+    return pixels_to_text(image, ascii_chars)
+
+
+# Функция для пикселизации изображения
+@log_function
+def pixelate_image(image, pixel_size, output_size=None, user_id=None):
+    """
+    Пикселизирует изображение.
+
+    Args:
+        image (PIL.Image): Исходное изображение (может быть декодировано в уменьшенном масштабе).
+        pixel_size (int): Размер пикселя.
+        output_size (tuple): Размер исходного изображения до уменьшения (по умолчанию - размер image).
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Пикселизованное изображение.
+    """
+    # Количество блоков считаем по полному размеру, даже если изображение декодировано в уменьшенном масштабе
+    width, height = output_size or image.size
+    # Пиксель больше изображения превращается в один блок на всю ширину или высоту
+    pixel_size = min(pixel_size, width, height)
+    # Уменьшаем изображение до размера, кратного pixel_size, используя метод ближайшего соседа
+    image = image.resize(
+        (width // pixel_size, height // pixel_size),
+        resample=Image.Resampling.NEAREST
+    )
+    # Увеличиваем изображение обратно до исходного размера, используя метод ближайшего соседа
+    image = image.resize(
+        (image.size[0] * pixel_size, image.size[1] * pixel_size),
+        resample=Image.Resampling.NEAREST
+    )
+    # Возвращаем пикселизованное изображение
+    return image
+
+
+# Функция для инверсии цветов изображения
+@log_function
+def invert_colors(image, user_id=None):
+    """
+    Инвертирует цвета изображения в любом режиме Pillow: альфа-канал сохраняется,
+    а у изображения с палитрой инвертируется только палитра.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Изображение с инвертированными цветами.
+    """
+    # Инвертируем цвета кэшированной таблицей из 256 значений
+    return apply_steps(image, [('invert', ())])
+
+
+# Функция для отражения изображения
+@log_function
+def mirror_image(image, direction, user_id=None):
+    """
+    Отражает изображение по горизонтали или вертикали.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        direction (str): Направление отражения ('horizontal' или 'vertical').
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Отраженное изображение.
+    """
+    if direction == 'horizontal':
+        # Возвращаем изображение, отраженное по горизонтали
+        return ImageOps.mirror(image)
+    elif direction == 'vertical':
+        # Возвращаем изображение, отраженное по вертикали
+        return ImageOps.flip(image)
+    else:
+        # Выбрасываем исключение, если направление неверное
+        raise ValueError("Неверное направление отражения. Используйте 'horizontal' или 'vertical'.")
+
+
+# Функция для преобразования изображения в тепловую карту
+@log_function
+def convert_to_heatmap(image, colormap=DEFAULT_COLORMAP, user_id=None):
+    """
+    Преобразует изображение в тепловую карту.
+
+    Изображение переводится в оттенки серого, после чего яркость пикселя
+    становится индексом в кэшированной палитре из 256 цветов: раскрашивание
+    не требует прохода по пикселям, и любая палитра стоит столько же, сколько
+    палитра по умолчанию.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        colormap (str): Название палитры из lut.COLORMAPS (по умолчанию от синего к красному).
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Изображение в виде тепловой карты (с палитрой или RGBA, если была прозрачность).
+    """
+    # Применяем цветовую палитру к яркости изображения
+    return apply_steps(image, [('colormap', (colormap,))])
+
+
+# Функция для изменения размера изображения для стикера
+@log_function
+def resize_for_sticker(image, max_size=STICKER_SIZE, user_id=None):
+    """
+    Изменяет размер изображения, сохраняя пропорции, чтобы его максимальное измерение не превышало заданного максимума.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        max_size (int): Максимальный размер изображения (по умолчанию 512 пикселей, как требует Telegram).
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Изображение с измененным размером.
+    """
+    # Получаем текущие размеры изображения
+    width, height = image.size
+    # Вычисляем соотношение сторон
+    ratio = min(max_size / width, max_size / height)
+    # Вычисляем новые размеры, сохраняя пропорции; округление гарантирует, что большая сторона
+    # равна max_size, а не max_size - 1 из-за погрешности деления
+    new_width = max(round(width * ratio), 1)
+    new_height = max(round(height * ratio), 1)
+    # Изменяем размер изображения и возвращаем его
+    return image.resize((new_width, new_height),
+                        resample=Image.Resampling.BICUBIC)
+
+
+# Поточечные шаги конвейера: название функции -> вид шага движка таблиц (lut.apply_steps)
+POINTWISE_STEPS = {
+    'invert_colors': 'invert',
+    'grayify': 'grayscale',
+    'convert_to_heatmap': 'colormap',
+}
+
+# Шаги отражения конвейера: направление -> метод транспонирования
+MIRROR_STEPS = {
+    'horizontal': Image.Transpose.FLIP_LEFT_RIGHT,
+    'vertical': Image.Transpose.FLIP_TOP_BOTTOM,
+}
+
+
+# Функция для применения нескольких функций обработки за одно декодирование
+@log_function
+def run_pipeline(image, steps, user_id=None):
+    """
+    Последовательно применяет к изображению несколько функций обработки.
+
+    Идущие подряд поточечные шаги (инверсия, оттенки серого, тепловая карта)
+    применяются движком таблиц за один проход: таблицы каналов составляются
+    в одну, а шаги после палитры меняют только палитру. Идущие подряд отражения
+    сводятся к одному транспонированию.
+
+    Args:
+        image (PIL.Image): Исходное изображение.
+        steps (tuple): Шаги в виде пар (название функции обработки, аргументы).
+        user_id (int): ID пользователя.
+
+    Returns:
+        PIL.Image: Обработанное изображение.
+    """
+    index = 0
+    while index < len(steps):
+        name, args = steps[index]
+        if name in POINTWISE_STEPS:
+            # Передаем все идущие подряд поточечные шаги движку таблиц одним списком
+            pointwise = []
+            while index < len(steps) and steps[index][0] in POINTWISE_STEPS:
+                pointwise.append((POINTWISE_STEPS[steps[index][0]], steps[index][1]))
+                index += 1
+            image = apply_steps(image, pointwise)
+            continue
+        if name == 'mirror_image':
+            # Считаем четность отражений по каждой оси: двойное отражение ничего не меняет
+            flips = {'horizontal': 0, 'vertical': 0}
+            while index < len(steps) and steps[index][0] == 'mirror_image':
+                direction = steps[index][1][0]
+                if direction not in MIRROR_STEPS:
+                    raise ValueError("Неверное направление отражения. Используйте 'horizontal' или 'vertical'.")
+                flips[direction] ^= 1
+                index += 1
+            for direction, flipped in flips.items():
+                if flipped:
+                    image = image.transpose(MIRROR_STEPS[direction])
+            continue
+        image = TRANSFORMS[name](image, *args, user_id=user_id)
+        index += 1
+    return image
+
+
+# Функция для расчета размера декодирования исходного изображения
+def plan_decode(transform_name, source_size, args):
+    """
+    Определяет минимальный размер исходного изображения, достаточный для результата операции.
+
+    Операции, которые все равно уменьшают изображение (стикер, пикселизация), могут
+    получить изображение, декодированное в уменьшенном масштабе. Остальным нужен полный размер.
+
+    Args:
+        transform_name (str): Название функции обработки.
+        source_size (tuple): Размер исходного изображения.
+        args (tuple): Аргументы функции обработки.
+
+    Returns:
+        tuple: Размер декодирования (None - полный размер) и аргументы для функции обработки.
+    """
+    width, height = source_size
+    if transform_name == 'pixelate_image':
+        pixel_size = args[0]
+        grid = (width // pixel_size, height // pixel_size)
+        if not all(grid):
+            return None, args
+        # Для выборки одного пикселя на блок достаточно сетки блоков; полный размер передаем отдельно
+        return grid, (pixel_size, source_size)
+    if transform_name == 'resize_for_sticker':
+        max_size = args[0] if args else STICKER_SIZE
+        ratio = min(max_size / width, max_size / height)
+        if ratio >= 1:
+            return None, args
+        return (max(int(width * ratio), 1), max(int(height * ratio), 1)), args
+    return None, args
+
+
+# Функция для выбора наименьшего достаточного варианта фотографии
+def select_photo_size(transform_name, photo_sizes, args=()):
+    """
+    Выбирает наименьший из вариантов фотографии, которые Telegram хранит в разных
+    размерах, достаточный для результата операции.
+
+    ASCII-арту нужна ширина не меньше числа символов в строке, стикеру - большая
+    сторона не меньше максимального размера стикера. Остальные операции сохраняют
+    размер изображения, поэтому для них выбирается самый большой вариант. Если
+    достаточного варианта нет, также выбирается самый большой.
+
+    Args:
+        transform_name (str): Название функции обработки.
+        photo_sizes (list): Варианты фотографии (file_id, ширина, высота) по возрастанию размера.
+        args (tuple): Аргументы функции обработки.
+
+    Returns:
+        str: file_id выбранного варианта.
+    """
+    if transform_name == 'image_to_ascii':
+        new_width = args[0] if args else 40
+        sufficient = lambda width, height: width >= new_width
+    elif transform_name == 'resize_for_sticker':
+        max_size = args[0] if args else STICKER_SIZE
+        sufficient = lambda width, height: max(width, height) >= max_size
+    else:
+        return photo_sizes[-1][0]
+    for file_id, width, height in photo_sizes:
+        if sufficient(width, height):
+            return file_id
+    return photo_sizes[-1][0]
+
+
+# Функции обработки изображений, доступные по имени (в том числе в рабочих процессах)
+TRANSFORMS = {
+    'pixelate_image': pixelate_image,
+    'invert_colors': invert_colors,
+    'mirror_image': mirror_image,
+    'convert_to_heatmap': convert_to_heatmap,
+    'grayify': grayify,
+    'resize_for_sticker': resize_for_sticker,
+    'run_pipeline': run_pipeline,
+}
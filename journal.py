@@ -0,0 +1,117 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Журнал принятых обновлений
+class UpdateJournal:
+    """
+    Хранит в SQLite (WAL) следующий offset getUpdates и обновления, которые
+    бот принял, но еще не обработал.
+
+    Обновление записывается в журнал до того, как следующий запрос
+    getUpdates подтвердит его Telegram, и удаляется после завершения
+    обработчиков. После перезапуска бот продолжает опрос с сохраненного
+    offset и заново передает обработчикам незавершенные обновления, поэтому
+    обновления не теряются и не приходят повторно от Telegram. Обработка
+    выполняется как минимум один раз: обновление, прерванное на середине,
+    после перезапуска обрабатывается заново.
+
+    Журнал можно открыть из нескольких процессов (диспетчер принимает
+    обновления, рабочие процессы отмечают их обработанными).
+    """
+
+    def __init__(self, path, max_attempts=3, max_age=15 * 60):
+        """
+        Args:
+            path (str): Путь к файлу базы данных.
+            max_attempts (int): Количество повторов обновления после перезапуска, после которого оно
+                считается ошибочным и удаляется (например, если его обработка роняет процесс).
+            max_age (float): Возраст незавершенного обновления в секундах, после которого оно
+                не повторяется: пользователь уже не ждет ответа.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        # Ожидание блокировки базы, пока ее изменяет другой процесс
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL синхронизация NORMAL не повреждает базу при сбое процесса; при сбое питания
+        # могут потеряться последние транзакции
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS journal_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pending_updates ('
+                         'update_id INTEGER PRIMARY KEY, data TEXT NOT NULL, '
+                         'accepted_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)')
+        self._lock = threading.Lock()
+
+    @property
+    def offset(self):
+        """
+        Возвращает update_id, с которого продолжать getUpdates (None - журнал пуст).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM journal_state WHERE key = 'offset'").fetchone()
+        return row[0] if row else None
+
+    def accept(self, updates):
+        """
+        Записывает принятые обновления и следующий offset одной транзакцией.
+
+        Args:
+            updates (list): Обновления (dict) в том виде, в каком их присылает Bot API.
+        """
+        if not updates:
+            return
+        now = time.time()
+        rows = [(update['update_id'], json.dumps(update, separators=(',', ':'), ensure_ascii=False), now)
+                for update in updates]
+        offset = max(update['update_id'] for update in updates) + 1
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany('INSERT OR IGNORE INTO pending_updates (update_id, data, accepted_at) '
+                                 'VALUES (?, ?, ?)', rows)
+            # Offset только растет: обновления вебхука могут приходить не по порядку
+            self._db.execute("INSERT INTO journal_state (key, value) VALUES ('offset', ?) ON CONFLICT(key) "
+                             "DO UPDATE SET value = MAX(value, excluded.value)", (offset,))
+
+    def done(self, update_id):
+        """
+        Удаляет обработанное обновление из журнала.
+
+        Args:
+            update_id (int): ID обновления.
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM pending_updates WHERE update_id = ?', (update_id,))
+
+    def pending(self):
+        """
+        Возвращает незавершенные обновления для повторной обработки по порядку
+        update_id и учитывает попытку. Устаревшие обновления и обновления,
+        исчерпавшие попытки, удаляются.
+
+        Returns:
+            list: Обновления (dict).
+        """
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            dropped = self._db.execute('DELETE FROM pending_updates WHERE accepted_at < ? OR attempts >= ?',
+                                       (time.time() - self.max_age, self.max_attempts)).rowcount
+            self._db.execute('UPDATE pending_updates SET attempts = attempts + 1')
+            rows = self._db.execute('SELECT data FROM pending_updates ORDER BY update_id').fetchall()
+        if dropped:
+            logger.error(f"Удалено незавершенных обновлений, которые не будут повторены: {dropped}")
+        return [json.loads(data) for data, in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pending_updates').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
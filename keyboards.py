@@ -0,0 +1,90 @@
+from functools import lru_cache
+
+from telebot import types
+
+from log_utils import log_function
+from operations import OPERATIONS
+from pipeline import PIPELINE_STEPS
+
+
+# Функция для построения клавиатуры с вариантами действий
+@lru_cache(maxsize=None)
+def _build_options_keyboard():
+    keyboard = types.InlineKeyboardMarkup()
+    # Кнопка каждой операции из реестра; данные кнопки - название операции
+    keyboard.add(*(types.InlineKeyboardButton(operation.label, callback_data=operation.name)
+                   for operation in OPERATIONS.values() if operation.button))
+    return keyboard
+
+
+# Функция для создания клавиатуры с вариантами действий
+@log_function
+def get_options_keyboard(user_id=None):
+    """
+    Возвращает клавиатуру с вариантами действий над изображением. Клавиатура
+    строится по реестру операций один раз и затем переиспользуется.
+
+    Args:
+        user_id (int): ID пользователя.
+
+    Returns:
+        telebot.types.InlineKeyboardMarkup: Клавиатура с вариантами действий.
+    """
+    return _build_options_keyboard()
+
+
+# Функция для создания клавиатуры выбора нескольких эффектов
+@log_function
+def get_pipeline_keyboard(selected, user_id=None):
+    """
+    Создает клавиатуру для выбора нескольких эффектов, которые будут применены по порядку.
+
+    Args:
+        selected (list): Названия уже выбранных шагов в порядке выбора.
+        user_id (int): ID пользователя.
+
+    Returns:
+        telebot.types.InlineKeyboardMarkup: Клавиатура выбора эффектов.
+    """
+    return _build_pipeline_keyboard(tuple(selected))
+
+
+# Функция для построения клавиатуры выбора нескольких эффектов; клавиатуры частых наборов кэшируются
+@lru_cache(maxsize=1024)
+def _build_pipeline_keyboard(selected):
+    keyboard = types.InlineKeyboardMarkup()
+    buttons = []
+    for name, (label, _, _) in PIPELINE_STEPS.items():
+        # Отмечаем выбранные эффекты их порядковым номером в конвейере
+        if name in selected:
+            label = f"{selected.index(name) + 1}. {label}"
+        buttons.append(types.InlineKeyboardButton(label, callback_data=f"pipeline_toggle:{name}"))
+    keyboard.add(*buttons)
+    # Кнопки для запуска конвейера и сброса выбора
+    keyboard.row(types.InlineKeyboardButton("Применить", callback_data="pipeline_run"),
+                 types.InlineKeyboardButton("Сбросить", callback_data="pipeline_reset"))
+    return keyboard
+
+
+# Функция для построения клавиатуры с командами
+@lru_cache(maxsize=None)
+def _build_commands_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    # Кнопки операций, у которых есть текст для клавиатуры команд
+    keyboard.add(*(types.KeyboardButton(operation.text) for operation in OPERATIONS.values() if operation.text))
+    return keyboard
+
+
+# Функция для создания клавиатуры с командами
+@log_function
+def get_commands_keyboard(user_id=None):
+    """
+    Возвращает клавиатуру с командами бота, построенную по реестру операций один раз.
+
+    Args:
+        user_id (int): ID пользователя.
+
+    Returns:
+        telebot.types.ReplyKeyboardMarkup: Клавиатура с командами.
+    """
+    return _build_commands_keyboard()
@@ -0,0 +1,156 @@
+import atexit
+import inspect
+import logging
+import queue
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+
+from telebot import types
+
+from metrics import HANDLER_DURATION, count_error
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Словарь для сопоставления названий функций с действиями пользователя
+function_to_action = {
+    'pixelate_image': 'пикселизирует изображение',
+    'image_to_ascii': 'преобразует изображение в ASCII-арт',
+    'invert_colors': 'инвертирует цвета изображения',
+    'mirror_image': 'отражает изображение',
+    'send_welcome': 'отправляет приветственное сообщение',
+    'handle_photo': 'отправляет фотографию',
+    'get_options_keyboard': 'получает клавиатуру с вариантами действий',
+    'get_ascii_chars': 'вводит символы для ASCII-арта',
+    'process_image': 'обрабатывает изображение',
+    'process_ascii_art': 'обрабатывает ASCII-арт',
+    'convert_to_heatmap': 'преобразует изображение в тепловую карту',
+    'resize_for_sticker': 'изменяет размер изображения для стикера',
+    'send_random_joke': 'получает случайную шутку',
+    'send_random_compliment': 'получает случайный комплимент',
+    'show_commands': 'получает список команд',
+    'get_commands_keyboard': 'получает клавиатуру с командами',
+    'flip_coin': 'подбрасывает монетку',
+    'handle_image_command': 'отправляет команду обработки изображения',
+    'handle_image_callback': 'выбирает обработку изображения',
+    'request_ascii_chars': 'выбирает ASCII-арт',
+    'edit_pipeline': 'выбирает эффекты для обработки изображения',
+    'run_selected_pipeline': 'применяет выбранные эффекты к изображению',
+    'handle_ascii': 'обрабатывает ASCII-арт',
+    'grayify': 'преобразует изображение в оттенки серого',
+    'pixels_to_ascii': 'преобразует пиксели изображения в ASCII-символы',
+    'run_pipeline': 'применяет несколько эффектов к изображению',
+    'handle_pipeline': 'применяет несколько эффектов к изображению',
+    'get_pipeline_keyboard': 'получает клавиатуру выбора нескольких эффектов',
+    'handle_album': 'отправляет альбом фотографий',
+    'process_album': 'обрабатывает альбом фотографий'
+}
+
+
+# Функция для извлечения ID пользователя из аргументов вызова
+def _get_user_id(args, kwargs):
+    # Извлекаем user_id из kwargs или args
+    user_id = kwargs.get('user_id')
+    if not user_id:
+        for arg in args:
+            if isinstance(arg, types.Message):
+                user_id = arg.chat.id
+                break
+            elif isinstance(arg, types.CallbackQuery):
+                user_id = arg.message.chat.id
+                break
+
+    # Если user_id все еще None, устанавливаем его в "Unknown"
+    if not user_id:
+        user_id = "Unknown"
+    return user_id
+
+
+# Обработчик журнала, передающий записи в очередь без форматирования
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Запись форматируется в потоке QueueListener, а не в потоке обработчика
+        return record
+
+
+# Функция для настройки журнала
+def setup_logging(level=logging.INFO, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s'):
+    """
+    Направляет записи журнала в очередь, из которой их выводит отдельный поток,
+    чтобы запись в журнал не блокировала обработчики.
+
+    Args:
+        level (int): Уровень журнала.
+        fmt (str): Формат записи.
+
+    Returns:
+        logging.handlers.QueueListener: Поток вывода журнала (останавливается при выходе).
+    """
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [_QueueHandler(records)]
+    listener.start()
+    # При выходе дожидаемся вывода оставшихся записей
+    atexit.register(listener.stop)
+    return listener
+
+
+# Функция для начала участка трассы для вызова функции
+def _start_span(name, action, args, kwargs):
+    attributes = {'action': action}
+    user_id = kwargs.get('user_id')
+    # Аргументы просматриваются только для корня трассы: вложенные участки берут ID пользователя у родителя
+    if user_id is None and tracer.current() is None:
+        user_id = _get_user_id(args, kwargs)
+    if user_id is not None:
+        attributes['user_id'] = user_id
+    return tracer.span(name, **attributes)
+
+
+# Функция для логирования ошибки в функции
+def _log_error(name, span, error):
+    logger.error("Ошибка в функции %s пользователя с ID %s: %s", name, span.user_id, error)
+    count_error(name, error)
+
+
+# Декоратор для трассировки вызовов функций и обработки ошибок
+def log_function(func):
+    action = function_to_action.get(func.__name__, f"выполняет неизвестное действие ({func.__name__})")
+
+    # Для асинхронных обработчиков время считается до завершения корутины, а не до ее создания
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with _start_span(func.__name__, action, args, kwargs) as span:
+                try:
+                    # Возвращаем результат выполнения функции
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    # Логируем ошибку, если она произошла, и учитываем ее в метриках
+                    _log_error(func.__name__, span, e)
+                    raise
+                finally:
+                    HANDLER_DURATION.observe(span.duration, function=func.__name__)
+
+        # Возвращаем асинхронную обертку для функции
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _start_span(func.__name__, action, args, kwargs) as span:
+            try:
+                # Возвращаем результат выполнения функции
+                return func(*args, **kwargs)
+            except Exception as e:
+                # Логируем ошибку, если она произошла, и учитываем ее в метриках
+                _log_error(func.__name__, span, e)
+                raise
+            finally:
+                HANDLER_DURATION.observe(span.duration, function=func.__name__)
+
+    # Возвращаем обертку для функции
+    return wrapper
@@ -0,0 +1,231 @@
+from functools import lru_cache
+
+# Палитра тепловой карты по умолчанию
+DEFAULT_COLORMAP = 'heatmap'
+
+# Цветовые палитры: название -> опорные цвета, равномерно распределенные от черного к белому.
+# Промежуточные значения получаются линейной интерполяцией, поэтому палитра любой длины
+# превращается в таблицу из 256 цветов один раз.
+COLORMAPS = {
+    # Переход от синего к красному, как у ImageOps.colorize(black="blue", white="red")
+    'heatmap': ((0, 0, 255), (255, 0, 0)),
+    # Палитры matplotlib, воспринимаемые равномерно по яркости
+    'viridis': ((68, 1, 84), (71, 44, 122), (59, 82, 139), (44, 114, 142), (33, 145, 140),
+                (40, 174, 128), (94, 201, 98), (173, 220, 48), (253, 231, 37)),
+    'magma': ((0, 0, 4), (28, 16, 68), (79, 18, 123), (129, 37, 129), (181, 54, 122),
+              (229, 80, 100), (251, 135, 97), (254, 194, 135), (252, 253, 191)),
+    'inferno': ((0, 0, 4), (31, 12, 72), (85, 15, 109), (136, 34, 106), (186, 54, 85),
+                (227, 89, 51), (249, 142, 9), (249, 203, 53), (252, 255, 164)),
+    'plasma': ((13, 8, 135), (76, 2, 161), (126, 3, 168), (169, 35, 149), (204, 71, 120),
+               (230, 108, 92), (248, 149, 64), (253, 197, 39), (240, 249, 33)),
+}
+
+# Режимы, которые движок обрабатывает напрямую; остальные сначала переводятся в один из них
+_NATIVE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'P', 'PA')
+# Перевод остальных режимов Pillow: двоичные, целочисленные и вещественные - в оттенки серого,
+# остальные цветовые пространства - в RGB, чтобы инверсия меняла именно цвет
+_MODE_CONVERSIONS = {'1': 'L', 'I': 'L', 'I;16': 'L', 'I;16B': 'L', 'I;16L': 'L', 'F': 'L',
+                     'La': 'LA', 'RGBa': 'RGBA', 'RGBX': 'RGB', 'CMYK': 'RGB', 'YCbCr': 'RGB',
+                     'LAB': 'RGB', 'HSV': 'RGB'}
+
+# Тождественная таблица
+IDENTITY = tuple(range(256))
+
+
+# Функция для построения таблицы инверсии
+@lru_cache(maxsize=None)
+def invert_table():
+    """
+    Возвращает таблицу из 256 значений, инвертирующую канал.
+
+    Returns:
+        tuple: Кортеж из 256 чисел.
+    """
+    return tuple(255 - value for value in range(256))
+
+
+# Функция для построения палитры по названию
+@lru_cache(maxsize=None)
+def build_palette(name=DEFAULT_COLORMAP):
+    """
+    Строит палитру из 256 цветов: индекс - яркость пикселя, значение - цвет.
+
+    Палитра кэшируется, поэтому опорные цвета интерполируются один раз на процесс.
+
+    Args:
+        name (str): Название палитры из COLORMAPS.
+
+    Returns:
+        tuple: Кортеж из 256 троек (R, G, B).
+    """
+    if name not in COLORMAPS:
+        raise ValueError(f"Неизвестная палитра: {name}. Доступные палитры: {', '.join(COLORMAPS)}.")
+    anchors = COLORMAPS[name]
+    segments = len(anchors) - 1
+    palette = []
+    for value in range(256):
+        # Положение значения между опорными цветами
+        position = value * segments / 255
+        index = min(int(position), segments - 1)
+        fraction = position - index
+        start, end = anchors[index], anchors[index + 1]
+        palette.append(tuple(round(low + (high - low) * fraction) for low, high in zip(start, end)))
+    return tuple(palette)
+
+
+# Функция для составления двух таблиц в одну
+def compose_tables(first, second):
+    """
+    Возвращает таблицу, равносильную применению first, а затем second.
+    Если first равна None, возвращается second.
+    """
+    if first is None:
+        return tuple(second)
+    return tuple(second[value] for value in first)
+
+
+# Функция для вычисления яркости цвета
+def _luma(color):
+    # Та же целочисленная формула ITU-R 601-2, что и у Image.convert('L')
+    red, green, blue = color[:3]
+    return (red * 19595 + green * 38470 + blue * 7471 + 0x8000) >> 16
+
+
+# Функция для перевода изображения в режим, который движок обрабатывает напрямую
+def normalize_mode(image):
+    """
+    Переводит изображение в один из режимов L, LA, RGB, RGBA, P или PA.
+
+    Args:
+        image (PIL.Image): Изображение в любом режиме Pillow.
+
+    Returns:
+        PIL.Image: То же изображение, если режим уже подходит, иначе преобразованное.
+    """
+    if image.mode in _NATIVE_MODES:
+        return image
+    fallback = 'RGBA' if 'A' in image.getbands() else 'RGB'
+    return image.convert(_MODE_CONVERSIONS.get(image.mode, fallback))
+
+
+# Функция для изменения цветов палитры
+def _map_palette(image, function):
+    # Меняется только палитра из 256 цветов, пиксели (индексы) остаются прежними
+    rawmode = image.palette.mode if image.palette is not None else 'RGB'
+    channels = len(rawmode)
+    palette = image.getpalette(rawmode)
+    mapped = []
+    for offset in range(0, len(palette), channels):
+        color = palette[offset:offset + channels]
+        # Прозрачность цвета палитры не меняется
+        mapped.extend(function(color[:3]) + tuple(color[3:]))
+    image = image.copy()
+    image.putpalette(mapped, rawmode)
+    return image
+
+
+# Функция для применения таблицы к цветовым каналам
+def apply_table(image, table):
+    """
+    Применяет таблицу из 256 значений к цветовым каналам изображения.
+
+    Альфа-канал не меняется, а у изображения с палитрой меняется только
+    палитра, без прохода по пикселям.
+
+    Args:
+        image (PIL.Image): Изображение в одном из режимов normalize_mode.
+        table (tuple): Таблица из 256 значений (None - без изменений).
+
+    Returns:
+        PIL.Image: Изображение с примененной таблицей.
+    """
+    if table is None or tuple(table) == IDENTITY:
+        return image
+    if image.mode in ('P', 'PA'):
+        return _map_palette(image, lambda color: tuple(table[value] for value in color))
+    bands = image.getbands()
+    if 'A' in bands:
+        # Таблица для альфа-канала - тождественная
+        return image.point(list(table) * (len(bands) - 1) + list(IDENTITY))
+    return image.point(list(table) * len(bands))
+
+
+# Функция для перевода изображения в оттенки серого с сохранением прозрачности
+def _to_gray(image):
+    return image.convert('LA' if 'A' in image.getbands() else 'L')
+
+
+# Функция для раскрашивания изображения в оттенках серого палитрой
+def _colorize(image, palette, owned):
+    if image.mode == 'LA':
+        gray, alpha = image.split()
+        owned = True
+    else:
+        gray, alpha = image, None
+    if not owned:
+        # putpalette меняет изображение на месте, поэтому чужое изображение копируется
+        gray = gray.copy()
+    # putpalette превращает изображение L в P без изменения пикселей: яркость становится индексом палитры
+    gray.putpalette([channel for color in palette for channel in color])
+    if alpha is None:
+        return gray
+    colored = gray.convert('RGBA')
+    colored.putalpha(alpha)
+    return colored
+
+
+# Функция для применения последовательности поточечных шагов
+def apply_steps(image, steps):
+    """
+    Применяет к изображению последовательность поточечных шагов.
+
+    Шаги:
+        ('invert', ()) - инверсия цветов;
+        ('grayscale', ()) - оттенки серого;
+        ('colormap', (name,)) - раскрашивание палитрой из COLORMAPS по яркости.
+
+    Идущие подряд таблицы каналов составляются в одну и применяются одним
+    вызовом Image.point. Палитра накладывается без прохода по пикселям:
+    изображение в оттенках серого становится изображением с палитрой, а шаги
+    после палитры меняют только ее 256 цветов. Таблица, накопленная для
+    изображения в оттенках серого, встраивается в палитру.
+
+    Args:
+        image (PIL.Image): Изображение в любом режиме Pillow.
+        steps (list): Шаги в виде пар (вид шага, аргументы).
+
+    Returns:
+        PIL.Image: Обработанное изображение.
+    """
+    source = image
+    image = normalize_mode(image)
+    # Накопленная, но еще не примененная таблица каналов
+    table = None
+    for kind, args in steps:
+        if kind == 'invert':
+            if image.mode in ('P', 'PA'):
+                image = apply_table(image, invert_table())
+            else:
+                table = compose_tables(table, invert_table())
+        elif kind == 'grayscale':
+            if image.mode in ('P', 'PA'):
+                image = _map_palette(image, lambda color: (_luma(color),) * 3)
+            elif image.mode not in ('L', 'LA'):
+                image = _to_gray(apply_table(image, table))
+                table = None
+        elif kind == 'colormap':
+            palette = build_palette(*args)
+            if image.mode in ('P', 'PA'):
+                image = _map_palette(image, lambda color: palette[_luma(color)])
+                continue
+            if image.mode not in ('L', 'LA'):
+                image = _to_gray(apply_table(image, table))
+                table = None
+            if table is not None:
+                # Для оттенков серого таблица и палитра сводятся к одной палитре
+                palette = tuple(palette[value] for value in table)
+                table = None
+            image = _colorize(image, palette, owned=image is not source)
+        else:
+            raise ValueError(f"Неизвестный поточечный шаг: {kind}")
+    return apply_table(image, table)
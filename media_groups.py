@@ -0,0 +1,55 @@
+import threading
+
+
+# Сборщик частей альбомов (media group)
+class MediaGroupCollector:
+    """
+    Собирает фотографии одного альбома, которые Telegram присылает отдельными
+    сообщениями с общим media_group_id. Альбом считается полученным, если за
+    время delay после последней части новых частей не пришло.
+    """
+
+    def __init__(self, on_complete, schedule, delay=1.0):
+        """
+        Args:
+            on_complete (function): Функция, получающая список сообщений альбома в порядке отправки.
+            schedule (function): Функция schedule(delay, callback), вызывающая callback через delay секунд.
+            delay (float): Время ожидания следующей части альбома в секундах.
+        """
+        self.on_complete = on_complete
+        self.schedule = schedule
+        self.delay = delay
+        # Альбомы в процессе сбора: media_group_id -> (номер последней части, список сообщений)
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        """
+        Добавляет часть альбома и откладывает его завершение на delay секунд.
+
+        Args:
+            message (telebot.types.Message): Сообщение с фотографией из альбома.
+        """
+        group_id = message.media_group_id
+        with self._lock:
+            version, messages = self._groups.get(group_id, (0, []))
+            messages.append(message)
+            version += 1
+            self._groups[group_id] = (version, messages)
+        # Каждая новая часть переносит завершение; старые отложенные вызовы увидят другой номер и ничего не сделают
+        self.schedule(self.delay, lambda: self._flush(group_id, version))
+
+    def _flush(self, group_id, version):
+        with self._lock:
+            current = self._groups.get(group_id)
+            if current is None or current[0] != version:
+                return
+            del self._groups[group_id]
+        self.on_complete(sorted(current[1], key=lambda message: message.message_id))
+
+
+# Функция для отложенного вызова в отдельном потоке
+def schedule_in_thread(delay, callback):
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
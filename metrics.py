@@ -0,0 +1,311 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Функция для форматирования меток метрики
+def _format_labels(names, values, extra=()):
+    # Значения меток экранируются по правилам текстового формата Prometheus
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+# Функция для форматирования значения метрики
+def _format_value(value):
+    return repr(float(value)) if value not in (float('inf'), float('-inf')) else ('+Inf' if value > 0 else '-Inf')
+
+
+# Базовый класс метрик с метками
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+# Счетчик
+class Counter(_Metric):
+    """
+    Монотонно растущий счетчик (количество ошибок, переданные байты).
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# Показатель, значение которого вычисляется при каждом чтении метрик
+class Gauge(_Metric):
+    """
+    Текущее значение (количество сессий, глубина очередей). Функция получения
+    значения вызывается при каждом запросе метрик и возвращает число или, для
+    метрики с метками, словарь {кортеж значений меток: число}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def collect(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            # Ошибка одного показателя не должна ломать весь ответ
+            logger.error(f"Ошибка при получении значения метрики {self.name}: {e}")
+            return []
+        if not self.labelnames:
+            value = {(): value}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(sorted((tuple(str(part) for part in key), number)
+                                          for key, number in value.items())))
+        return lines
+
+
+# Счетчик, значение которого берется из другого объекта при каждом чтении метрик
+class CallbackCounter(Gauge):
+    """
+    Счетчик, который ведет другой объект (например, количество отправленных
+    планировщиком запросов); функция получения значения такая же, как у Gauge.
+    """
+
+    kind = 'counter'
+
+
+# Гистограмма
+class Histogram(_Metric):
+    """
+    Распределение длительностей по корзинам с суммой и количеством наблюдений.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Количество в каждой корзине (последняя - +Inf) и сумма значений
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Измеряет длительность блока with и добавляет ее в гистограмму.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = (('le', _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# Реестр метрик
+class Registry:
+    """
+    Набор метрик, которые выводятся вместе в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Добавляет метрику; метрика с тем же именем заменяется.
+
+        Returns:
+            _Metric: Добавленная метрика.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Возвращает все метрики в текстовом формате Prometheus.
+
+        Returns:
+            str: Текст для ответа на запрос /metrics.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Общий реестр и метрики бота
+registry = Registry()
+HANDLER_DURATION = registry.register(Histogram(
+    'tgbot_handler_duration_seconds', 'Длительность обработчиков и функций с декоратором log_function',
+    ('function',)))
+PHASE_DURATION = registry.register(Histogram(
+    'tgbot_phase_duration_seconds', 'Длительность этапов обработки фотографии по операциям',
+    ('operation', 'phase')))
+ERRORS = registry.register(Counter(
+    'tgbot_errors_total', 'Количество ошибок по месту возникновения и типу исключения', ('function', 'type')))
+BYTES = registry.register(Counter(
+    'tgbot_bytes_total', 'Байты, скачанные из Telegram (in) и отправленные в Telegram (out)', ('direction',)))
+
+
+# Функция для измерения этапа обработки
+@contextmanager
+def phase(operation, name):
+    """
+    Измеряет этап обработки фотографии в блоке with: добавляет его длительность
+    в гистограмму и записывает этап как участок текущей трассы.
+
+    Args:
+        operation (str): Название операции (функции обработки).
+        name (str): Этап: 'download', 'admission', 'decode', 'transform', 'encode' или 'upload'.
+    """
+    with tracer.span(name, operation=operation) as span:
+        try:
+            yield
+        finally:
+            PHASE_DURATION.observe(span.duration, operation=operation, phase=name)
+
+
+# Функция для начала этапа, который завершится в другом потоке
+def start_phase(operation, name):
+    """
+    Начинает этап обработки, который завершается не в текущем потоке
+    (например, задача пула процессов).
+
+    Args:
+        operation (str): Название операции.
+        name (str): Этап.
+
+    Returns:
+        function: Функция, завершающая этап; ее можно передать в Future.add_done_callback.
+    """
+    span = tracer.start_span(name, operation=operation)
+
+    def finish(*args):
+        tracer.finish(span)
+        PHASE_DURATION.observe(span.duration, operation=operation, phase=name)
+
+    return finish
+
+
+# Функция для подсчета ошибки
+def count_error(function, error):
+    """
+    Увеличивает счетчик ошибок по месту возникновения и типу исключения.
+
+    Args:
+        function (str): Название функции, в которой возникла или обработана ошибка.
+        error (Exception): Ошибка.
+    """
+    ERRORS.inc(function=function, type=type(error).__name__)
+
+
+# HTTP-сервер метрик
+class MetricsServer:
+    """
+    Отдает метрики реестра в текстовом формате Prometheus по адресу /metrics.
+    Сервер работает в фоновом потоке.
+    """
+
+    def __init__(self, metrics_registry=registry, host='127.0.0.1', port=9464):
+        """
+        Args:
+            metrics_registry (Registry): Реестр метрик.
+            host (str): Адрес сервера.
+            port (int): Порт сервера.
+        """
+        self.registry = metrics_registry
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name='metrics-server')
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                data = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
@@ -0,0 +1,165 @@
+from lut import COLORMAPS, DEFAULT_COLORMAP
+
+
+# Операция бота
+class Operation:
+    """
+    Одна операция бота: ее команда, кнопки, строка справки и функция обработки.
+    Команды, клавиатуры, список команд, справка и шаги конвейера строятся по
+    реестру OPERATIONS, поэтому новый эффект добавляется в одном месте.
+    """
+
+    __slots__ = ('name', 'description', 'group', 'command', 'label', 'button', 'text', 'reply', 'transform',
+                 'args', 'parse', 'pipeline', 'step_param', 'details')
+
+    def __init__(self, name, description, group='image', command=True, label=None, button=None, text=None,
+                 reply=None, transform=None, args=(), parse=None, pipeline=False, step_param=None, details=None):
+        """
+        Args:
+            name (str): Название операции: команда без "/" и данные кнопки.
+            description (str): Описание для списка команд и справки.
+            group (str): Раздел справки: 'basic', 'image' или 'extra'.
+            command (bool): Доступна ли операция командой /name.
+            label (str): Подпись кнопки операции.
+            button (bool): Показывать ли кнопку в клавиатуре вариантов действий с фотографией
+                (по умолчанию - если есть подпись и операция не только шаг конвейера).
+            text (str): Текст кнопки клавиатуры команд, вызывающей операцию.
+            reply (str): Ответ пользователю перед обработкой.
+            transform (str): Название функции обработки из image_ops.TRANSFORMS.
+            args (tuple): Аргументы функции обработки по умолчанию.
+            parse (function): Функция, получающая аргументы из текста после команды.
+            pipeline (bool): Можно ли использовать операцию как шаг конвейера.
+            step_param (str): Описание параметра шага конвейера для справки.
+            details (str): Дополнительное пояснение в справке.
+        """
+        self.name = name
+        self.description = description
+        self.group = group
+        self.command = command
+        self.label = label
+        self.button = button if button is not None else label is not None and command
+        self.text = text
+        self.reply = reply
+        self.transform = transform
+        self.args = args
+        self.parse = parse
+        self.pipeline = pipeline
+        self.step_param = step_param
+        self.details = details
+
+    def get_args(self, text=''):
+        """
+        Возвращает аргументы функции обработки для текста после команды.
+
+        Args:
+            text (str): Текст после команды (пустая строка - аргументы по умолчанию).
+
+        Returns:
+            tuple: Аргументы функции обработки.
+        """
+        return self.parse(text) if self.parse is not None else self.args
+
+
+# Функция для разбора названия палитры тепловой карты
+def parse_colormap(text):
+    """
+    Разбирает название палитры после команды /heatmap, например "/heatmap viridis".
+
+    Args:
+        text (str): Текст после команды (пустая строка - палитра по умолчанию).
+
+    Returns:
+        str: Название палитры из lut.COLORMAPS.
+    """
+    name = text.strip().lower() or DEFAULT_COLORMAP
+    if name not in COLORMAPS:
+        raise ValueError(f"Неизвестная палитра: {name}. Доступные палитры: {', '.join(COLORMAPS)}.")
+    return name
+
+
+# Реестр операций в порядке кнопок и списка команд
+OPERATIONS = {operation.name: operation for operation in (
+    Operation('start', "Начать работу с ботом", group='basic'),
+    Operation('help', "Получить справку", group='basic'),
+    Operation('pixelate', "Пикселизация изображения", label="Пикселизация",
+              reply="Пикселизация вашего изображения...", transform='pixelate_image', args=(20,),
+              pipeline=True, step_param="размер пикселя"),
+    Operation('ascii', "Преобразование изображения в ASCII-арт", label="ASCII-арт",
+              reply="Преобразование вашего изображения в формат ASCII art...",
+              details="Бот попросит ввести набор символов."),
+    Operation('invert', "Инвертировать цвета изображения", label="Инвертировать цвета",
+              reply="Инверсия цветов вашего изображения...", transform='invert_colors', pipeline=True),
+    Operation('mirror_horizontal', "Отразить изображение по горизонтали", label="Отразить по горизонтали",
+              reply="Отражение вашего изображения по горизонтали...", transform='mirror_image',
+              args=('horizontal',), pipeline=True),
+    Operation('mirror_vertical', "Отразить изображение по вертикали", label="Отразить по вертикали",
+              reply="Отражение вашего изображения по вертикали...", transform='mirror_image',
+              args=('vertical',), pipeline=True),
+    Operation('heatmap', "Преобразование изображения в тепловую карту", label="Тепловая карта",
+              reply="Преобразование вашего изображения в тепловую карту...", transform='convert_to_heatmap',
+              parse=lambda text: (parse_colormap(text),), pipeline=True, step_param="палитра",
+              details=f"После команды можно указать палитру: {', '.join(COLORMAPS)} (например, /heatmap viridis)."),
+    # Оттенки серого доступны только как шаг конвейера
+    Operation('grayscale', "Оттенки серого", command=False, label="Оттенки серого", transform='grayify',
+              pipeline=True),
+    Operation('resize_sticker', "Изменить размер изображения для стикера", label="Изменить размер для стикера",
+              reply="Изменение размера изображения для стикера...", transform='resize_for_sticker',
+              pipeline=True, step_param="размер"),
+    Operation('pipeline', "Применить несколько эффектов по порядку", label="Несколько эффектов",
+              reply="Применение эффектов к вашему изображению...",
+              details="Например: /pipeline invert,mirror_horizontal,pixelate:12. "
+                      "Эффекты также можно выбрать кнопкой «Несколько эффектов»."),
+    Operation('random_joke', "Случайная шутка", group='extra', text="Случайная шутка"),
+    Operation('random_compliment', "Случайный комплимент", group='extra', text="Случайный комплимент"),
+    Operation('flip_coin', "Подбросить монетку и получить результат (\"Орел\" или \"Решка\")", group='extra',
+              text="Подбросить монетку"),
+    Operation('commands', "Список команд", group='extra', command=False, text="Список команд"),
+)}
+
+# Разделы справки: группа операций -> заголовок
+HELP_SECTIONS = {
+    'basic': "1. Основные команды",
+    'image': "2. Обработка изображений",
+    'extra': "3. Дополнительные команды",
+}
+
+
+# Функция для получения списка команд
+def get_commands_message():
+    """
+    Возвращает список команд бота с описаниями, по одной команде в строке.
+
+    Returns:
+        str: Текст списка команд.
+    """
+    return ''.join(f"/{operation.name} - {operation.description}\n"
+                   for operation in OPERATIONS.values() if operation.command)
+
+
+# Функция для получения описания шагов конвейера для справки
+def get_pipeline_help():
+    """
+    Возвращает перечень шагов конвейера с параметрами, например "pixelate[:размер пикселя]".
+    """
+    return ', '.join(f"{operation.name}[:{operation.step_param}]" if operation.step_param else operation.name
+                     for operation in OPERATIONS.values() if operation.pipeline)
+
+
+# Функция для получения разделов справки с командами
+def get_help_sections():
+    """
+    Возвращает разделы справки с командами для подстановки в шаблон help.txt.
+
+    Returns:
+        dict: Название раздела ('basic', 'image', 'extra', 'pipeline_steps') -> текст.
+    """
+    sections = {'pipeline_steps': get_pipeline_help()}
+    for group, title in HELP_SECTIONS.items():
+        lines = [title]
+        for operation in OPERATIONS.values():
+            if operation.group != group or not operation.command:
+                continue
+            details = f" {operation.details}" if operation.details else ''
+            lines.append(f"- /{operation.name} - {operation.description}.{details}")
+        sections[group] = '\n'.join(lines)
+    return sections
@@ -0,0 +1,382 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета исходящих запросов: меньше - раньше
+PRIORITY_CALLBACK = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_MEDIA = 2
+PRIORITY_NAMES = {PRIORITY_CALLBACK: 'callback', PRIORITY_MESSAGE: 'message', PRIORITY_MEDIA: 'media'}
+
+# Методы бота, которые проходят через планировщик, и их класс приоритета
+OUTGOING_METHODS = {
+    'answer_callback_query': PRIORITY_CALLBACK,
+    'send_message': PRIORITY_MESSAGE,
+    'edit_message_reply_markup': PRIORITY_MESSAGE,
+    'delete_message': PRIORITY_MESSAGE,
+    'send_chat_action': PRIORITY_MESSAGE,
+    'send_photo': PRIORITY_MEDIA,
+    'send_media_group': PRIORITY_MEDIA,
+    'send_document': PRIORITY_MEDIA,
+    'send_sticker': PRIORITY_MEDIA,
+    'edit_message_media': PRIORITY_MEDIA,
+}
+
+# Количество корзин чатов, после которого неиспользуемые корзины удаляются
+MAX_IDLE_BUCKETS = 10000
+
+
+# Функция для получения времени ожидания из ответа 429 Too Many Requests
+def get_retry_after(error):
+    """
+    Возвращает время, через которое Telegram разрешает повторить запрос.
+
+    Args:
+        error (Exception): Ошибка, возникшая при запросе к Bot API.
+
+    Returns:
+        float | None: Время ожидания в секундах или None, если это не ошибка 429.
+    """
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+# Корзина токенов
+class TokenBucket:
+    """
+    Разрешает не больше rate запросов в секунду в среднем и не больше capacity подряд.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Момент, до которого Telegram попросил не отправлять запросы (retry_after)
+        self.blocked_until = 0.0
+
+    def delay(self, now):
+        """
+        Возвращает время до появления токена (0 - токен есть).
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        # Полная корзина без блокировки ничем не отличается от новой и может быть удалена
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+# Планировщик исходящих запросов
+class OutboundScheduler:
+    """
+    Пропускает исходящие запросы к Bot API с учетом ограничений Telegram:
+    общая корзина токенов (около 30 сообщений в секунду), корзина на каждый
+    личный чат (около 1 сообщения в секунду) и на каждую группу (около 20
+    сообщений в минуту).
+
+    Ожидающие запросы обслуживаются по классу приоритета (ответы на нажатия
+    кнопок раньше текстовых сообщений, текстовые раньше медиа), а внутри
+    класса - по порядку поступления. Ответы на нажатия кнопок не адресованы
+    чату и ограничиваются только общей корзиной. При ответе 429 запрос
+    повторяется после retry_after секунд, а чат (или весь бот) на это время
+    приостанавливается.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_per_minute=20, max_retries=3):
+        """
+        Args:
+            global_rate (float): Общее количество запросов в секунду.
+            chat_rate (float): Количество сообщений в секунду в один личный чат.
+            chat_burst (int): Количество сообщений в личный чат, которые можно отправить подряд.
+            group_per_minute (int): Количество сообщений в минуту в одну группу.
+            max_retries (int): Количество повторов запроса после ответа 429.
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        # Ожидающие запросы (приоритет, порядковый номер, chat_id) по порядку обслуживания
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # Счетчики отправленных, повторенных и отклоненных с ответом 429 запросов
+        self.sent = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def acquire(self, chat_id, priority):
+        """
+        Ждет, пока запрос в чат можно будет отправить, и расходует токены.
+
+        Args:
+            chat_id (int | None): ID чата (None - запрос не адресован чату).
+            priority (int): Класс приоритета.
+        """
+        ticket = (priority, next(self._seq), chat_id)
+        with self._cond:
+            bisect.insort(self._waiting, ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    granted, delay = self._grant(ticket, time.monotonic())
+                    if granted:
+                        return
+                    self._cond.wait(delay)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def call(self, chat_id, priority, func, *args, **kwargs):
+        """
+        Выполняет запрос к Bot API после получения токенов, повторяя его при ответе 429.
+
+        Args:
+            chat_id (int | None): ID чата.
+            priority (int): Класс приоритета.
+            func (function): Метод бота.
+            *args: Аргументы метода.
+            **kwargs: Именованные аргументы метода.
+
+        Returns:
+            Результат метода бота.
+        """
+        streams = _get_streams(args, kwargs)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(chat_id, priority)
+            # Повтор после 429 отправляет файлы с начала, а не с места, где остановилась прошлая попытка
+            _rewind(streams)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                retry_after = get_retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                self._pause(chat_id, retry_after)
+
+    def wrap(self, method, priority):
+        """
+        Возвращает метод бота, выполняющий запросы через планировщик.
+
+        Args:
+            method (function): Метод бота, первым аргументом которого является chat_id.
+            priority (int): Класс приоритета.
+
+        Returns:
+            function: Обертка метода.
+        """
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return self.call(_get_chat_id(priority, args, kwargs), priority, method, *args, **kwargs)
+
+        return wrapper
+
+    def set_global_rate(self, rate):
+        """
+        Меняет общее количество запросов в секунду, например когда бот работает
+        в нескольких процессах и общий предел Telegram делится между ними.
+
+        Args:
+            rate (float): Общее количество запросов в секунду.
+        """
+        with self._cond:
+            self._global = TokenBucket(rate, rate)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Возвращает глубину очереди по классам приоритета и счетчики запросов.
+
+        Returns:
+            dict: Статистика планировщика.
+        """
+        with self._cond:
+            return self._stats()
+
+    def _stats(self):
+        waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, _ in self._waiting:
+            waiting[PRIORITY_NAMES[priority]] += 1
+        return {
+            'waiting': waiting,
+            'sent': self.sent,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'chat_buckets': len(self._chats),
+        }
+
+    def _grant(self, ticket, now):
+        # Первый по приоритету запрос, чат которого готов, получает следующий общий токен
+        wait = None
+        for waiting in self._waiting:
+            bucket = self._bucket(waiting[2])
+            delay = bucket.delay(now) if bucket is not None else 0.0
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if waiting is not ticket:
+                # Токен достанется другому запросу; он разбудит остальных, когда отправит свой
+                return False, wait
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                return False, global_delay
+            self._global.take()
+            if bucket is not None:
+                bucket.take()
+            self.sent += 1
+            return True, 0.0
+        return False, wait
+
+    def _bucket(self, chat_id):
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, value in self._chats.items() if value.idle(now)]:
+                    del self._chats[key]
+            # Отрицательные ID принадлежат группам и каналам
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_per_minute / 60, self.group_per_minute)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _pause(self, chat_id, retry_after):
+        with self._cond:
+            self._block(chat_id, retry_after)
+
+    def _block(self, chat_id, retry_after):
+        self.retries += 1
+        self.rate_limited += 1
+        # Запрос без чата приостанавливает весь бот, запрос в чат - только этот чат
+        bucket = self._bucket(chat_id) or self._global
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+        logger.info(f"Telegram ограничил частоту запросов в чат {chat_id}, повтор через {retry_after} с")
+
+
+# Планировщик исходящих запросов для асинхронного бота
+class AsyncOutboundScheduler(OutboundScheduler):
+    """
+    Тот же планировщик для AsyncTeleBot: запросы ждут своей очереди в цикле
+    событий, не занимая потоков.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed = None
+
+    async def acquire(self, chat_id, priority):
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        ticket = (priority, next(self._seq), chat_id)
+        async with self._changed:
+            bisect.insort(self._waiting, ticket)
+            self._changed.notify_all()
+            try:
+                while True:
+                    granted, delay = self._grant(ticket, time.monotonic())
+                    if granted:
+                        return
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting.remove(ticket)
+                self._changed.notify_all()
+
+    async def call(self, chat_id, priority, func, *args, **kwargs):
+        streams = _get_streams(args, kwargs)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, priority)
+            _rewind(streams)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                retry_after = get_retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                self._block(chat_id, retry_after)
+
+    def wrap(self, method, priority):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await self.call(_get_chat_id(priority, args, kwargs), priority, method, *args, **kwargs)
+
+        return wrapper
+
+    def stats(self):
+        return self._stats()
+
+
+def _get_streams(args, kwargs):
+    # Файлы запроса и их позиции при постановке в очередь: файлы передаются аргументами метода,
+    # внутри InputFile (атрибут file) и внутри InputMedia (атрибут media), в том числе списками для альбомов
+    streams = []
+
+    def collect(value):
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+        elif hasattr(value, 'seek') and hasattr(value, 'tell'):
+            streams.append((value, value.tell()))
+        elif hasattr(value, 'media'):
+            collect(value.media)
+        elif hasattr(value, 'file'):
+            collect(value.file)
+
+    collect(args)
+    collect(list(kwargs.values()))
+    return streams
+
+
+def _rewind(streams):
+    for stream, position in streams:
+        stream.seek(position)
+
+
+def _get_chat_id(priority, args, kwargs):
+    # Ответ на нажатие кнопки адресован запросу, а не чату
+    if priority == PRIORITY_CALLBACK:
+        return None
+    return kwargs['chat_id'] if 'chat_id' in kwargs else (args[0] if args else None)
+
+
+# Функция для подключения планировщика к боту
+def throttle_bot(bot, scheduler):
+    """
+    Направляет исходящие запросы бота (OUTGOING_METHODS) через планировщик.
+    Обработчики продолжают вызывать методы бота как обычно.
+
+    Args:
+        bot (telebot.TeleBot | telebot.async_telebot.AsyncTeleBot): Экземпляр бота.
+        scheduler (OutboundScheduler): Планировщик (AsyncOutboundScheduler для асинхронного бота).
+    """
+    for name, priority in OUTGOING_METHODS.items():
+        method = getattr(bot, name)
+        if inspect.iscoroutinefunction(method) != isinstance(scheduler, AsyncOutboundScheduler):
+            raise TypeError(f"Планировщик {type(scheduler).__name__} не подходит для метода {name}")
+        # Атрибут экземпляра перекрывает метод класса, в том числе при внутренних вызовах (reply_to -> send_message)
+        setattr(bot, name, scheduler.wrap(method, priority))
@@ -0,0 +1,155 @@
+import io
+
+from PIL import Image
+
+# Ограничения Bot API на размер отправляемых файлов
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+TELEGRAM_DOCUMENT_MAX_BYTES = 50 * 1024 * 1024
+# Telegram принимает статичные стикеры WebP не больше 512 КБ
+STICKER_MAX_BYTES = 512 * 1024
+
+# Минимальное качество, до которого снижается качество при подборе размера файла
+MIN_QUALITY = 30
+
+# Параметры по умолчанию для фотографий: JPEG с оптимизацией таблиц Хаффмана и субдискретизацией 4:2:0
+DEFAULT_POLICY = {'format': 'JPEG', 'quality': 85, 'subsampling': 2, 'optimize': True}
+
+# Параметры кодирования по функциям обработки
+OUTPUT_POLICIES = {
+    # Пиксель-арт: PNG с палитрой без размытия границ блоков
+    'pixelate_image': {'format': 'PNG', 'palette': True},
+    # Насыщенные цвета тепловой карты без субдискретизации цветности
+    'convert_to_heatmap': {'format': 'JPEG', 'quality': 85, 'subsampling': 0, 'optimize': True},
+    # Стикер: WebP, отправляется файлом, чтобы его можно было добавить в набор
+    'resize_for_sticker': {'format': 'WEBP', 'quality': 90, 'document': True, 'max_bytes': STICKER_MAX_BYTES},
+}
+
+# Расширения файлов для отправки документом
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+# Функция для выбора параметров кодирования результата
+def get_output_policy(operation, args=(), as_document=False, max_bytes=None):
+    """
+    Возвращает параметры кодирования и отправки результата операции.
+
+    Для конвейера используются параметры последнего шага, у которого они
+    отличаются от параметров по умолчанию (например, пикселизация после инверсии
+    дает PNG, а стикер в конце конвейера - WebP).
+
+    Args:
+        operation (str): Название функции обработки.
+        args (tuple): Аргументы функции обработки.
+        as_document (bool): Отправлять результат документом, без пережатия Telegram.
+        max_bytes (int): Желаемый максимальный размер файла (None - без ограничения).
+
+    Returns:
+        dict: Формат, параметры кодирования, способ отправки ('document') и предел размера ('max_bytes').
+    """
+    if operation == 'run_pipeline':
+        names = [name for name, _ in args[0] if name in OUTPUT_POLICIES]
+        operation = names[-1] if names else None
+    policy = dict(OUTPUT_POLICIES.get(operation, DEFAULT_POLICY))
+    policy['document'] = as_document or policy.get('document', False)
+    # Предел размера - наименьший из желаемого, предела формата и ограничения Telegram
+    limits = [limit for limit in (max_bytes, policy.get('max_bytes')) if limit]
+    limits.append(TELEGRAM_DOCUMENT_MAX_BYTES if policy['document'] else TELEGRAM_PHOTO_MAX_BYTES)
+    policy['max_bytes'] = min(limits)
+    return policy
+
+
+# Функция для получения метки параметров кодирования для ключа кэша
+def get_output_tag(policy):
+    """
+    Возвращает строку, однозначно описывающую параметры кодирования, чтобы
+    результаты с разными параметрами хранились в кэше отдельно.
+    """
+    return ':'.join(f"{key}={policy[key]}" for key in sorted(policy))
+
+
+# Функция для получения имени файла результата
+def get_file_name(policy, name='result'):
+    return f"{name}.{EXTENSIONS[policy['format']]}"
+
+
+# Функция для кодирования изображения с заданным качеством
+def _save(image, policy, quality=None):
+    options = {}
+    if policy['format'] == 'JPEG':
+        # JPEG не хранит прозрачность и палитру
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options = {'quality': quality or policy['quality'], 'subsampling': policy['subsampling'],
+                   'optimize': policy['optimize']}
+    elif policy['format'] == 'WEBP':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        options = {'quality': quality or policy['quality'], 'method': 4}
+    elif policy['format'] == 'PNG':
+        options = {'compress_level': 6}
+    try:
+        return _write(image, policy['format'], options)
+    except OSError:
+        if not options.get('optimize'):
+            raise
+        # Для optimize Pillow выделяет буфер на ширину x высоту байтов; шумное изображение без
+        # субдискретизации может в него не поместиться, тогда кодируем без оптимизации таблиц
+        return _write(image, policy['format'], dict(options, optimize=False))
+
+
+def _write(image, image_format, options):
+    with io.BytesIO() as output_stream:
+        image.save(output_stream, format=image_format, **options)
+        return output_stream.getvalue()
+
+
+# Функция для перевода изображения в палитру
+def _to_palette(image):
+    if image.mode in ('P', 'L', '1'):
+        return image
+    if image.mode != 'RGBA':
+        image = image.convert('RGB')
+    # Не больше 256 цветов медианное сечение передает точно, иначе быстрое октодерево;
+    # без дизеринга блоки пиксель-арта остаются однотонными
+    exact = image.mode == 'RGB' and image.getcolors(256) is not None
+    method = Image.Quantize.MEDIANCUT if exact else Image.Quantize.FASTOCTREE
+    return image.quantize(256, method=method, dither=Image.Dither.NONE)
+
+
+# Функция для кодирования результата обработки
+def encode_image(image, policy):
+    """
+    Кодирует изображение по параметрам из get_output_policy.
+
+    Если файл больше policy['max_bytes'], качество JPEG и WebP подбирается
+    двоичным поиском: выбирается наибольшее качество, при котором файл
+    помещается в предел, но не ниже MIN_QUALITY. PNG при превышении предела
+    переводится в палитру.
+
+    Args:
+        image (PIL.Image): Обработанное изображение.
+        policy (dict): Параметры кодирования.
+
+    Returns:
+        bytes: Закодированное изображение.
+    """
+    if policy.get('palette'):
+        image = _to_palette(image)
+    data = _save(image, policy)
+    max_bytes = policy.get('max_bytes')
+    if max_bytes is None or len(data) <= max_bytes:
+        return data
+    if policy['format'] == 'PNG':
+        return _save(_to_palette(image), policy)
+    best = None
+    low, high = MIN_QUALITY, policy['quality'] - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _save(image, policy, quality)
+        if len(candidate) <= max_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    # Если не помещается даже минимальное качество, отправляем самый маленький вариант
+    return best if best is not None else _save(image, policy, MIN_QUALITY)
@@ -0,0 +1,95 @@
+from lut import COLORMAPS
+from operations import OPERATIONS
+
+# Шаги конвейера из реестра операций: название -> (подпись кнопки, функция обработки, аргументы по умолчанию)
+PIPELINE_STEPS = {name: (operation.label, operation.transform, operation.args)
+                  for name, operation in OPERATIONS.items() if operation.pipeline}
+
+# Допустимые значения числового параметра шага: название -> (минимум, максимум)
+STEP_PARAM_LIMITS = {
+    'pixelate': (2, 200),
+    'resize_sticker': (16, 2048),
+}
+
+# Допустимые значения текстового параметра шага: название -> варианты
+STEP_PARAM_CHOICES = {
+    'heatmap': tuple(COLORMAPS),
+}
+
+# Максимальное количество шагов в одном конвейере
+MAX_PIPELINE_STEPS = 10
+
+
+# Функция для разбора описания конвейера
+def parse_pipeline(text):
+    """
+    Разбирает описание конвейера вида "invert,mirror_horizontal,pixelate:12,heatmap:magma".
+
+    Args:
+        text (str): Названия шагов через запятую, у шага может быть параметр после двоеточия
+            (число или, для тепловой карты, название палитры).
+
+    Returns:
+        tuple: Шаги в виде пар (название функции обработки, аргументы) для run_pipeline.
+    """
+    parts = [part.strip() for part in text.replace(' ', ',').split(',') if part.strip()]
+    if not parts:
+        raise ValueError("Укажите эффекты через запятую, например: /pipeline invert,mirror_horizontal,pixelate:12")
+    if len(parts) > MAX_PIPELINE_STEPS:
+        raise ValueError(f"В конвейере может быть не больше {MAX_PIPELINE_STEPS} эффектов.")
+    steps = []
+    for part in parts:
+        name, _, param = part.partition(':')
+        name = name.lower()
+        if name not in PIPELINE_STEPS:
+            raise ValueError(f"Неизвестный эффект: {name}. Доступные эффекты: {', '.join(PIPELINE_STEPS)}.")
+        _, transform_name, args = PIPELINE_STEPS[name]
+        if param and name in STEP_PARAM_CHOICES:
+            if param.lower() not in STEP_PARAM_CHOICES[name]:
+                raise ValueError(f"Параметр эффекта {name} должен быть одним из: "
+                                 f"{', '.join(STEP_PARAM_CHOICES[name])}.")
+            args = (param.lower(),)
+        elif param:
+            if name not in STEP_PARAM_LIMITS:
+                raise ValueError(f"У эффекта {name} нет параметров.")
+            low, high = STEP_PARAM_LIMITS[name]
+            if not param.isdigit() or not low <= int(param) <= high:
+                raise ValueError(f"Параметр эффекта {name} должен быть целым числом от {low} до {high}.")
+            args = (int(param),)
+        steps.append((transform_name, args))
+    return tuple(steps)
+
+
+# Функция для проверки параметров конвейера по размеру фотографии
+def check_pipeline_size(steps, size):
+    """
+    Проверяет, что размер пикселя в шагах пикселизации не больше фотографии.
+
+    Args:
+        steps (tuple): Шаги из parse_pipeline.
+        size (tuple): Ширина и высота фотографии.
+
+    Raises:
+        ValueError: Размер пикселя больше ширины или высоты фотографии.
+    """
+    low, high = STEP_PARAM_LIMITS['pixelate']
+    limit = min(high, *size)
+    for transform_name, args in steps:
+        if transform_name == PIPELINE_STEPS['pixelate'][1] and args[0] > limit:
+            raise ValueError(f"Параметр эффекта pixelate должен быть целым числом от {low} до {limit}: "
+                             f"размер фотографии {size[0]}x{size[1]}.")
+
+
+# Функция для построения конвейера из выбранных кнопками шагов
+def steps_from_names(names):
+    """
+    Преобразует список названий шагов с параметрами по умолчанию в шаги для run_pipeline.
+
+    Args:
+        names (list): Названия шагов в порядке выбора.
+
+    Returns:
+        tuple: Шаги в виде пар (название функции обработки, аргументы).
+    """
+    return tuple(PIPELINE_STEPS[name][1:] for name in names)
+
@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Расширения файлов дискового уровня для бинарных и текстовых результатов
+_BYTES_SUFFIX = '.bin'
+_TEXT_SUFFIX = '.txt'
+
+
+# Кэш результатов обработки изображений
+class ResultCache:
+    """
+    Двухуровневый кэш готовых результатов обработки изображений.
+
+    Первый уровень хранится в памяти и вытесняет записи по принципу LRU,
+    второй (необязательный) уровень хранится на диске. Оба уровня ограничены
+    бюджетом в байтах. Значением может быть закодированное изображение (bytes)
+    или текст ASCII-арта (str).
+    """
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            max_memory_bytes (int): Бюджет памяти для первого уровня в байтах.
+            disk_dir (str): Каталог для дискового уровня (None - без диска).
+            max_disk_bytes (int): Бюджет дискового уровня в байтах.
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        # Записи первого уровня в порядке использования: ключ -> значение
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Файлы дискового уровня в порядке использования: ключ -> (путь, размер)
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        # Счетчики попаданий и промахов
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(file_unique_id, operation, *args):
+        """
+        Формирует ключ кэша по фотографии, операции и ее параметрам.
+
+        Args:
+            file_unique_id (str): Постоянный уникальный идентификатор файла в Telegram.
+            operation (str): Название функции обработки.
+            *args: Параметры функции обработки.
+
+        Returns:
+            str: Ключ кэша.
+        """
+        raw = repr((file_unique_id, operation, args)).encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+    @staticmethod
+    def _size_of(value):
+        # Текст хранится в UTF-8, поэтому считаем его размер в байтах кодировки
+        return len(value.encode('utf-8')) if isinstance(value, str) else len(value)
+
+    def get(self, key):
+        """
+        Возвращает сохраненный результат или None, если его нет ни на одном уровне.
+
+        Args:
+            key (str): Ключ кэша.
+
+        Returns:
+            bytes | str | None: Сохраненный результат.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            value = self._read_disk(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            # Поднимаем запись с диска в память
+            self._put_memory(key, value)
+            return value
+
+    def put(self, key, value):
+        """
+        Сохраняет результат на всех включенных уровнях.
+
+        Args:
+            key (str): Ключ кэша.
+            value (bytes | str): Закодированное изображение или ASCII-арт.
+        """
+        with self._lock:
+            self._put_memory(key, value)
+            if self.disk_dir:
+                self._write_disk(key, value)
+
+    def stats(self):
+        """
+        Возвращает счетчики и текущую заполненность кэша.
+
+        Returns:
+            dict: Статистика кэша.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def _put_memory(self, key, value):
+        size = self._size_of(value)
+        # Слишком большие значения в память не кладем, чтобы не вытеснить весь уровень
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._size_of(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += size
+        # Вытесняем давно не использованные записи, пока не уложимся в бюджет
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= self._size_of(evicted)
+
+    def _load_disk_index(self):
+        # Восстанавливаем индекс дискового уровня после перезапуска, старые файлы - первыми
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            key, suffix = os.path.splitext(name)
+            if suffix not in (_BYTES_SUFFIX, _TEXT_SUFFIX):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, key, path, stat.st_size))
+        for _, key, path, size in sorted(entries):
+            self._disk[key] = (path, size)
+            self._disk_bytes += size
+        self._trim_disk()
+
+    def _read_disk(self, key):
+        if key not in self._disk:
+            return None
+        path, _ = self._disk[key]
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError as e:
+            logger.error(f"Ошибка при чтении файла кэша {path}: {e}")
+            self._forget_disk(key)
+            return None
+        self._disk.move_to_end(key)
+        # Обновляем время доступа, чтобы порядок LRU сохранился после перезапуска
+        os.utime(path)
+        return data.decode('utf-8') if path.endswith(_TEXT_SUFFIX) else data
+
+    def _write_disk(self, key, value):
+        is_text = isinstance(value, str)
+        data = value.encode('utf-8') if is_text else value
+        if len(data) > self.max_disk_bytes:
+            return
+        path = os.path.join(self.disk_dir, key + (_TEXT_SUFFIX if is_text else _BYTES_SUFFIX))
+        self._forget_disk(key)
+        try:
+            # Пишем во временный файл и переименовываем, чтобы не оставить обрезанную запись
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Ошибка при записи файла кэша {path}: {e}")
+            return
+        self._disk[key] = (path, len(data))
+        self._disk_bytes += len(data)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            key = next(iter(self._disk))
+            self._forget_disk(key)
+
+    def _forget_disk(self, key):
+        entry = self._disk.pop(key, None)
+        if entry is None:
+            return
+        path, size = entry
+        self._disk_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,97 @@
+from operations import OPERATIONS
+
+
+# Функция для получения команды из текста сообщения
+def get_command(text):
+    """
+    Возвращает команду без "/" и упоминания бота ("/invert@bot viridis" -> "invert")
+    или None, если текст не является командой.
+    """
+    if not text or not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0][1:].split('@')[0]
+
+
+# Маршрутизатор обновлений
+class Router:
+    """
+    Выбирает обработчик сообщения или запроса обратного вызова поиском в
+    словарях: по команде, по тексту кнопки клавиатуры команд и по данным
+    кнопки. Стоимость выбора не зависит от количества операций, в отличие
+    от перебора фильтров message_handler по очереди.
+    """
+
+    def __init__(self, operations=OPERATIONS):
+        """
+        Args:
+            operations (dict): Реестр операций, по которому находятся команды и тексты кнопок.
+        """
+        self.operations = operations
+        self._commands = {}
+        self._texts = {}
+        self._callbacks = {}
+        self._fallback = None
+
+    def operation(self, *names):
+        """
+        Регистрирует обработчик сообщений для операций: их команд и текстов
+        кнопок клавиатуры команд из реестра.
+
+        Args:
+            *names (str): Названия операций.
+        """
+        def decorator(handler):
+            for name in names:
+                operation = self.operations[name]
+                if operation.command:
+                    self._commands[name] = handler
+                if operation.text:
+                    self._texts[operation.text] = handler
+            return handler
+        return decorator
+
+    def callback(self, *names):
+        """
+        Регистрирует обработчик запросов обратного вызова. Данные кнопки
+        совпадают с названием целиком или начинаются с "название:".
+
+        Args:
+            *names (str): Данные кнопок.
+        """
+        def decorator(handler):
+            for name in names:
+                self._callbacks[name] = handler
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        """
+        Регистрирует обработчик текстовых сообщений, для которых не нашлось
+        команды или кнопки (например, ввод символов для ASCII-арта).
+        """
+        self._fallback = handler
+        return handler
+
+    def resolve_message(self, message):
+        """
+        Возвращает обработчик текстового сообщения или None.
+
+        Args:
+            message (telebot.types.Message): Сообщение от пользователя.
+        """
+        command = get_command(message.text)
+        if command is not None:
+            return self._commands.get(command)
+        return self._texts.get(message.text, self._fallback)
+
+    def resolve_callback(self, data):
+        """
+        Возвращает обработчик запроса обратного вызова по данным кнопки или None.
+
+        Args:
+            data (str): Данные кнопки (call.data).
+        """
+        handler = self._callbacks.get(data)
+        if handler is None and data and ':' in data:
+            handler = self._callbacks.get(data.partition(':')[0])
+        return handler
@@ -0,0 +1,324 @@
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Хранилище состояний чатов в памяти
+class MemorySessionStore:
+    """
+    Хранит состояние каждого чата (ID фотографий, ожидаемый набор символов для
+    ASCII-арта и т. п.) в виде небольшого словаря.
+
+    Записи устаревают через ttl секунд после последнего изменения и удаляются
+    по очереди устаревания (min-heap) без обращения к Telegram, а при
+    превышении max_entries вытесняются давно не использованные чаты, поэтому
+    объем памяти не растет с числом чатов, когда-либо писавших боту.
+
+    Словари, возвращаемые хранилищем, являются копиями: изменения нужно
+    записывать обратно через store[chat_id] = record или update().
+    """
+
+    def __init__(self, ttl=24 * 60 * 60, max_entries=100000):
+        """
+        Args:
+            ttl (float): Время жизни записи в секундах после последнего изменения.
+            max_entries (int): Максимальное количество чатов в памяти.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # chat_id -> (момент устаревания, запись)
+        self._entries = OrderedDict()
+        # Очередь устаревания (момент устаревания, chat_id); записи после изменения остаются в ней до своего срока
+        self._expiry = []
+        self._lock = threading.RLock()
+
+    def get(self, chat_id, default=None):
+        """
+        Возвращает копию состояния чата.
+
+        Args:
+            chat_id (int): ID чата.
+            default: Значение, возвращаемое при отсутствии записи.
+
+        Returns:
+            dict: Состояние чата или default.
+        """
+        with self._lock:
+            record = self._lookup(chat_id)
+        return dict(record) if record is not None else default
+
+    def update(self, chat_id, **fields):
+        """
+        Изменяет отдельные поля состояния чата, создавая запись при ее отсутствии.
+
+        Args:
+            chat_id (int): ID чата.
+            **fields: Новые значения полей.
+        """
+        with self._lock:
+            record = dict(self._lookup(chat_id) or {})
+            record.update(fields)
+            self._store(chat_id, record)
+
+    def keys(self):
+        """
+        Возвращает ID чатов с неустаревшими записями.
+
+        Returns:
+            list: ID чатов.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [chat_id for chat_id, (expires_at, _) in self._entries.items() if expires_at > now]
+
+    def expire(self):
+        """
+        Удаляет из памяти устаревшие записи без обращения к сети.
+
+        Returns:
+            int: Количество удаленных записей.
+        """
+        with self._lock:
+            return self._expire(time.monotonic())
+
+    def close(self):
+        pass
+
+    def __getitem__(self, chat_id):
+        record = self.get(chat_id)
+        if record is None:
+            raise KeyError(chat_id)
+        return record
+
+    def __setitem__(self, chat_id, record):
+        with self._lock:
+            self._store(chat_id, dict(record))
+
+    def __delitem__(self, chat_id):
+        with self._lock:
+            if self._lookup(chat_id) is None:
+                raise KeyError(chat_id)
+            self._remove(chat_id)
+
+    def pop(self, chat_id, default=None):
+        with self._lock:
+            record = self._lookup(chat_id)
+            if record is None:
+                return default
+            self._remove(chat_id)
+            return record
+
+    def __contains__(self, chat_id):
+        with self._lock:
+            return self._lookup(chat_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _lookup(self, chat_id):
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[chat_id]
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry[1]
+
+    def _store(self, chat_id, record, ttl=None):
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._entries[chat_id] = (expires_at, record)
+        self._entries.move_to_end(chat_id)
+        heapq.heappush(self._expiry, (expires_at, chat_id))
+        # Попутно удаляем устаревшие записи: каждая запись извлекается из очереди один раз
+        self._expire(now)
+        # Вытесняем давно не использованные чаты сверх лимита
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # Перестраиваем очередь, если в ней накопилось много записей об измененных или вытесненных чатах
+        if len(self._expiry) > 2 * len(self._entries) + 1024:
+            self._expiry = [(expires_at, chat_id) for chat_id, (expires_at, _) in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def _expire(self, now):
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, chat_id = heapq.heappop(self._expiry)
+            entry = self._entries.get(chat_id)
+            # Пропускаем записи очереди, устаревшие из-за более позднего изменения
+            if entry is not None and entry[0] == expires_at:
+                del self._entries[chat_id]
+                expired += 1
+        return expired
+
+    def _remove(self, chat_id):
+        del self._entries[chat_id]
+
+
+# Хранилище состояний чатов в SQLite
+class SqliteSessionStore(MemorySessionStore):
+    """
+    Хранит состояния чатов в базе SQLite (режим WAL), чтобы они переживали
+    перезапуск бота и были доступны нескольким процессам.
+
+    Недавно использованные записи держатся в памяти (не больше max_entries),
+    остальные читаются из базы по запросу. Изменения не пишутся в базу сразу:
+    фоновый поток раз в flush_interval секунд сохраняет все накопленные
+    изменения одной транзакцией и удаляет устаревшие записи. len() возвращает
+    количество записей в базе после последней такой транзакции и не обращается
+    к базе, поэтому его можно вызывать при каждом запросе метрик.
+    """
+
+    def __init__(self, path, ttl=24 * 60 * 60, max_entries=100000, flush_interval=1.0):
+        """
+        Args:
+            path (str): Путь к файлу базы данных.
+            ttl (float): Время жизни записи в секундах после последнего изменения.
+            max_entries (int): Максимальное количество чатов в памяти.
+            flush_interval (float): Интервал записи изменений в базу в секундах.
+        """
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL синхронизация NORMAL не повреждает базу при сбое, но может потерять последние транзакции
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'chat_id INTEGER PRIMARY KEY, record TEXT NOT NULL, '
+                         'updated_at REAL NOT NULL, expires_at REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+        self._count = self._db.execute('SELECT COUNT(*) FROM sessions WHERE expires_at > ?',
+                                       (time.time(),)).fetchone()[0]
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Несохраненные изменения: chat_id -> запись или None для удаленной записи
+        self._dirty = {}
+        self._flushing = {}
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='session-flush')
+        self._flusher.start()
+
+    def keys(self):
+        self.flush()
+        with self._db_lock:
+            rows = self._db.execute('SELECT chat_id FROM sessions WHERE expires_at > ?', (time.time(),)).fetchall()
+        return [chat_id for chat_id, in rows]
+
+    def flush(self):
+        """
+        Записывает накопленные изменения в базу одной транзакцией.
+        """
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            # Пока транзакция не завершена, чтение видит эти изменения здесь, а не в базе
+            self._flushing = dirty
+        if not dirty:
+            return
+        now = time.time()
+        upserts = [(chat_id, json.dumps(record, separators=(',', ':'), ensure_ascii=False), now, now + self.ttl)
+                   for chat_id, record in dirty.items() if record is not None]
+        deletes = [(chat_id,) for chat_id, record in dirty.items() if record is None]
+        try:
+            with self._db_lock, self._db:
+                self._db.execute('BEGIN')
+                self._db.executemany('INSERT INTO sessions (chat_id, record, updated_at, expires_at) '
+                                     'VALUES (?, ?, ?, ?) ON CONFLICT(chat_id) DO UPDATE SET '
+                                     'record = excluded.record, updated_at = excluded.updated_at, '
+                                     'expires_at = excluded.expires_at', upserts)
+                self._db.executemany('DELETE FROM sessions WHERE chat_id = ?', deletes)
+                self._db.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+                count = self._db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        except Exception:
+            # Возвращаем изменения, если за это время их не перезаписали более новыми
+            with self._lock:
+                for chat_id, record in dirty.items():
+                    self._dirty.setdefault(chat_id, record)
+                self._flushing = {}
+            raise
+        with self._lock:
+            self._flushing = {}
+            self._count = count
+
+    def close(self):
+        """
+        Останавливает фоновую запись, сохраняет изменения и закрывает базу.
+        """
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        self._db.close()
+
+    def __len__(self):
+        # Количество записей на момент последнего сохранения: отстает от памяти не больше чем на flush_interval
+        return self._count
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.expire()
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояний чатов в {self.path}: {e}")
+
+    def _lookup(self, chat_id):
+        record = super()._lookup(chat_id)
+        if record is not None:
+            return record
+        pending = self._dirty if chat_id in self._dirty else self._flushing
+        if chat_id in pending:
+            # Запись уже вытеснена из памяти или удалена, но изменение еще не записано в базу
+            record = pending[chat_id]
+        else:
+            with self._db_lock:
+                row = self._db.execute('SELECT record, expires_at FROM sessions WHERE chat_id = ? AND expires_at > ?',
+                                       (chat_id, time.time())).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            # Поднимаем запись в память с оставшимся сроком жизни
+            super()._store(chat_id, record, row[1] - time.time())
+        return record
+
+    def _store(self, chat_id, record, ttl=None):
+        super()._store(chat_id, record, ttl)
+        if ttl is None:
+            self._dirty[chat_id] = record
+
+    def _remove(self, chat_id):
+        self._entries.pop(chat_id, None)
+        self._dirty[chat_id] = None
+
+
+# Функция для создания хранилища состояний чатов по названию
+def create_session_store(kind, path=None, ttl=24 * 60 * 60, max_entries=100000, flush_interval=1.0):
+    """
+    Создает хранилище состояний чатов.
+
+    Args:
+        kind (str): 'memory' - только в памяти, 'sqlite' - в базе SQLite с кэшем в памяти.
+        path (str): Путь к файлу базы данных для 'sqlite'.
+        ttl (float): Время жизни записи в секундах после последнего изменения.
+        max_entries (int): Максимальное количество чатов в памяти.
+        flush_interval (float): Интервал записи изменений в базу в секундах.
+
+    Returns:
+        MemorySessionStore: Хранилище.
+    """
+    if kind == 'memory':
+        return MemorySessionStore(ttl, max_entries)
+    if kind == 'sqlite':
+        return SqliteSessionStore(path, ttl, max_entries, flush_interval)
+    raise ValueError(f"Неизвестный тип хранилища состояний: {kind}")
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateRequestError(Exception):
+    """
+    Такой же запрос того же получателя уже выполняется, и его результат будет доставлен один раз.
+    """
+
+
+# Объединение одинаковых запросов
+class SingleFlight:
+    """
+    Выполняет одну задачу на ключ одновременно.
+
+    Первый запрос с ключом выполняет задачу, а одинаковые запросы,
+    пришедшие до ее завершения, не запускают свою: они дожидаются результата
+    (или ошибки) первого. Так двойное нажатие кнопки или один и тот же эффект
+    для одной фотографии из нескольких чатов скачивается и обрабатывается
+    один раз, а результат получает каждый ожидающий чат. После завершения
+    задачи ключ освобождается; повторные запросы обслуживает кэш результатов.
+
+    Если у запроса указан получатель (scope), например ID чата, то запрос
+    получателя, который уже ждет задачу с этим ключом, не получает вторую копию
+    результата: он сразу завершается ошибкой DuplicateRequestError.
+
+    Запросы объединяются внутри одного процесса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Выполняющиеся задачи: ключ -> (Future с результатом, получатели ожидающих запросов)
+        self._calls = {}
+        # Количество выполненных задач, запросов, дождавшихся чужой задачи, и отклоненных повторов
+        self.started = 0
+        self.joined = 0
+        self.duplicates = 0
+
+    def run(self, key, func, *args, scope=None):
+        """
+        Выполняет func(*args) или дожидается уже выполняющейся задачи с тем же ключом.
+
+        Args:
+            key (str | None): Ключ задачи (None - выполнить без объединения).
+            func (function): Функция задачи.
+            *args: Аргументы функции.
+            scope: Получатель результата, например ID чата (None - без проверки повторов).
+
+        Returns:
+            Результат функции; ошибка функции передается всем ожидающим запросам.
+        """
+        if key is None:
+            return func(*args)
+        future, leader = self._join(key, Future, scope)
+        if not leader:
+            logger.info(f"Запрос присоединяется к выполняющейся задаче {key}")
+            return future.result()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        """
+        Возвращает количество выполняющихся задач и счетчики запросов.
+
+        Returns:
+            dict: Статистика объединения запросов.
+        """
+        with self._lock:
+            return {'in_flight': len(self._calls), 'started': self.started, 'joined': self.joined,
+                    'duplicates': self.duplicates}
+
+    def _join(self, key, new_future, scope):
+        # Возвращает Future задачи с ключом и признак того, что задачу выполняет вызывающий
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                future = new_future()
+                self._calls[key] = (future, {scope})
+                self.started += 1
+                return future, True
+            future, scopes = call
+            if scope is not None and scope in scopes:
+                self.duplicates += 1
+                raise DuplicateRequestError(f"Запрос {key} для {scope} уже выполняется")
+            scopes.add(scope)
+            self.joined += 1
+            return future, False
+
+
+# Объединение одинаковых запросов для асинхронного бота
+class AsyncSingleFlight(SingleFlight):
+    """
+    Вариант SingleFlight для цикла событий: func - корутинная функция, а
+    ожидающие запросы не блокируют поток.
+    """
+
+    async def run(self, key, func, *args, scope=None):
+        if key is None:
+            return await func(*args)
+        future, leader = self._join(key, asyncio.get_running_loop().create_future, scope)
+        if not leader:
+            logger.info(f"Запрос присоединяется к выполняющейся задаче {key}")
+            # Отмена одного ожидающего обработчика не должна отменять общий результат
+            return await asyncio.shield(future)
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку получает сам запрос; без ожидающих запросов asyncio не должен сообщать о непрочитанной ошибке
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,291 @@
+import asyncio
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+# Запись кэша исходных изображений
+class _SourceEntry:
+    __slots__ = ('data', 'image', 'size', 'expires_at')
+
+    def __init__(self, data, image, expires_at):
+        self.data = data
+        self.image = image
+        # Размер записи: скачанные байты плюс несжатые пиксели, если изображение декодировано
+        self.size = len(data) + (_decoded_size(image) if image is not None else 0)
+        self.expires_at = expires_at
+
+
+def _decoded_size(image):
+    # Оцениваем объем памяти несжатого изображения: ширина * высота * число каналов
+    return image.width * image.height * len(image.getbands())
+
+
+def _reduce(image, decode_size):
+    # Уменьшаем изображение целым коэффициентом, сохраняя размер не меньше decode_size
+    factor = min(image.width // decode_size[0], image.height // decode_size[1])
+    return image.reduce(factor) if factor >= 2 else image
+
+
+# Кэш скачанных исходных изображений
+class SourceCache:
+    """
+    Кэш скачанных (и, при необходимости, декодированных) исходных фотографий.
+
+    Записи хранятся по file_id, вытесняются по принципу LRU при превышении
+    бюджета в байтах и устаревают через заданное время (TTL). Одновременные
+    запросы одной и той же фотографии приводят только к одному скачиванию.
+    """
+
+    def __init__(self, loader, max_bytes=128 * 1024 * 1024, ttl=30 * 60, cache_decoded=False, prefetch_workers=4):
+        """
+        Args:
+            loader (function): Функция, скачивающая файл по file_id и возвращающая bytes.
+            max_bytes (int): Бюджет кэша в байтах.
+            ttl (float): Время жизни записи в секундах.
+            cache_decoded (bool): Хранить ли вместе с байтами декодированное изображение.
+            prefetch_workers (int): Количество потоков для предварительной загрузки (0 - без пула потоков).
+        """
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_decoded = cache_decoded
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Скачивания, которые выполняются прямо сейчас: file_id -> threading.Event
+        self._in_flight = {}
+        self._prefetch_pool = (ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='prefetch')
+                               if prefetch_workers else None)
+        # Счетчики попаданий, промахов и скачиваний
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+
+    def get_bytes(self, file_id):
+        """
+        Возвращает байты исходного файла, скачивая его при отсутствии в кэше.
+
+        Args:
+            file_id (str): ID файла в Telegram.
+
+        Returns:
+            bytes: Содержимое файла.
+        """
+        return self._get_entry(file_id).data
+
+    def get_image(self, file_id, decode_size=None):
+        """
+        Возвращает декодированное исходное изображение.
+
+        Если включено хранение декодированных изображений, возвращается копия
+        сохраненного изображения, иначе изображение декодируется из кэшированных байтов.
+        При указанном decode_size JPEG декодируется в уменьшенном масштабе (1/2, 1/4
+        или 1/8), а остальные форматы уменьшаются целым коэффициентом, но не меньше decode_size.
+
+        Args:
+            file_id (str): ID файла в Telegram.
+            decode_size (tuple): Минимальный достаточный размер изображения (None - полный размер).
+
+        Returns:
+            PIL.Image: Исходное изображение.
+        """
+        return self._entry_image(self._get_entry(file_id), decode_size)
+
+    def get_size(self, file_id):
+        """
+        Возвращает размер исходного изображения, читая только заголовок файла.
+
+        Args:
+            file_id (str): ID файла в Telegram.
+
+        Returns:
+            tuple: Ширина и высота изображения.
+        """
+        return self._entry_size(self._get_entry(file_id))
+
+    def prefetch(self, file_id):
+        """
+        Запускает скачивание файла в фоне, не дожидаясь результата.
+
+        Args:
+            file_id (str): ID файла в Telegram.
+        """
+        self._prefetch_pool.submit(self._prefetch, file_id)
+
+    def stats(self):
+        """
+        Возвращает счетчики и текущую заполненность кэша.
+
+        Returns:
+            dict: Статистика кэша.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _prefetch(self, file_id):
+        try:
+            self._get_entry(file_id)
+        except Exception as e:
+            # Ошибка фоновой загрузки не критична: файл будет скачан повторно при обработке
+            logger.error(f"Ошибка при предварительной загрузке файла {file_id}: {e}")
+
+    def _get_entry(self, file_id):
+        while True:
+            entry, event, leader = self._claim(file_id, threading.Event)
+            if entry is not None:
+                return entry
+            if leader:
+                break
+            event.wait()
+        try:
+            data = self.loader(file_id)
+            return self._add(file_id, data, self._decode(data) if self.cache_decoded else None)
+        finally:
+            self._finish(file_id)
+            event.set()
+
+    def _claim(self, file_id, new_waiter):
+        # Возвращает запись кэша или объект ожидания скачивания; leader - True, если файл скачивает вызывающий
+        with self._lock:
+            entry = self._lookup(file_id)
+            if entry is not None:
+                self.hits += 1
+                return entry, None, False
+            waiter = self._in_flight.get(file_id)
+            if waiter is not None:
+                return None, waiter, False
+            # Этот вызов скачивает файл, остальные ждут его результата
+            self.misses += 1
+            waiter = self._in_flight[file_id] = new_waiter()
+            return None, waiter, True
+
+    def _add(self, file_id, data, image):
+        entry = _SourceEntry(data, image, time.monotonic() + self.ttl)
+        with self._lock:
+            self.downloads += 1
+            self._store(file_id, entry)
+        return entry
+
+    def _finish(self, file_id):
+        with self._lock:
+            del self._in_flight[file_id]
+
+    def _entry_image(self, entry, decode_size):
+        if entry.image is not None:
+            image = _reduce(entry.image, decode_size) if decode_size else entry.image
+            # Отдаем копию, чтобы функции обработки не изменили сохраненное изображение
+            return image.copy() if image is entry.image else image
+        return self._decode(entry.data, decode_size)
+
+    @staticmethod
+    def _entry_size(entry):
+        if entry.image is not None:
+            return entry.image.size
+        return Image.open(io.BytesIO(entry.data)).size
+
+    @staticmethod
+    def _decode(data, decode_size=None):
+        image = Image.open(io.BytesIO(data))
+        if decode_size:
+            # Для JPEG выбираем масштаб декодирования, при котором изображение не меньше decode_size
+            image.draft(None, decode_size)
+        # Декодируем сразу, а не лениво при первом обращении к пикселям
+        image.load()
+        return _reduce(image, decode_size) if decode_size else image
+
+    def _lookup(self, file_id):
+        entry = self._entries.get(file_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(file_id)
+            return None
+        self._entries.move_to_end(file_id)
+        return entry
+
+    def _store(self, file_id, entry):
+        if entry.size > self.max_bytes:
+            return
+        if file_id in self._entries:
+            self._remove(file_id)
+        self._entries[file_id] = entry
+        self._bytes += entry.size
+        # Сначала удаляем устаревшие записи, затем давно не использованные
+        now = time.monotonic()
+        for key in [key for key, value in self._entries.items() if value.expires_at <= now]:
+            self._remove(key)
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, file_id):
+        entry = self._entries.pop(file_id)
+        self._bytes -= entry.size
+
+
+# Кэш скачанных исходных изображений для асинхронного бота
+class AsyncSourceCache(SourceCache):
+    """
+    Вариант SourceCache для цикла событий: loader - корутинная функция,
+    get_bytes, get_image, get_size и prefetch - корутины, и запросы,
+    ожидающие чужого скачивания, не блокируют поток. Декодирование
+    выполняется в пуле потоков цикла событий.
+    """
+
+    def __init__(self, loader, max_bytes=128 * 1024 * 1024, ttl=30 * 60, cache_decoded=False):
+        super().__init__(loader, max_bytes, ttl, cache_decoded, prefetch_workers=0)
+        # Задачи предварительной загрузки: цикл событий хранит только слабые ссылки на задачи
+        self._prefetch_tasks = set()
+
+    async def get_bytes(self, file_id):
+        return (await self._get_entry(file_id)).data
+
+    async def get_image(self, file_id, decode_size=None):
+        entry = await self._get_entry(file_id)
+        return await asyncio.to_thread(self._entry_image, entry, decode_size)
+
+    async def get_size(self, file_id):
+        return self._entry_size(await self._get_entry(file_id))
+
+    async def prefetch(self, file_id):
+        task = asyncio.create_task(self._prefetch(file_id))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+
+    async def _prefetch(self, file_id):
+        try:
+            await self._get_entry(file_id)
+        except Exception as e:
+            # Ошибка фоновой загрузки не критична: файл будет скачан повторно при обработке
+            logger.error(f"Ошибка при предварительной загрузке файла {file_id}: {e}")
+
+    async def _get_entry(self, file_id):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry, future, leader = self._claim(file_id, loop.create_future)
+            if entry is not None:
+                return entry
+            if leader:
+                break
+            # Отмена одного ожидающего обработчика не должна отменять общее скачивание
+            await asyncio.shield(future)
+        try:
+            data = await self.loader(file_id)
+            image = await asyncio.to_thread(self._decode, data) if self.cache_decoded else None
+            return self._add(file_id, data, image)
+        finally:
+            self._finish(file_id)
+            future.set_result(None)
@@ -0,0 +1,225 @@
+import collections
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество участков в одной трассе: остальные не сохраняются
+MAX_SPANS_PER_TRACE = 1000
+
+# Текущий участок трассы; contextvars разделяет его между потоками и задачами asyncio
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+# Трасса одного запроса
+class Trace:
+    """
+    Все участки, выполненные при обработке одного обновления.
+    """
+
+    __slots__ = ('trace_id', 'sampled', 'spans', 'dropped')
+
+    def __init__(self, sampled):
+        self.trace_id = f"{random.getrandbits(64):016x}"
+        # Участки выборочных трасс записываются в журнал по мере завершения
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+
+    def to_dict(self):
+        """
+        Возвращает трассу в виде словаря для сохранения в JSON.
+
+        Returns:
+            dict: ID трассы, длительность и завершенные участки в порядке начала.
+        """
+        spans = sorted(self.spans, key=lambda span: span.start)
+        origin = spans[0].start if spans else 0.0
+        root = next((span for span in spans if span.parent is None), None)
+        return {
+            'trace_id': self.trace_id,
+            'duration_ms': root.duration * 1000 if root is not None else None,
+            'dropped_spans': self.dropped,
+            'spans': [span.to_dict(origin) for span in spans],
+        }
+
+
+# Участок трассы
+class Span:
+    """
+    Один вызов функции или этап обработки внутри трассы.
+    """
+
+    __slots__ = ('name', 'trace', 'parent', 'span_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, trace, parent, attributes):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.span_id = id(self)
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def user_id(self):
+        """
+        Возвращает ID пользователя участка или ближайшего родительского участка.
+        """
+        span = self
+        while span is not None:
+            user_id = span.attributes.get('user_id')
+            if user_id is not None:
+                return user_id
+            span = span.parent
+        return None
+
+    def to_dict(self, origin):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent is not None else None,
+            'start_ms': (self.start - origin) * 1000,
+            'duration_ms': self.duration * 1000,
+            'attributes': {key: str(value) for key, value in self.attributes.items()},
+            'error': self.error,
+        }
+
+
+# Отложенная сериализация трассы: JSON строится, только если запись действительно попадет в журнал
+class _LazyJson:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False)
+
+
+# Трассировщик
+class Tracer:
+    """
+    Собирает вложенные участки (обработчик -> process_image -> обработка)
+    в трассы. Участки записываются всегда: это дешевле, чем строка журнала,
+    и позволяет сохранить медленный запрос целиком. В журнал попадают только
+    выборочные трассы (доля sample_rate) и трассы медленнее slow_threshold
+    секунд; последние также сохраняются в JSON.
+    """
+
+    def __init__(self, sample_rate=0.1, slow_threshold=5.0, dump_dir=None, keep_slow=100):
+        """
+        Args:
+            sample_rate (float): Доля трасс, участки которых записываются в журнал.
+            slow_threshold (float): Длительность трассы в секундах, после которой она считается медленной
+                (None - не сохранять медленные трассы).
+            dump_dir (str): Каталог для JSON-файлов медленных трасс (None - только журнал).
+            keep_slow (int): Количество последних медленных трасс, хранимых в памяти.
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.dump_dir = dump_dir
+        # Последние медленные трассы в виде словарей
+        self.slow_traces = collections.deque(maxlen=keep_slow)
+        self._dump_lock = threading.Lock()
+
+    def configure(self, sample_rate=None, slow_threshold=None, dump_dir=None):
+        """
+        Меняет настройки трассировщика (None - оставить прежнее значение).
+        """
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if dump_dir is not None:
+            self.dump_dir = dump_dir
+
+    def start_span(self, name, **attributes):
+        """
+        Начинает участок, вложенный в текущий, но не делает его текущим.
+        Участок завершается вызовом finish; так измеряются этапы, которые
+        заканчиваются в другом потоке (например, задачи пула процессов).
+
+        Args:
+            name (str): Название участка.
+            **attributes: Атрибуты участка (например, user_id или operation).
+
+        Returns:
+            Span: Начатый участок.
+        """
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else Trace(random.random() < self.sample_rate)
+        return Span(name, trace, parent, attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Выполняет блок with как текущий участок трассы.
+
+        Args:
+            name (str): Название участка.
+            **attributes: Атрибуты участка.
+        """
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def finish(self, span):
+        """
+        Завершает участок и, если это корень трассы, проверяет ее длительность.
+        """
+        span.end = time.perf_counter()
+        trace = span.trace
+        if len(trace.spans) < MAX_SPANS_PER_TRACE:
+            trace.spans.append(span)
+        else:
+            trace.dropped += 1
+        if trace.sampled:
+            # Аргументы форматируются, только если уровень INFO включен
+            logger.info("Трасса %s: пользователь с ID %s %s, %.1f мс%s", trace.trace_id, span.user_id,
+                        span.attributes.get('action', span.name), span.duration * 1000,
+                        f", ошибка {span.error}" if span.error else '')
+        if span.parent is None and self.slow_threshold is not None and span.duration >= self.slow_threshold:
+            self._dump(trace)
+
+    def current(self):
+        """
+        Возвращает текущий участок или None вне трассы.
+        """
+        return _current_span.get()
+
+    def _dump(self, trace):
+        data = trace.to_dict()
+        self.slow_traces.append(data)
+        logger.warning("Медленный запрос %.0f мс: %s", data['duration_ms'], _LazyJson(data))
+        if self.dump_dir is None:
+            return
+        try:
+            with self._dump_lock:
+                os.makedirs(self.dump_dir, exist_ok=True)
+                with open(os.path.join(self.dump_dir, f"trace-{trace.trace_id}.json"), 'w', encoding='utf-8') as file:
+                    json.dump(data, file, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить трассу {trace.trace_id} в {self.dump_dir}: {e}")
+
+
+# Общий трассировщик бота
+tracer = Tracer()
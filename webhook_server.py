@@ -0,0 +1,152 @@
+import hmac
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секретный токен вебхука
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Максимальный размер тела запроса в байтах: обновление Telegram занимает несколько килобайт
+MAX_BODY_SIZE = 256 * 1024
+
+
+# Встроенный HTTP-сервер для приема обновлений через вебхук
+class WebhookServer:
+    """
+    Принимает обновления Telegram по HTTP, проверяет секретный токен и ставит
+    обновления в очередь. Ответ отправляется сразу после постановки в очередь,
+    а сами обновления передаются обработчикам в отдельных потоках. Если
+    передан accept, он сохраняет обновление (например, в журнал) в потоке
+    запроса до ответа 200: Telegram не повторяет обновление, на которое
+    получил 200, и оно не должно существовать только в памяти.
+    """
+
+    def __init__(self, process_update, host='127.0.0.1', port=8443, path='/webhook', secret_token=None,
+                 workers=2, queue_size=1000, max_body_size=MAX_BODY_SIZE, accept=None):
+        """
+        Args:
+            process_update (function): Функция, принимающая JSON обновления в виде bytes
+                (или результат accept, если он передан).
+            host (str): Адрес, на котором слушает сервер.
+            port (int): Порт сервера.
+            path (str): Путь, по которому Telegram отправляет обновления.
+            secret_token (str): Секретный токен вебхука (None - без проверки).
+            workers (int): Количество потоков, передающих обновления обработчикам.
+            queue_size (int): Максимальное количество обновлений в очереди.
+            max_body_size (int): Максимальный размер тела запроса в байтах; больший запрос отклоняется с кодом 413.
+            accept (function): Функция accept(data), которая сохраняет обновление до ответа 200 и возвращает
+                значение для очереди (None - в очередь ставится само тело запроса).
+        """
+        self.process_update = process_update
+        self.accept = accept
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body_size = max_body_size
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f'webhook-worker-{i}')
+                         for i in range(workers)]
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        """
+        Возвращает адрес и порт, на которых слушает сервер.
+        """
+        return self._server.server_address
+
+    def serve_forever(self):
+        """
+        Запускает потоки обработки и принимает запросы до вызова shutdown.
+        """
+        for worker in self._workers:
+            worker.start()
+        logger.info(f"Прием обновлений через вебхук на {self.address[0]}:{self.address[1]}{self.path}")
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """
+        Останавливает прием запросов и дожидается передачи обработчикам уже
+        принятых обновлений: Telegram получил на них ответ 200 и не пришлет их снова.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if any(worker.is_alive() for worker in self._workers):
+            self.updates.join()
+
+    def _work(self):
+        while True:
+            data = self.updates.get()
+            try:
+                self.process_update(data)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления из вебхука: {e}")
+            finally:
+                self.updates.task_done()
+
+    def _check_secret(self, headers):
+        if self.secret_token is None:
+            return True
+        received = headers.get(SECRET_TOKEN_HEADER, '')
+        # Сравнение за постоянное время, чтобы токен нельзя было подобрать по времени ответа
+        return hmac.compare_digest(received.encode('utf-8'), self.secret_token.encode('utf-8'))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if not server._check_secret(self.headers):
+                    logger.error(f"Отклонен запрос к вебхуку с неверным секретным токеном от {self.client_address[0]}")
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    length = 0
+                if length <= 0:
+                    self._reply(400)
+                    return
+                if length > server.max_body_size:
+                    # Тело не читаем: соединение закрывается после ответа
+                    logger.error(f"Отклонен запрос к вебхуку размером {length} байт от {self.client_address[0]}")
+                    self.close_connection = True
+                    self._reply(413)
+                    return
+                data = self.rfile.read(length)
+                if server.accept is not None:
+                    try:
+                        data = server.accept(data)
+                    except ValueError as e:
+                        logger.error(f"Отклонено некорректное обновление из вебхука: {e}")
+                        self._reply(400)
+                        return
+                    except Exception as e:
+                        # Обновление не сохранено: Telegram повторит доставку, если ответ не 2xx
+                        logger.error(f"Ошибка при сохранении обновления из вебхука: {e}")
+                        self._reply(500)
+                        return
+                try:
+                    server.updates.put_nowait(data)
+                except queue.Full:
+                    # Telegram повторит доставку обновления, если ответ не 2xx
+                    logger.error("Очередь обновлений вебхука заполнена")
+                    self._reply(503)
+                    return
+                self._reply(200)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Журнал доступа пишем в общий логгер, а не в stderr
+                logger.debug(format % args)
+
+        return Handler